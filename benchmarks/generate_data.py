@@ -0,0 +1,215 @@
+# encoding: utf8
+#!/usr/bin/env python3
+"""
+生成用来做 benchmark 的 csv / txt 文件, 数据里带有 move_to_database.py 需要处理的各种脏数据:
+行中间的 \r 和 \r\n 换行, 引号和反斜杠, 列数不对的行, 超过 300 个字符的字段, 超过 csv 模块字段长度限制的字段,
+以及重复的行. 相同的参数和 seed 生成完全相同的文件
+
+Usage example:
+'''
+python3 benchmarks/generate_data.py --rows 1M --type both --output-dir /tmp/bench
+'''
+"""
+import os
+import sys
+import json
+import random
+import argparse
+from collections import Counter
+
+COLUMNS = ['id', 'name', 'email', 'phone', 'city', 'note', 'created_at']
+# txt 文件的分隔符, 对应 move_to_database.py 的 -F
+TXT_SEPARATOR = '|'
+# csv 模块默认的字段长度限制是 131072, 超过就会 _csv.Error: field larger than field limit
+OVERSIZE_LENGTH = 140000
+# 超过 varchar(300) 的字段长度范围
+LONG_FIELD_LENGTH = (301, 2000)
+# 重复的行从最近的这么多行里面选
+RECENT_ROWS = 1024
+# 每次写文件的行数
+WRITE_ROWS = 10000
+
+NAMES = ['Li Lei', 'Han Meimei', 'Zhang Wei', 'Wang Fang', 'John Smith', 'Maria Garcia', 'Chen Jing', 'Liu Yang']
+CITIES = ['Beijing', 'Shanghai', 'Guangzhou', 'Shenzhen', 'Hangzhou', 'Chengdu', 'New York', 'Berlin']
+NOTES = ['', 'vip', 'new customer', 'call back later', 'paid', 'refund requested']
+# 引号和反斜杠, csv 按 QUOTE_NONE 读取, 带逗号的会多出一列
+QUOTED_VALUES = ['O\'Brien "Bob"', 'C:\\data\\dump\\', '\\N', '"quoted, with comma"', 'back\\slash \\"escaped\\"']
+DIRT_KINDS = ('carriage_return', 'quotes_backslashes', 'ragged', 'long_field')
+
+
+def parse_count(value):
+    """
+    解析行数, 支持 K / M 后缀, 例如 1M, 50M, 500K
+
+    :param value: 字符串
+    :return: int
+    """
+
+    value = value.strip().upper()
+    multiplier = 1
+    if value.endswith('K'):
+        multiplier, value = 1000, value[:-1]
+    elif value.endswith('M'):
+        multiplier, value = 1000 * 1000, value[:-1]
+    try:
+        count = int(float(value) * multiplier)
+    except ValueError:
+        raise argparse.ArgumentTypeError('invalid row count "{}", for example 1M or 500K'.format(value))
+    if count < 1:
+        raise argparse.ArgumentTypeError('row count must be positive')
+    return count
+
+
+def clean_row(rng, index):
+    """一行正常的数据"""
+    name = rng.choice(NAMES)
+    return [
+        str(index),
+        name,
+        '{}{}@example.com'.format(name.split()[0].lower(), index),
+        '1{:010d}'.format(rng.randrange(10 ** 10)),
+        rng.choice(CITIES),
+        rng.choice(NOTES),
+        '20{:02d}-{:02d}-{:02d} {:02d}:{:02d}:{:02d}'.format(rng.randrange(10, 25), rng.randrange(1, 13),
+                                                          rng.randrange(1, 29), rng.randrange(24),
+                                                          rng.randrange(60), rng.randrange(60)),
+    ]
+
+
+def make_dirty(rng, row, kind):
+    """
+    给一行数据加上一种脏数据
+
+    :param rng: random.Random 对象
+    :param row: 数据列表, 会被修改
+    :param kind: DIRT_KINDS 中的一种
+    :return: 修改之后的数据列表
+    """
+
+    if kind == 'carriage_return':
+        # 字段中间的 ^M
+        column = rng.randrange(1, len(row))
+        row[column] = row[column][:1] + '\r' + row[column][1:]
+    elif kind == 'quotes_backslashes':
+        row[rng.choice([1, 5])] = rng.choice(QUOTED_VALUES)
+    elif kind == 'ragged':
+        if rng.random() < 0.5:
+            row = row[:rng.randrange(1, len(row))]
+        else:
+            row = row + ['extra'] * rng.randrange(1, 3)
+    elif kind == 'long_field':
+        row[5] = 'x' * rng.randrange(*LONG_FIELD_LENGTH)
+    return row
+
+
+def generate_rows(rows, seed=0, dirty_ratio=0.01, duplicate_ratio=0.01, oversize_every=0, dirt=None):
+    """
+    生成数据行
+
+    :param rows: 行数, 不包括列名
+    :param seed: 随机数种子
+    :param dirty_ratio: 带脏数据的行的比例
+    :param duplicate_ratio: 重复前面某一行的比例
+    :param oversize_every: 每隔这么多行有一个超过 csv 字段长度限制的字段, 0 为没有
+    :param dirt: Counter 对象, 记录每种脏数据的行数
+    :return: 生成器, 每次返回一个数据列表
+    """
+
+    rng = random.Random(seed)
+    dirt = dirt if dirt is not None else Counter()
+    recent = []
+    for index in range(1, rows + 1):
+        if recent and rng.random() < duplicate_ratio:
+            dirt['duplicate'] += 1
+            yield rng.choice(recent)
+            continue
+
+        row = clean_row(rng, index)
+        if oversize_every and index % oversize_every == 0:
+            row[5] = 'y' * OVERSIZE_LENGTH
+            dirt['oversize_field'] += 1
+        elif rng.random() < dirty_ratio:
+            kind = rng.choice(DIRT_KINDS)
+            row = make_dirty(rng, row, kind)
+            dirt[kind] += 1
+
+        if len(recent) < RECENT_ROWS:
+            recent.append(row)
+        else:
+            recent[rng.randrange(RECENT_ROWS)] = row
+        yield row
+
+
+def write_dump(path, rows, file_type='csv', separator=TXT_SEPARATOR, **kwargs):
+    """
+    生成一个 csv 或者 txt 文件, csv 文件的第一行是列名, txt 文件没有列名. 大约 2% 的行用 \r\n 换行
+
+    :param path: 文件路径
+    :param rows: 行数
+    :param file_type: 'csv' 或者 'txt'
+    :param separator: txt 文件的分隔符
+    :param kwargs: 传给 generate_rows 的参数
+    :return: 描述这个文件的字典, 包括路径, 行数, 字节数和每种脏数据的行数
+    """
+
+    dirt = Counter()
+    delimiter = ',' if file_type == 'csv' else separator
+    # 换行符用单独的随机数, 不影响数据本身
+    rng = random.Random(kwargs.get('seed', 0) + 1)
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+
+    with open(path, 'w', encoding='utf8', newline='') as w:
+        if file_type == 'csv':
+            w.write(','.join(COLUMNS) + '\n')
+        buffer = []
+        for row in generate_rows(rows, dirt=dirt, **kwargs):
+            buffer.append(delimiter.join(row) + ('\r\n' if rng.random() < 0.02 else '\n'))
+            if len(buffer) >= WRITE_ROWS:
+                w.write(''.join(buffer))
+                buffer = []
+        w.write(''.join(buffer))
+
+    return {
+        'path': os.path.abspath(path),
+        'type': file_type,
+        'rows': rows,
+        'bytes': os.path.getsize(path),
+        'dirt': dict(dirt),
+    }
+
+
+def dump_path(output_dir, rows, file_type, seed=0):
+    """同样的行数和 seed 使用同一个文件名, 已经生成过的文件可以直接复用"""
+    return os.path.join(output_dir, 'bench_{}_s{}.{}'.format(rows, seed, file_type))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='generate csv/txt dumps with dirty data for benchmarks')
+    parser.add_argument('--rows', type=parse_count, default=parse_count('1M'),
+                        help='rows of every file, K and M suffixes are allowed, default is 1M')
+    parser.add_argument('--type', choices=['csv', 'txt', 'both'], default='both', dest='file_type',
+                        help='which files to generate, default is both')
+    parser.add_argument('--output-dir', default='.', help='directory of the generated files')
+    parser.add_argument('--seed', type=int, default=0, help='random seed, default is 0')
+    parser.add_argument('--dirty-ratio', type=float, default=0.01,
+                        help='ratio of rows with one kind of dirty data, default is 0.01')
+    parser.add_argument('--duplicate-ratio', type=float, default=0.01,
+                        help='ratio of rows that repeat a recent row, default is 0.01')
+    parser.add_argument('--oversize-every', type=int, default=0, metavar='ROWS',
+                        help='put a field larger than the csv field limit every ROWS rows, these rows stop the csv '
+                             'import with _csv.Error. default is 0, no such field')
+    opts = parser.parse_args()
+
+    file_types = ['csv', 'txt'] if opts.file_type == 'both' else [opts.file_type]
+    results = []
+    for file_type in file_types:
+        path = dump_path(opts.output_dir, opts.rows, file_type, opts.seed)
+        results.append(write_dump(path, opts.rows, file_type, seed=opts.seed, dirty_ratio=opts.dirty_ratio,
+                                  duplicate_ratio=opts.duplicate_ratio, oversize_every=opts.oversize_every))
+    json.dump(results, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+# encoding: utf8
+#!/usr/bin/env python3
+"""
+用 generate_data.py 生成的数据运行 move_to_database.py 的单进程 -i, 多进程 -i -f 和 -t 三种模式,
+每次运行都是一个新的子进程, 把 rows/s, 最大内存 (RSS) 和每个阶段 (count, split, insert, commit) 的用时
+输出成 JSON, 可以用来比较不同版本的速度. 数据库连接使用 lib/settings.py 中的配置,
+--backend sqlite 不需要数据库服务器, 数据库文件默认在 --work-dir 里面
+
+Usage example:
+'''
+python3 benchmarks/run_benchmark.py --rows 1M --rows 10M --workers 8 --output result.json
+python3 benchmarks/run_benchmark.py --rows 100K --backend sqlite
+'''
+"""
+import os
+import sys
+import json
+import time
+import shlex
+import platform
+import argparse
+import tempfile
+import subprocess
+import multiprocessing
+
+BENCHMARK_PATH = os.path.dirname(os.path.abspath(__file__))
+ROOT_PATH = os.path.dirname(BENCHMARK_PATH)
+sys.path.insert(0, ROOT_PATH)
+
+from lib.settings import DATABASE, TABLE_NAME
+from lib.stats import merge_stats, merge_profile
+from generate_data import COLUMNS, TXT_SEPARATOR, parse_count, dump_path, write_dump
+
+MODES = ('single', 'fast', 'txt')
+SCRIPT_PATH = os.path.join(ROOT_PATH, 'move_to_database.py')
+
+
+def git_version():
+    """当前代码的 commit, 不是 git 仓库的话返回 None"""
+    try:
+        return subprocess.check_output(['git', 'describe', '--always', '--dirty'], cwd=ROOT_PATH,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def mode_args(mode, csv_path, txt_path, workers):
+    """每种模式的命令行参数"""
+    if mode == 'single':
+        return ['-i', csv_path]
+    if mode == 'fast':
+        return ['-i', csv_path, '-f', '--workers', str(workers)]
+    return ['-t', txt_path, '-F', TXT_SEPARATOR, '-T', TABLE_NAME, '-c'] + COLUMNS
+
+
+def run_command(command, work_dir, output_path):
+    """
+    运行一个子进程, 输出写进 output_path
+
+    :return: (退出码, 用时秒数, 子进程和它的子进程中最大的 RSS, 单位 KB)
+    """
+
+    with open(output_path, 'wb') as w:
+        start_time = time.perf_counter()
+        process = subprocess.Popen(command, cwd=work_dir, stdin=subprocess.DEVNULL, stdout=w,
+                                   stderr=subprocess.STDOUT)
+        # wait4 返回的是这一个子进程的资源使用, 多次运行之间不会互相影响
+        _, status, rusage = os.wait4(process.pid, 0)
+        elapsed = time.perf_counter() - start_time
+    return os.waitstatus_to_exitcode(status), elapsed, rusage.ru_maxrss
+
+
+def run_benchmark(mode, rows, csv_path, txt_path, opts):
+    """
+    运行一种模式, 运行之前删掉上一次的数据库表
+
+    :return: 这一次运行的结果字典
+    """
+
+    work_dir = opts.work_dir
+    base_args = [opts.python, SCRIPT_PATH, '--backend', opts.backend, '-D', opts.database]
+    name = '{}_{}'.format(mode, rows)
+    drop_command = base_args + ['-m', 'DROP TABLE IF EXISTS {}'.format(TABLE_NAME)]
+    run_command(drop_command, work_dir, os.path.join(work_dir, name + '.drop.out'))
+
+    stats_path = os.path.join(work_dir, name + '.stats.jsonl')
+    command = base_args + mode_args(mode, csv_path, txt_path, opts.workers) + [
+        '--skip-error', '--stats-file', stats_path] + shlex.split(opts.extra_args)
+    exit_code, elapsed, peak_rss = run_command(command, work_dir, os.path.join(work_dir, name + '.out'))
+
+    stats = merge_stats(stats_path)
+    result = {
+        'mode': mode,
+        'rows': rows,
+        'file': txt_path if mode == 'txt' else csv_path,
+        'command': ' '.join([shlex.quote(_) for _ in command[1:]]),
+        'exit_code': exit_code,
+        'elapsed': round(elapsed, 3),
+        'rows_per_second': round(stats['rows'] / elapsed, 1) if elapsed else 0,
+        'peak_rss_kb': peak_rss,
+        'phases': stats['phases'],
+        'inserted': stats['rows'],
+        'success': stats['success'],
+        'failed': stats['failed'],
+        'commits': stats['commits'],
+        'stats_records': stats['records'],
+    }
+    # --extra-args --profile 的时候加上每个阶段的用时和直方图
+    profile = merge_profile(stats_path)
+    if profile['stages']:
+        result['profile'] = profile['stages']
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='run move_to_database.py on generated dumps and report JSON')
+    parser.add_argument('--rows', type=parse_count, action='append', dest='row_counts',
+                        help='rows of the generated dump, can be given more than once, K and M suffixes are '
+                             'allowed, default is 1M')
+    parser.add_argument('--mode', choices=MODES, action='append', dest='modes',
+                        help='single (-i), fast (-i -f) or txt (-t), can be given more than once, default is all')
+    parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count(),
+                        help='--workers of the fast mode, default is the cpu count')
+    parser.add_argument('--backend', choices=['mysql', 'postgresql', 'sqlite'], default='mysql',
+                        help='--backend of move_to_database.py, default is mysql')
+    parser.add_argument('-D', '--database', help='database name, default is lib/settings.py, the sqlite backend '
+                                                 'uses bench.sqlite3 in --work-dir')
+    parser.add_argument('--extra-args', default='',
+                        help='more options for every run, for example "--engine load-data --batch-size 5000"')
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'move_to_database_bench'),
+                        help='directory of the generated dumps')
+    parser.add_argument('--work-dir', help='directory of logs/, stats files and the output of every run, '
+                                           'default is a new temporary directory')
+    parser.add_argument('--reuse-data', action='store_true',
+                        help='use the dumps in --data-dir if they already exist instead of generating them again')
+    parser.add_argument('--seed', type=int, default=0, help='random seed of the generator')
+    parser.add_argument('--dirty-ratio', type=float, default=0.01, help='see generate_data.py')
+    parser.add_argument('--duplicate-ratio', type=float, default=0.01, help='see generate_data.py')
+    parser.add_argument('--oversize-every', type=int, default=0, metavar='ROWS', help='see generate_data.py')
+    parser.add_argument('--python', default=sys.executable, help='python interpreter of the runs')
+    parser.add_argument('--output', help='write the JSON report to this file as well as stdout')
+    opts = parser.parse_args()
+
+    row_counts = opts.row_counts or [parse_count('1M')]
+    modes = opts.modes or list(MODES)
+    opts.work_dir = os.path.abspath(opts.work_dir or tempfile.mkdtemp(prefix='move_to_database_run_'))
+    os.makedirs(opts.work_dir, exist_ok=True)
+    if not opts.database:
+        opts.database = os.path.join(opts.work_dir, 'bench.sqlite3') if opts.backend == 'sqlite' else DATABASE
+
+    report = {
+        'version': git_version(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': multiprocessing.cpu_count(),
+        'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'backend': opts.backend,
+        'database': opts.database,
+        'workers': opts.workers,
+        'extra_args': opts.extra_args,
+        'work_dir': opts.work_dir,
+        'datasets': [],
+        'runs': [],
+    }
+    # -i 的两种模式用 csv 文件, -t 用 txt 文件
+    file_types = [_ for _ in ('csv', 'txt') if _ in ['txt' if mode == 'txt' else 'csv' for mode in modes]]
+    for rows in row_counts:
+        paths = {}
+        for file_type in file_types:
+            path = dump_path(opts.data_dir, rows, file_type, opts.seed)
+            paths[file_type] = path
+            if opts.reuse_data and os.path.exists(path):
+                dataset = {'path': path, 'type': file_type, 'rows': rows, 'bytes': os.path.getsize(path),
+                           'reused': True}
+            else:
+                start_time = time.perf_counter()
+                dataset = write_dump(path, rows, file_type, seed=opts.seed, dirty_ratio=opts.dirty_ratio,
+                                     duplicate_ratio=opts.duplicate_ratio, oversize_every=opts.oversize_every)
+                dataset['generate_seconds'] = round(time.perf_counter() - start_time, 3)
+            report['datasets'].append(dataset)
+
+        for mode in modes:
+            result = run_benchmark(mode, rows, paths.get('csv'), paths.get('txt'), opts)
+            report['runs'].append(result)
+            sys.stderr.write('{mode} {rows} rows: {elapsed}s, {rows_per_second} rows/s, exit code {exit_code}\n'.format(
+                **result))
+
+    output = json.dumps(report, indent=2)
+    if opts.output:
+        with open(opts.output, 'w') as w:
+            w.write(output + '\n')
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,111 @@
 # encoding: utf8
 #!/usr/bin/env python3
 import os
+import time
+import queue
+import atexit
+import threading
 import logging.config
+import logging.handlers
+from multiprocessing.connection import Connection
 from lib.settings import LOG_PATH
 
+# 当前进程的日志队列: 主进程中是 listener 读取的 queue.Queue, fork 出来的子进程中是它自己的 PipeQueue
+LOG_QUEUE = None
+# 主进程中唯一写日志文件的 listener
+LOG_LISTENER = None
+LISTENER_PID = None
+# fork 之前创建的管道, fork 之后子进程用写的一端, 父进程用读的一端
+FORK_PIPE = None
+# 父进程中转发子进程日志记录的线程
+FORWARD_THREADS = []
+# 程序退出的时候等待转发线程读完子进程剩下的日志记录的秒数
+FORWARD_TIMEOUT = 5
+
+
+class PipeQueue(object):
+    """
+    子进程中代替 LOG_QUEUE, QueueHandler 调用 put_nowait 把日志记录直接写进这个子进程自己的管道.
+    管道只有这一个进程写, 不需要跨进程的锁, 子进程在写日志的时候被 kill 也不会让其他进程卡住
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.lock = threading.Lock()
+
+    def put_nowait(self, record):
+        with self.lock:
+            try:
+                self.connection.send(record)
+            except OSError:
+                # 父进程已经退出, 日志记录没有地方写了
+                pass
+
+
+def forward_records(connection):
+    """父进程中的线程, 把一个子进程管道中的日志记录转到当前进程的 LOG_QUEUE, 子进程退出管道关闭的时候结束"""
+    with connection:
+        while True:
+            try:
+                record = connection.recv()
+            except (EOFError, OSError):
+                # 子进程退出了, 或者在写一条记录的中间被 kill 了
+                return
+            LOG_QUEUE.put_nowait(record)
+
+
+def before_fork():
+    global FORK_PIPE
+    if LOG_QUEUE is not None:
+        FORK_PIPE = os.pipe()
+
+
+def after_fork_in_parent():
+    global FORK_PIPE
+    if FORK_PIPE is None:
+        return
+    read_fd, write_fd = FORK_PIPE
+    FORK_PIPE = None
+    os.close(write_fd)
+    thread = threading.Thread(target=forward_records, args=(Connection(read_fd, writable=False), ), daemon=True)
+    thread.start()
+    FORWARD_THREADS[:] = [_ for _ in FORWARD_THREADS if _.is_alive()] + [thread]
+
+
+def after_fork_in_child():
+    global LOG_QUEUE, FORK_PIPE
+    if FORK_PIPE is None:
+        return
+    read_fd, write_fd = FORK_PIPE
+    FORK_PIPE = None
+    os.close(read_fd)
+    # 父进程的转发线程不会出现在子进程中
+    FORWARD_THREADS[:] = []
+    LOG_QUEUE = PipeQueue(Connection(write_fd, readable=False))
+    for logger_name in ('debug_logger', 'error_logger'):
+        for handler in logging.getLogger(logger_name).handlers:
+            if isinstance(handler, logging.handlers.QueueHandler):
+                handler.queue = LOG_QUEUE
+
+
+os.register_at_fork(before=before_fork, after_in_parent=after_fork_in_parent, after_in_child=after_fork_in_child)
+
+
+def stop_listener():
+    """
+    等待转发线程读完已经退出的子进程的日志记录, 处理完队列中剩下的日志记录之后停止 listener,
+    程序退出的时候自动调用. fork 出来的子进程也继承了 LOG_LISTENER, 但是 listener 线程只在主进程中运行
+    """
+    global LOG_LISTENER
+    if LOG_LISTENER is not None and LISTENER_PID == os.getpid():
+        deadline = time.time() + FORWARD_TIMEOUT
+        for thread in FORWARD_THREADS:
+            thread.join(max(0, deadline - time.time()))
+        LOG_LISTENER.stop()
+        for handler in LOG_LISTENER.handlers:
+            handler.close()
+        LOG_LISTENER = None
+
 
 class Logger(object):
     """
@@ -25,6 +127,10 @@ class Logger(object):
 
         如果设置了等级为 WARNING, 那么调用 debug info 写的日志便不会出现在日志文件中
 
+        日志记录先放进队列, 由主进程中的 listener 线程写文件, 插入数据的进程不会等待磁盘.
+        fork 出来的子进程把日志记录写进自己的管道, 由父进程中的线程转到队列里
+        热点路径上用 debug_logger.debug('flush %s rows', n) 这种写法, 等级没有打开的时候不会格式化字符串
+
         使用方法:
         '''
         先创建Logger对象, 例如 logger = Logger(log_level='DEBUG'), 然后
@@ -41,25 +147,10 @@ class Logger(object):
 
     def get_logging_config(self):
         """get logging dict config, return a dict object"""
-        # logging dict config
+        # logging dict config, 只在 listener 所在的主进程中使用, 创建写文件的 handler
         logging_config = {
             'version': 1,
             'disable_existing_loggers': False,
-            'loggers': {
-                # custom logger
-                'debug_logger': {
-                    'level': self.log_level,
-                    'handlers': ['debug_handler'],
-                    'formatter': 'standard',
-                    'propagate': False
-                },
-                'error_logger': {
-                    'level': 'ERROR',
-                    'handlers': ['error_handler'],
-                    'formatter': 'standard',
-                    'propagate': False
-                },
-            },
             'handlers': {
                 # be used for file output
                 'debug_handler': {
@@ -70,6 +161,7 @@ class Logger(object):
                     'filename': os.path.join(LOG_PATH, 'debug.log'),
                     'maxBytes': 1024*1024*500,
                     'formatter': 'standard',
+                    'filters': ['debug_filter'],
                 },
                 'error_handler': {
                     # 只处理 DEBUG 级别以上的
@@ -79,6 +171,16 @@ class Logger(object):
                     'filename': os.path.join(LOG_PATH, 'error.log'),
                     'maxBytes': 1024*1024*500,
                     'formatter': 'standard',
+                    'filters': ['error_filter'],
+                },
+            },
+            # 所有记录都从同一个队列里出来, 按 logger 名字分到各自的文件
+            'filters': {
+                'debug_filter': {
+                    'name': 'debug_logger',
+                },
+                'error_filter': {
+                    'name': 'error_logger',
                 },
             },
             'formatters': {
@@ -100,13 +202,41 @@ class Logger(object):
 
     def logger_init(self):
         """
-        logger initialization, get logging_config and use logging_config,
-        no return
+        logger initialization, no return.
+
+        所有进程的 debug_logger 和 error_logger 都只挂一个 QueueHandler, 把日志记录放进 LOG_QUEUE;
+        第一次初始化的 (主) 进程启动 QueueListener 线程, 只有它打开和轮转 debug.log / error.log.
+        fork 出来的子进程继承了 QueueHandler, fork 的时候换成这个子进程自己的 PipeQueue,
+        子进程里再创建 Logger 也不会重新打开文件
         """
-        if not os.path.exists(LOG_PATH):
-            os.mkdir(LOG_PATH)
-        logging_config = self.get_logging_config()
-        logging.config.dictConfig(logging_config)
+        global LOG_QUEUE, LOG_LISTENER, LISTENER_PID
+        if LOG_QUEUE is None:
+            if not os.path.exists(LOG_PATH):
+                os.mkdir(LOG_PATH)
+            handlers = self.get_file_handlers()
+            LOG_QUEUE = queue.Queue()
+            LOG_LISTENER = logging.handlers.QueueListener(LOG_QUEUE, *handlers, respect_handler_level=True)
+            LOG_LISTENER.start()
+            LISTENER_PID = os.getpid()
+            atexit.register(stop_listener)
+        self.configure_loggers()
+
+    def get_file_handlers(self):
+        """根据 get_logging_config 创建写文件的 handler, 返回 handler 列表"""
+        configurator = logging.config.DictConfigurator(self.get_logging_config())
+        configurator.configure()
+        return [configurator.config['handlers'][_] for _ in ('debug_handler', 'error_handler')]
+
+    def configure_loggers(self):
+        """给 debug_logger 和 error_logger 设置等级, 并且只保留一个写到 LOG_QUEUE 的 QueueHandler"""
+        for logger_name, level in (('debug_logger', self.log_level), ('error_logger', 'ERROR')):
+            logger = logging.getLogger(logger_name)
+            logger.setLevel(level)
+            logger.propagate = False
+            if not any([isinstance(_, logging.handlers.QueueHandler) for _ in logger.handlers]):
+                for handler in logger.handlers[:]:
+                    logger.removeHandler(handler)
+                logger.addHandler(logging.handlers.QueueHandler(LOG_QUEUE))
 
     def debug(self, string):
         """logging debug function"""
@@ -0,0 +1,32 @@
+# encoding: utf8
+#!/usr/bin/env python3
+import importlib
+
+# --backend 的名字和对应的模块, 模块只有用到的时候才导入, 没有安装的驱动不影响其他 backend
+BACKENDS = {
+    'mysql': 'lib.backends.mysql',
+    'postgresql': 'lib.backends.postgresql',
+    'sqlite': 'lib.backends.sqlite',
+}
+# 每个 backend 需要安装的驱动, sqlite3 是标准库
+BACKEND_DRIVERS = {
+    'mysql': 'pymysql',
+    'postgresql': 'psycopg2-binary',
+    'sqlite': '',
+}
+
+
+def get_backend(name):
+    """
+    根据名字创建 backend 对象
+
+    :param name: BACKENDS 中的名字, 或者已经创建好的 backend 对象
+    :return: Backend 对象, 名字不对的话 raise ValueError, 没有安装驱动的话 raise ImportError
+    """
+
+    if not isinstance(name, str):
+        return name
+    if name not in BACKENDS:
+        raise ValueError('unknown backend "{}", choose from {}'.format(name, ', '.join(sorted(BACKENDS))))
+    module = importlib.import_module(BACKENDS[name])
+    return module.BACKEND_CLASS()
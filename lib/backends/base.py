@@ -0,0 +1,173 @@
+# encoding: utf8
+#!/usr/bin/env python3
+from contextlib import contextmanager
+from lib.schema import DEFAULT_COLUMN_TYPE
+
+# 索引名最长 63 个字符 (PostgreSQL 的限制, MYSQL 是 64)
+INDEX_NAME_LIMIT = 63
+
+
+class Backend(object):
+    """
+    Database backend base class, Database 对象通过 backend 完成和具体数据库有关的操作: 创建连接, 创建表,
+    批量写入, 提交事务, 执行 sql 命令. 批量缓冲, 拆分失败的批次, reject 文件和定期提交都在 Database 里面,
+    所有 backend 共用
+
+    新的 backend 继承这个类, 覆盖需要的方法, 然后在 lib/backends/__init__.py 的 BACKENDS 中登记
+
+    注意: backend 对象没有状态, 连接和 cursor 由 Database 和 ConnectionPool 保存
+    """
+
+    name = None
+    # 驱动的异常基类, 例如 pymysql.err.Error
+    Error = Exception
+    # 参数化 sql 的占位符
+    placeholder = '%s'
+    # --bulk-session 修改的会话变量, (变量名, 值) 元组
+    bulk_session_variables = ()
+    # 是否支持 --engine load-data
+    load_data = False
+    # 同一时间是否只能有一个写事务, 是的话流水线的写入进程每写完一批就提交, 不一直拿着写锁
+    single_writer = False
+
+    def connect(self, host, port, user, password, database, connect_timeout=10, local_infile=False):
+        """创建一个新的连接"""
+        raise NotImplementedError
+
+    def ping(self, conn):
+        """检查连接是否还能用, 不能用的话 raise, 连接池会换一个新的连接"""
+        cursor = conn.cursor()
+        cursor.execute('SELECT 1')
+        cursor.close()
+
+    def open_cursor(self, conn, engine='insert', max_packet_size=1024*1024):
+        """
+        创建 Database 使用的 cursor, fetchall() 返回字典列表
+
+        :param conn: 连接
+        :param engine: insert 或者 load-data
+        :param max_packet_size: 一条 sql 语句的最大长度(字节)
+        :return: cursor
+        """
+
+        raise NotImplementedError
+
+    @contextmanager
+    def savepoint(self, cursor, name='statement'):
+        """
+        Database 执行可能失败的语句 (建表, 建索引, 修改会话变量, 删除表) 的时候用 with 包起来, 失败的时候只撤销这条
+        语句, 事务中还没有提交的数据不受影响. MYSQL 和 SQLite 一条语句失败不影响事务, 什么都不做; PostgreSQL 事务中
+        任何一条语句失败之后整个事务都不能用了, 见 PostgreSQLBackend.savepoint
+
+        :param cursor: cursor
+        :param name: savepoint 的名字
+        """
+
+        yield
+
+    def split_error(self, error):
+        """
+        把异常分成 (错误码, 错误信息), 写进 reject 文件
+
+        :param error: 异常
+        :return: (错误码, 错误信息), 没有错误码的用异常的类名
+        """
+
+        return type(error).__name__, str(error)
+
+    def column_type(self, column_type):
+        """把 lib/schema.py 中的 MYSQL 类型转换成这个数据库的类型"""
+        return column_type
+
+    def create_table_sql(self, table_name, table_column_list, column_types):
+        """
+        :param table_name: table name
+        :param table_column_list: 列名列表
+        :param column_types: {列名: 类型} 字典, 没有的列使用 varchar(300)
+        :return: CREATE TABLE 语句
+        """
+
+        # 例如: id varchar(300) null default NULL, name varchar(300) null default NULL
+        columns = ['{} {} null default NULL'.format(
+            column, self.column_type(column_types.get(column, DEFAULT_COLUMN_TYPE))) for column in table_column_list]
+        return 'CREATE TABLE {} ({})'.format(table_name, ', '.join(columns))
+
+    def insert_sql(self, table_name, column_list):
+        """
+        参数化的 INSERT 模板, 例如 INSERT INTO test_table (id, name) VALUES (%s, %s)
+
+        :param table_name: table name
+        :param column_list: 用 , 分隔的列名字符串
+        :return: INSERT 模板
+        """
+
+        placeholders = ', '.join([self.placeholder] * len(column_list.split(',')))
+        return 'INSERT INTO {} ({}) VALUES ({})'.format(table_name, column_list, placeholders)
+
+    def statement_size(self, template):
+        """
+        批量写入的语句中数据以外的部分的长度(字节), 例如 INSERT INTO test_table (id, name) VALUES.
+        Database 用它和 row_size 保证一批数据拼成的语句不超过 --max-packet-size
+
+        :param template: insert_sql() 返回的 INSERT 模板
+        :return: 字节数
+        """
+
+        return 0
+
+    def row_size(self, cursor, template, row):
+        """
+        一行数据在批量写入的语句中占的长度(字节), 默认是估算: 每一列的字符数再加上引号和 ", "
+
+        :param cursor: cursor
+        :param template: insert_sql() 返回的 INSERT 模板
+        :param row: 数据列表, None 为 NULL
+        :return: 字节数
+        """
+
+        return sum(map(len, filter(None, row))) + 4 * len(row)
+
+    def write_batch(self, cursor, template, table_name, column_list, rows):
+        """
+        用这个数据库最快的方式写入一批数据, 不提交事务. 失败的时候必须 raise, 并且这一批数据一行都没有写进去,
+        Database 会把这一批对半拆开再分别写入
+
+        :param cursor: cursor
+        :param template: insert_sql() 返回的 INSERT 模板
+        :param table_name: table name
+        :param column_list: 用 , 分隔的列名字符串
+        :param rows: 数据列表的列表, None 为 NULL
+        :return:
+        """
+
+        cursor.executemany(template, rows)
+
+    def variable_sql(self, name):
+        """读取一个会话变量的 sql, 返回一列 value"""
+        raise NotImplementedError
+
+    def set_variable_sql(self, name, value):
+        """修改一个会话变量的 sql, value 为 None 的时候恢复默认值"""
+        raise NotImplementedError
+
+    def index_name(self, table_name, index_columns):
+        return '{}_idx_{}'.format(table_name, '_'.join(index_columns))[:INDEX_NAME_LIMIT]
+
+    def index_sql_list(self, table_name, primary_key, indexes, column_types):
+        """
+        导入完成之后建立主键和索引的 sql 语句
+
+        :param table_name: table name
+        :param primary_key: 主键的列名列表
+        :param indexes: 索引列表, 每个索引是一个列名列表
+        :param column_types: {列名: 类型} 字典
+        :return: sql 语句列表
+        """
+
+        sql_list = []
+        if primary_key:
+            sql_list.append('ALTER TABLE {} ADD PRIMARY KEY ({})'.format(table_name, ', '.join(primary_key)))
+        for index_columns in indexes or []:
+            sql_list.append('CREATE INDEX {} ON {} ({})'.format(
+                self.index_name(table_name, index_columns), table_name, ', '.join(index_columns)))
+        return sql_list
@@ -0,0 +1,103 @@
+# encoding: utf8
+#!/usr/bin/env python3
+import sys
+import pymysql
+from lib.backends.base import Backend
+
+# 批量导入时关闭的会话变量, sql_log_bin 需要 SUPER 权限, 没有权限的话跳过
+BULK_SESSION_VARIABLES = (
+    ('unique_checks', 0),
+    ('foreign_key_checks', 0),
+    ('sql_log_bin', 0),
+)
+# MYSQL 索引名最长 64 个字符, TEXT 类型的列只能用前缀建索引
+INDEX_NAME_LIMIT = 64
+INDEX_PREFIX_LENGTH = 255
+
+
+class MySQLBackend(Backend):
+    """
+    MYSQL / MariaDB backend, 使用 pymysql. insert 模式下 executemany 会把一批数据拼成多行 INSERT 语句,
+    load-data 模式下用 LOAD DATA LOCAL INFILE 导入临时文件
+    """
+
+    name = 'mysql'
+    Error = pymysql.err.Error
+    bulk_session_variables = BULK_SESSION_VARIABLES
+    load_data = True
+
+    def connect(self, host, port, user, password, database, connect_timeout=10, local_infile=False):
+        return pymysql.connect(host=host, port=port or 3306, user=user, password=password, database=database,
+                               charset='utf8', connect_timeout=connect_timeout, local_infile=local_infile)
+
+    def ping(self, conn):
+        conn.ping(reconnect=True)
+
+    def open_cursor(self, conn, engine='insert', max_packet_size=1024*1024):
+        cursor = conn.cursor(cursor=pymysql.cursors.DictCursor)
+        # executemany 会把多行数据拼成多行 INSERT 语句, 超过 max_stmt_length 的话拆成多条语句.
+        # Database 已经按 row_size 保证一批数据不超过 max_packet_size, 这里不让 executemany 再拆, 一批就是一条语句.
+        # 一条语句失败的时候整条回滚, 一批要么全部写入要么都没有, 所以不需要 savepoint
+        cursor.max_stmt_length = sys.maxsize
+        if engine == 'load-data':
+            # LOAD DATA 的坏数据都是以 warning 的形式返回的, 默认只保留 64 条, 调大一点
+            cursor.execute('SET SESSION max_error_count = 65535')
+        return cursor
+
+    def split_error(self, error):
+        # pymysql 的异常参数是 (MYSQL 错误码, 错误信息)
+        if len(error.args) > 1 and isinstance(error.args[0], int):
+            return error.args[0], str(error.args[1])
+        return type(error).__name__, str(error)
+
+    def create_table_sql(self, table_name, table_column_list, column_types):
+        create_table_sql = super(MySQLBackend, self).create_table_sql(table_name, table_column_list, column_types)
+        return create_table_sql + ' CHARACTER SET utf8 COLLATE utf8_general_ci'
+
+    def statement_size(self, template):
+        # executemany 发送的是 INSERT INTO t (id, name) VALUES 加上每一行转义之后的 (...), 用 , 连接
+        return len(template[:template.rindex('(')].encode('utf8'))
+
+    def row_size(self, cursor, template, row):
+        # 和 pymysql 的 executemany 一样: 转义之后的 ('1', 'a') 按 utf8 编码的长度, 再加上连接用的 ,
+        return len(cursor.mogrify(template[template.rindex('('):], row).encode('utf8')) + 1
+
+    def load_file(self, cursor, path, table_name, column_list):
+        """
+        用 LOAD DATA LOCAL INFILE 导入一个用 \\t 分隔, \\ 转义的临时文件
+
+        :return: (导入的行数, warning 字典列表), warning 包括 Level, Code 和 Message
+        """
+
+        load_data_sql = "LOAD DATA LOCAL INFILE %s INTO TABLE {} CHARACTER SET utf8 FIELDS TERMINATED BY '\\t' " \
+                        "ESCAPED BY '\\\\' LINES TERMINATED BY '\\n' ({})".format(table_name, column_list)
+        cursor.execute(load_data_sql, (path, ))
+        loaded_count = max(cursor.rowcount, 0)
+        cursor.execute('SHOW WARNINGS')
+        return loaded_count, cursor.fetchall()
+
+    def variable_sql(self, name):
+        return 'SELECT @@SESSION.{} AS value'.format(name)
+
+    def set_variable_sql(self, name, value):
+        return 'SET SESSION {} = {}'.format(name, 'DEFAULT' if value is None else value)
+
+    def index_sql_list(self, table_name, primary_key, indexes, column_types):
+        # 一条 ALTER TABLE 建立主键和所有的二级索引, 只需要重建一次表
+        def index_column(column):
+            if column_types.get(column, '').lower().endswith('text'):
+                return '{}({})'.format(column, INDEX_PREFIX_LENGTH)
+            return column
+
+        alter_list = []
+        if primary_key:
+            alter_list.append('ADD PRIMARY KEY ({})'.format(', '.join([index_column(_) for _ in primary_key])))
+        for index_columns in indexes or []:
+            index_name = 'idx_{}'.format('_'.join(index_columns))[:INDEX_NAME_LIMIT]
+            alter_list.append('ADD INDEX {} ({})'.format(index_name, ', '.join([index_column(_) for _ in index_columns])))
+        if not alter_list:
+            return []
+        return ['ALTER TABLE {} {}'.format(table_name, ', '.join(alter_list))]
+
+
+BACKEND_CLASS = MySQLBackend
@@ -0,0 +1,68 @@
+# encoding: utf8
+#!/usr/bin/env python3
+import sqlite3
+from lib.settings import DATABASE
+from lib.backends.base import Backend
+
+# 多个进程写同一个文件的时候, 等待别人的写事务结束的最长时间(秒)
+BUSY_TIMEOUT = 600
+
+
+def dict_factory(cursor, row):
+    """和 pymysql 的 DictCursor 一样, fetchall() 返回字典列表"""
+    return dict(zip([_[0] for _ in cursor.description], row))
+
+
+class SQLiteBackend(Backend):
+    """
+    SQLite backend, 不需要数据库服务器, -D 是数据库文件的路径. 连接打开 WAL 和 synchronous=OFF,
+    每一批数据在一个大事务里面用 executemany 写入, 只有提交事务的时候才写磁盘.
+
+    SQLite 同一时间只能有一个写事务, -f 的多个进程会轮流写入, 流水线的写入进程每一批写完就提交, 让出写锁
+    """
+
+    name = 'sqlite'
+    Error = sqlite3.Error
+    placeholder = '?'
+    single_writer = True
+
+    def connect(self, host, port, user, password, database, connect_timeout=10, local_infile=False):
+        # 没有指定 -D 的话使用 lib/settings.py 中的数据库名字
+        conn = sqlite3.connect(database or '{}.sqlite3'.format(DATABASE), timeout=max(connect_timeout, BUSY_TIMEOUT),
+                               check_same_thread=False)
+        conn.row_factory = dict_factory
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute('PRAGMA synchronous = OFF')
+        return conn
+
+    def open_cursor(self, conn, engine='insert', max_packet_size=1024*1024):
+        return conn.cursor()
+
+    def split_error(self, error):
+        # Python 3.11 开始 sqlite3 的异常带有错误码的名字, 例如 SQLITE_CONSTRAINT_NOTNULL
+        return getattr(error, 'sqlite_errorname', None) or type(error).__name__, str(error)
+
+    def write_batch(self, cursor, template, table_name, column_list, rows):
+        # executemany 中间某一行失败的时候, 前面的行已经写进去了, 所以用 savepoint 保证一批要么全部写入要么都没有.
+        # 先开始事务, 不然 RELEASE 最外层的 savepoint 会提交事务
+        if not cursor.connection.in_transaction:
+            cursor.execute('BEGIN')
+        cursor.execute('SAVEPOINT write_batch')
+        try:
+            cursor.executemany(template, rows)
+        except sqlite3.Error:
+            cursor.execute('ROLLBACK TO SAVEPOINT write_batch')
+            cursor.execute('RELEASE SAVEPOINT write_batch')
+            raise
+        cursor.execute('RELEASE SAVEPOINT write_batch')
+
+    def index_sql_list(self, table_name, primary_key, indexes, column_types):
+        # SQLite 不能给已经存在的表加主键, 用唯一索引代替
+        sql_list = super(SQLiteBackend, self).index_sql_list(table_name, None, indexes, column_types)
+        if primary_key:
+            sql_list.insert(0, 'CREATE UNIQUE INDEX {}_pkey ON {} ({})'.format(
+                table_name, table_name, ', '.join(primary_key)))
+        return sql_list
+
+
+BACKEND_CLASS = SQLiteBackend
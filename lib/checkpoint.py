@@ -0,0 +1,130 @@
+# encoding: utf8
+#!/usr/bin/env python3
+import os
+import json
+import hashlib
+import tempfile
+from lib.settings import CHECKPOINT_PATH
+
+
+def file_fingerprint(file_path):
+    """
+    计算文件的指纹, 由文件大小, 修改时间和开头 1MB 数据的 sha1 组成, 文件被修改过的话指纹就对不上了
+
+    :param file_path: 文件路径
+    :return: 指纹字符串
+    """
+
+    stat = os.stat(file_path)
+    sha1 = hashlib.sha1()
+    with open(file_path, 'rb') as r:
+        sha1.update(r.read(1024*1024))
+    return '{}-{}-{}'.format(stat.st_size, int(stat.st_mtime), sha1.hexdigest())
+
+
+class Checkpoint(object):
+    """
+    Handle checkpoint manifest class, 用来实现断点续传
+
+    每一次导入 (源文件 + 表名) 对应 checkpoint/ 下面的一个 manifest 目录, 目录里每一段 [start, end) 对应一个
+    chunk_<start>.json 文件, 只会被处理这一段的进程写, 所以多进程之间不需要加锁. 每次提交事务之后都会用
+    "写临时文件 + os.replace" 的方式原子地更新, 内容例如:
+    '''
+    {"fingerprint": "...", "start": 0, "end": 1048576, "offset": 524288, "lines": 10001, "committed_rows": 10000,
+     "success_rows": 9990, "failed_rows": 10, "done": false}
+    '''
+    offset 之前的数据都已经提交了, --resume 的时候从 offset 开始继续处理
+    """
+
+    def __init__(self, file_path, table_name):
+        self.file_path = file_path
+        self.table_name = table_name
+        self.fingerprint = file_fingerprint(file_path)
+        manifest_name = hashlib.sha1('{}:{}'.format(os.path.realpath(file_path), table_name).encode('utf8'))
+        self.manifest_path = os.path.join(CHECKPOINT_PATH, manifest_name.hexdigest()[:16])
+
+    def chunk_file(self, start):
+        return os.path.join(self.manifest_path, 'chunk_{}.json'.format(start))
+
+    def load(self):
+        """
+        读取 manifest, 如果源文件的指纹对不上就当作没有 checkpoint
+
+        :return: {start: record} 字典
+        """
+
+        records = {}
+        if not os.path.isdir(self.manifest_path):
+            return records
+
+        for name in os.listdir(self.manifest_path):
+            if not (name.startswith('chunk_') and name.endswith('.json')):
+                continue
+            with open(os.path.join(self.manifest_path, name), 'r') as r:
+                record = json.load(r)
+            if record.get('fingerprint') != self.fingerprint:
+                return {}
+            records[record['start']] = record
+        return records
+
+    def load_chunk(self, start):
+        """
+        读取一段的 checkpoint, 子进程每次开始处理一段的时候读取, 这样同一次运行中重试的时候也能从上次提交的位置继续
+
+        :param start: 这一段开始的字节位置
+        :return: checkpoint 记录, 没有或者指纹对不上的话返回 None
+        """
+
+        chunk_file = self.chunk_file(start)
+        if not os.path.isfile(chunk_file):
+            return None
+        with open(chunk_file, 'r') as r:
+            record = json.load(r)
+        if record.get('fingerprint') != self.fingerprint:
+            return None
+        return record
+
+    def save(self, start, end, offset, lines, committed_rows, done=False, success_rows=0, failed_rows=0):
+        """
+        原子地写入一段的 checkpoint, 写到一半崩溃也不会留下损坏的文件
+
+        :param start: 这一段开始的字节位置
+        :param end: 这一段结束的字节位置
+        :param offset: 已经提交的数据结束的字节位置
+        :param lines: 从 start 到 offset 一共读了多少行
+        :param committed_rows: 从 start 到 offset 一共提交了多少条数据
+        :param done: 这一段是否已经全部处理完
+        :param success_rows: 已经提交的数据中插入成功的条数
+        :param failed_rows: 已经提交的数据中插入失败的条数
+        """
+
+        if not os.path.isdir(self.manifest_path):
+            os.makedirs(self.manifest_path, exist_ok=True)
+
+        record = {
+            'file_path': os.path.realpath(self.file_path),
+            'table_name': self.table_name,
+            'fingerprint': self.fingerprint,
+            'start': start,
+            'end': end,
+            'offset': offset,
+            'lines': lines,
+            'committed_rows': committed_rows,
+            'success_rows': success_rows,
+            'failed_rows': failed_rows,
+            'done': done,
+        }
+        fd, temp_path = tempfile.mkstemp(prefix='.chunk_', dir=self.manifest_path)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(record, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.chunk_file(start))
+
+    def clear(self):
+        """删除这次导入的 manifest"""
+        if not os.path.isdir(self.manifest_path):
+            return
+        for name in os.listdir(self.manifest_path):
+            os.remove(os.path.join(self.manifest_path, name))
+        os.rmdir(self.manifest_path)
@@ -0,0 +1,184 @@
+# encoding: utf8
+#!/usr/bin/env python3
+import itertools
+from operator import methodcaller
+try:
+    import numpy
+except ImportError:
+    # numpy 是可选的, 没有安装的时候 --vectorize 不可用, 还是一行一行清洗
+    numpy = None
+
+# 需要从数据中剔除的 \r \n \t 坏字符
+CLEAN_TABLE = str.maketrans('', '', '\r\n\t')
+# --vectorize 每一批清洗的行数
+VECTORIZE_BATCH_ROWS = 4096
+
+
+def clean_file_string(string_list):
+    """
+    wash data and remove \r \n \t etc bad data
+    剔除文件中的 \r \n \t 的坏数据, 数据作为参数传给 executemany, 不需要再转义 \ " '
+    仅仅适用于文件 string
+    :param string_list: string list
+    :return: 源数据
+    """
+
+    # 剔除 \r \n \t 的坏数据, translate 只需要遍历一次字符串
+    if isinstance(string_list, list):
+        string_list = [ _.translate(CLEAN_TABLE) for _ in string_list ]
+    else:
+        string_list = string_list.translate(CLEAN_TABLE)
+    return string_list
+
+
+def split_txt_line(line, separator):
+    """去掉 txt 文件一行两头的空格, 再按 separator 分隔"""
+    return line.strip().split(separator)
+
+
+def repair_txt_fields(lines, column_count):
+    """
+    清洗 split_txt_line 分隔出来的每一列, 去掉空的列, 再截断或者用空字符串补齐到 column_count 列
+
+    :param lines: 数据列表
+    :param column_count: 列的个数
+    :return: 数据列表
+    """
+
+    data_line_list = []
+    lines = clean_file_string(lines)
+    lines = [ _.strip() for _ in lines if _ ]
+
+    if len(lines) == column_count:
+        data_line_list = lines
+    elif len(lines) > column_count:
+        # split出来的长度 大于 column_list 的长度
+        for i in range(column_count):
+            data_line_list.append(lines[i])
+    else:
+        # split 出来的长度 小于 column_list 的长度, 剩余的用 空字符 填充
+        data_line_list = lines
+        for _ in range(column_count - len(data_line_list)):
+            data_line_list.append('')
+    return data_line_list
+
+
+def clean_txt_line(line, separator, column_count):
+    """
+    把 txt 文件的一行按 separator 分隔, 清洗之后对齐到 column_count 列
+
+    :param line: 一行字符串
+    :param separator: 分隔符
+    :param column_count: 列的个数
+    :return: 数据列表
+    """
+
+    return repair_txt_fields(split_txt_line(line, separator), column_count)
+
+
+def remove_batch_chars(text, keep_tab=False):
+    """
+    按批清洗的时候一批数据用 \n 连接成一个字符串, 所以只去掉 \r \t, \n 留着用来拆开每一列.
+    字符串中有中文等非 ASCII 字符的时候 translate 一个字符一个字符查表, 一批数据这么长的字符串用 replace 快几十倍
+
+    :param text: 一批数据连接成的字符串
+    :param keep_tab: 用 \t 分隔的 txt 文件, 拆开之后每一列都不会再有 \t
+    :return: 字符串
+    """
+
+    text = text.replace('\r', '')
+    return text if keep_tab else text.replace('\t', '')
+
+
+def vectorize_supported(separator=None):
+    """
+    --vectorize 能不能用: 需要安装 numpy, txt 文件的分隔符只能是一个字符, 并且不能是 \r 或者 \n,
+    否则先去掉坏字符再拆分和一行一行清洗的结果会不一样
+
+    :param separator: txt 文件的分隔符, csv 文件为 None
+    :return: True / False
+    """
+
+    if numpy is None:
+        return False
+    return separator is None or (len(separator) == 1 and separator not in '\r\n')
+
+
+def clean_csv_batch(rows):
+    """
+    按批清洗 csv.reader 解析出来的很多行, 结果和每一行调用 clean_file_string 一样.
+    所有的列用 \n 连接成一个字符串, 一次去掉坏字符再拆开, 然后按每一行的列数重新分组, 不需要在 python 里面
+    一列一列处理. 每一行的列数都一样的时候 (正常的文件) 用 numpy reshape, 否则按列数切片
+
+    :param rows: 数据列表的列表
+    :return: 清洗之后的数据列表的列表
+    """
+
+    fields = list(itertools.chain.from_iterable(rows))
+    text = '\n'.join(fields)
+    if not rows or text.count('\n') != len(fields) - 1:
+        # 有的列本身就有 \n, 拆开之后对不上, 一行一行清洗
+        return [clean_file_string(_) for _ in rows]
+    fields = remove_batch_chars(text).split('\n')
+    counts = numpy.fromiter(map(len, rows), dtype=numpy.intp, count=len(rows))
+    if counts.min() == counts.max():
+        return numpy.array(fields, dtype=object).reshape(len(rows), counts[0]).tolist()
+    return [fields[end - count:end] for count, end in zip(counts.tolist(), numpy.cumsum(counts).tolist())]
+
+
+def clean_txt_batch(lines, separator, column_count):
+    """
+    按批清洗 txt 文件的很多行, 结果和每一行调用 clean_txt_line 一样, 调用之前先用 vectorize_supported 检查分隔符.
+
+    所有的行去掉两头的空格之后用 \n 连接成一个字符串, 一次去掉坏字符, 再把分隔符换成 \n 拆成所有的列.
+    去掉空的列, 截断和补齐到 column_count 列都用 numpy 的下标运算一次完成: 每一列属于哪一行, 去掉空的列之后
+    是这一行的第几列, 超过 column_count 的丢掉, 没有的位置是空字符串
+
+    :param lines: 字符串列表
+    :param separator: 分隔符, 只能是一个字符
+    :param column_count: 列的个数
+    :return: 数据列表的列表
+    """
+
+    lines = list(map(str.strip, lines))
+    # 每一行拆开之后有多少列
+    counts = numpy.fromiter(map(methodcaller('count', separator), lines), dtype=numpy.intp, count=len(lines)) + 1
+    text = remove_batch_chars('\n'.join(lines), keep_tab=(separator == '\t'))
+    fields = text.replace(separator, '\n').split('\n')
+    if len(fields) != counts.sum():
+        # 行中间有 \n, 拆开之后对不上, 一行一行清洗
+        return [clean_txt_line(_, separator, column_count) for _ in lines]
+
+    if counts.min() == column_count == counts.max() and '' not in fields:
+        # 最常见的情况: 每一行的列数都对, 也没有空的列
+        return numpy.array(list(map(str.strip, fields)), dtype=object).reshape(len(lines), column_count).tolist()
+
+    keep = numpy.fromiter(map(len, fields), dtype=numpy.intp, count=len(fields)) > 0
+    values = numpy.array(list(map(str.strip, fields)), dtype=object)[keep]
+    row_indexes = numpy.repeat(numpy.arange(len(lines)), counts)[keep]
+    kept_counts = numpy.bincount(row_indexes, minlength=len(lines))
+    positions = numpy.arange(len(row_indexes)) - (numpy.cumsum(kept_counts) - kept_counts)[row_indexes]
+    inside = positions < column_count
+    data = numpy.full((len(lines), column_count), '', dtype=object)
+    data[row_indexes[inside], positions[inside]] = values[inside]
+    return data.tolist()
+
+
+def vectorize_rows(items, clean_batch, batch_rows=VECTORIZE_BATCH_ROWS):
+    """
+    把每一项最后一个元素是原始数据的生成器, 例如 (行号, 字节位置, 一行字符串), 按 batch_rows 行分批,
+    每一批用 clean_batch 一次清洗完, 再一项一项返回, 最后一个元素换成清洗之后的数据列表
+
+    :param items: 生成器, 每一项是元组
+    :param clean_batch: clean_csv_batch 或者 clean_txt_batch, 参数是原始数据的列表
+    :param batch_rows: 每一批的行数
+    :return: 生成器
+    """
+
+    items = iter(items)
+    while True:
+        batch = list(itertools.islice(items, batch_rows))
+        if not batch:
+            return
+        for item, row in zip(batch, clean_batch([_[-1] for _ in batch])):
+            yield item[:-1] + (row, )
@@ -1,4 +1,5 @@
 # encoding: utf8
+import os
 import sys
 from argparse import ArgumentParser
 
@@ -19,10 +20,16 @@ class CmdLineParser(ArgumentParser):
         mandatory = parser.add_argument_group("Mandatory module",
                                               "arguments that have to be passed for the program to run")
         mandatory.add_argument('-i', '--csv-to-database', metavar='CSV-FILE-PATH', dest='csv_to_database',
-                               help='insert data that extracted from csv file to MYSQL database')
+                               help='insert data that extracted from csv file to MYSQL database, it can also be a '
+                                    'folder (all *.csv files in it) or a quoted glob like "dumps/**/*.csv", then all '
+                                    'files are imported into one table by --workers processes, largest file first. '
+                                    '.gz, .bz2 and .xz files, named pipes and - (stdin) are read as a stream without '
+                                    'decompressing to disk, for example: zcat dump.csv.gz | grep @ | %(prog)s -i -')
         mandatory.add_argument('-t', '--txt-to-database', metavar='TXT-FOLDER-PATH', dest='txt_to_database',
-                               help='insert data that extracted from txt file or contain txt files folder to MYSQL '
-                                    'database')
+                               help='insert data that extracted from txt file or contain txt files folder (all *.txt '
+                                    'files in it) or a quoted glob to MYSQL database, multiple files are imported into '
+                                    'one table by --workers processes, largest file first. compressed files, named pipes '
+                                    'and - (stdin) are read as a stream like -i')
 
         # Options module
         options = parser.add_argument_group("Options module", 'set up parameter to control this program or control log '
@@ -30,7 +37,82 @@ class CmdLineParser(ArgumentParser):
         options.add_argument('-f', '--fast', action='store_true', dest='fast', default=False,
                              help="hit -f or --fast option to toggle fast mode with multiprocessing to handle big csv "
                                   "data or others big file, multiprocessing amount is that according to your computer "
-                                  "CPU core amount. for example intel i7 CPU is 4 core so multiprocessing amount is 4")
+                                  "CPU core amount. for example intel i7 CPU is 4 core so multiprocessing amount is 4. "
+                                  "it works for both -i and -t")
+        options.add_argument('--workers', dest='workers', metavar='N', type=int, default=os.cpu_count(),
+                             help='bond for -f option or a folder/glob of files, the number of worker processes, '
+                                  'default is the CPU core amount of your computer')
+        options.add_argument('--chunk-size', dest='chunk_size', metavar='BYTES', type=int, default=32*1024*1024,
+                             help='bond for -f option, split the file into chunks of about BYTES bytes and put them '
+                                  'on a work queue, an idle worker takes the next chunk and the chunk of a dead worker '
+                                  'is handed to a new one, default is 33554432 (32MB)')
+        options.add_argument('--stall-timeout', dest='stall_timeout', metavar='SECONDS', type=float, default=600,
+                             help='bond for -f option or a folder/glob of files, a worker that makes no progress for '
+                                  'SECONDS seconds (for example it hangs on a database call that never returns) is '
+                                  'terminated and its chunk or file is retried like the one of a crashed worker, '
+                                  'default is 600, 0 to disable')
+        options.add_argument('--pipeline', action='store_true', dest='pipeline', default=False,
+                             help='toggle pipeline mode, parser processes read, parse and clean rows and put them in '
+                                  'batches on a bounded queue, writer processes take the batches and insert them into '
+                                  'database, so parsing and waiting for the database happen at the same time. it '
+                                  'works for both -i and -t and takes precedence over -f, --resume is not supported')
+        options.add_argument('--parsers', dest='parsers', metavar='N', type=int,
+                             default=max(1, (os.cpu_count() or 2) // 2),
+                             help='bond for --pipeline option, the number of parser processes, default is half of '
+                                  'the CPU core amount')
+        options.add_argument('--writers', dest='writers', metavar='N', type=int,
+                             default=max(1, (os.cpu_count() or 2) // 2),
+                             help='bond for --pipeline option, the number of writer processes, every writer uses its '
+                                  'own database connection, default is half of the CPU core amount')
+        options.add_argument('--queue-size', dest='queue_size', metavar='BATCHES', type=int, default=64,
+                             help='bond for --pipeline and --writer-threads option, the max number of batches '
+                                  '(--batch-size rows each) waiting between parsers and writers, parsers wait when the '
+                                  'queue is full so a slow database can not use up the memory, default is 64')
+        options.add_argument('--writer-threads', dest='writer_threads', metavar='N', type=int, default=0,
+                             help='parse the file once in a single process and insert the batches with N writer '
+                                  'threads, every thread borrows its own connection from the connection pool. it is '
+                                  'good for a remote database where the network round trip is slower than parsing, '
+                                  'works for both -i and -t and takes precedence over -f, --pipeline takes precedence '
+                                  'over it, --resume is not supported. default is 0 (disabled)')
+        options.add_argument('--infer-schema', action='store_true', dest='infer_schema', default=False,
+                             help='read a sample from the start of the input and pick the narrowest column types: '
+                                  'INT / BIGINT, DATE / DATETIME, VARCHAR(n) sized from the longest value, TEXT for '
+                                  'long values, instead of varchar(300) for every column')
+        options.add_argument('--sample-rows', dest='sample_rows', metavar='ROWS', type=int, default=10000,
+                             help='bond for --infer-schema option, the max number of rows in the sample, '
+                                  'default is 10000')
+        options.add_argument('--sample-bytes', dest='sample_bytes', metavar='BYTES', type=int, default=16*1024*1024,
+                             help='bond for --infer-schema option, the max number of bytes in the sample, '
+                                  'default is 16MB')
+        options.add_argument('--type-margin', dest='type_margin', metavar='FACTOR', type=float, default=2.0,
+                             help='bond for --infer-schema option, multiply the longest length and the largest number '
+                                  'in the sample by FACTOR so rows after the sample still fit, default is 2.0')
+        options.add_argument('--column-type', dest='column_types', metavar='COLUMN=TYPE', action='append',
+                             help='set the type of one column, overrides --infer-schema, can be used more than once, '
+                                  'for example: --column-type id=bigint --column-type email=varchar(128)')
+        options.add_argument('--index', dest='indexes', metavar='COL[,COL]', action='append',
+                             help='build an index on COL after the load, COL1,COL2 builds one index on both columns, '
+                                  'can be used more than once. the table is created without indexes and all of them '
+                                  'are built by one ALTER TABLE when all rows are inserted, for example: '
+                                  '--index email --index username,age')
+        options.add_argument('--primary-key', dest='primary_key', metavar='COL[,COL]',
+                             help='add a primary key on COL after the load, built by the same ALTER TABLE as --index')
+        options.add_argument('--bulk-session', action='store_true', dest='bulk_session', default=False,
+                             help='turn off unique_checks, foreign_key_checks and sql_log_bin (skipped without the '
+                                  'privilege) on every loading connection, the session is restored after the load '
+                                  'and reported in the summary. rows are not written to the binlog, so do not use it '
+                                  'on a replication source unless the replicas are loaded separately')
+        options.add_argument('--dedupe', dest='dedupe', metavar='COL[,COL]', nargs='?', const='',
+                             help='skip duplicate rows before they are inserted, compare the whole row or only the '
+                                  'given key columns, for example: --dedupe email. the keys are kept in memory and '
+                                  'spilled to disk partitions beyond --dedupe-memory. with -f the rows are routed to '
+                                  'the writer processes by key hash (like --pipeline), a folder of files is imported '
+                                  'by one process, --resume is not supported')
+        options.add_argument('--dedupe-memory', dest='dedupe_memory', metavar='MB', type=int, default=256,
+                             help='bond for --dedupe option, the memory budget of the keys in MB, default is 256')
+        options.add_argument('--spill-dir', dest='spill_dir', metavar='DIR',
+                             help='bond for --dedupe option, the folder for the spilled partitions, default is the '
+                                  'system temp folder')
         options.add_argument('-F', '--field-separator', metavar='FS', dest='separator', default=' ',
                              help='bond for -t options, use fs for the input field separator(the value of the FS '
                                   'predefined variable), this option like awk -F option to separate a line with the '
@@ -38,6 +120,66 @@ class CmdLineParser(ArgumentParser):
         options.add_argument('-c', '--column-list', nargs='+', metavar='COLUMN-LIST', dest='column_list',
                              help="bond for -t options, provide database table column name list, this option will "
                                   "create table in database and insert data into database according this column list")
+        options.add_argument('--batch-size', dest='batch_size', metavar='ROWS', type=int, default=1000,
+                             help='group ROWS rows into one multi-row INSERT statement, default is 1000. if a batch '
+                                  'insert failed, it will be split in half repeatedly until the bad rows are found, so '
+                                  'only the bad rows go to the reject file')
+        options.add_argument('--vectorize', action='store_true', dest='vectorize',
+                             help='clean the rows in batches of 4096 instead of one by one: the bad characters of a '
+                                  'whole batch are removed with one call and the empty column filter, truncating and '
+                                  'padding to the column count are done with numpy index arrays. it needs numpy, '
+                                  'without numpy or with a -F longer than one character the rows are cleaned one by '
+                                  'one')
+        options.add_argument('--max-packet-size', dest='max_packet_size', metavar='BYTES', type=int,
+                             default=1024*1024,
+                             help='the max size of one multi-row INSERT statement in bytes, default is 1048576 '
+                                  '(1MB), keep it lower than the max_allowed_packet of your MYSQL server')
+        options.add_argument('--engine', dest='engine', choices=['insert', 'load-data'], default='insert',
+                             help='how to move data into database, "insert" use multi-row INSERT statements, '
+                                  '"load-data" write cleaned rows to a temporary spool file in chunks and import it with '
+                                  'LOAD DATA LOCAL INFILE, it is much faster but the MYSQL server must enable '
+                                  'local_infile. default is insert')
+        options.add_argument('--load-chunk-size', dest='load_chunk_size', metavar='ROWS', type=int, default=100000,
+                             help='bond for --engine load-data, import ROWS rows with one LOAD DATA statement, default '
+                                  'is 100000')
+        options.add_argument('--commit-every', dest='commit_every', metavar='ROWS', type=int, default=0,
+                             help='commit the transaction every ROWS rows instead of once per file (or per chunk with '
+                                  '-f), the commit always happens right after a batch is sent, for example 100000 to '
+                                  'keep the transactions small and let --resume continue from the middle of a file. '
+                                  'default is 0, commit only at the end')
+        options.add_argument('--commit-interval', dest='commit_interval', metavar='SECONDS', type=float, default=0,
+                             help='also commit the transaction when SECONDS seconds passed since the last commit, '
+                                  'default is 0 (disabled)')
+        options.add_argument('--resume', action='store_true', dest='resume', default=False,
+                             help='bond for -i options, -t with -f or a -t folder/glob, resume the last interrupted import of the same '
+                                  'file and table from the checkpoint manifest in checkpoint/ folder, the already '
+                                  'committed rows will be skipped. a checkpoint is written at every commit, so use '
+                                  'it with --commit-every to resume from the middle of a file')
+        options.add_argument('--reject-file', dest='reject_file', metavar='FILE',
+                             help='write every row that failed to insert as one JSON line (table, columns, source '
+                                  'file, line number, raw fields, MYSQL error code and message) to FILE instead of '
+                                  'the terminal, debug.log and error.log, only the first rows are shown in the '
+                                  'terminal. it is emptied at the start of an import unless --resume. default is '
+                                  'logs/rejects.jsonl')
+        options.add_argument('--replay-rejects', dest='replay_rejects', metavar='FILE',
+                             help='insert the rows of a reject file again through the batched insert, for example '
+                                  'after fixing the "fields" of the rows or the table. the rows that fail again are '
+                                  'written to --reject-file, or to FILE.replay.jsonl if it is the same file')
+        options.add_argument('--stats-file', dest='stats_file', metavar='FILE',
+                             help='append the time every process spent counting lines, splitting the file, sending '
+                                  'rows and committing, and its inserted rows, as one JSON line per process to FILE. '
+                                  'it is emptied at the start of an import unless --resume, see benchmarks/')
+        options.add_argument('--profile', action='store_true', dest='profile',
+                             help='time every stage (read, parse, clean, dedupe, format, execute, reject, commit) of '
+                                  'every process with monotonic timers and latency histograms, merge them into '
+                                  'PROFILE-DIR/profile.json at the end and show where the time went. the per process '
+                                  'records go to --stats-file, default is PROFILE-DIR/stats.jsonl')
+        options.add_argument('--cprofile', action='store_true', dest='cprofile',
+                             help='bond for --profile, every worker process of -f, --pipeline and multiple files also '
+                                  'dumps a cProfile file PROFILE-DIR/ROLE_PID.prof, view it with python3 -m pstats')
+        options.add_argument('--profile-dir', dest='profile_dir', metavar='PROFILE-DIR',
+                             help='bond for --profile, directory of the profile report and cProfile files, default '
+                                  'is logs/profile')
         options.add_argument('--log-level', dest='log_level', metavar='INT', type=int, default=1,
                              help='set output log level, default level is 1. for high level can record more details log '
                                   'information and the biggest level is 3')
@@ -50,12 +192,28 @@ class CmdLineParser(ArgumentParser):
         database = parser.add_argument_group("Database module",
                                              "database operation option and whether turn on verbose mode to output more"
                                              " details info")
+        database.add_argument('--backend', dest='backend', choices=['mysql', 'postgresql', 'sqlite'], default='mysql',
+                              help='which database to move data into, "mysql" use pymysql and multi-row INSERT '
+                                   'statements, "postgresql" use psycopg2 and COPY FROM STDIN, "sqlite" needs no '
+                                   'database server and -D is the path of the database file. default is mysql')
+        database.add_argument('--host', dest='host', metavar='HOST', default='127.0.0.1',
+                              help='database host, default is 127.0.0.1, ignored by the sqlite backend')
+        database.add_argument('--port', dest='port', metavar='PORT', type=int,
+                              help='database port, default is 3306 for mysql and 5432 for postgresql')
         database.add_argument('-D', '--database', metavar='DATABASE', dest='database_name',
                               help='designated database name custom in mysql database to storage data, default database '
                                    'name in lib/settings.py file without this option')
         database.add_argument('-T', '--table-name', metavar='TABLE-NAME', dest='table_name',
                              help='designated table name in mysql database to storage data, default table name in '
                                   'lib/settings.py file without this option')
+        database.add_argument('--pool-size', dest='pool_size', metavar='INT', type=int, default=4,
+                              help='max connections of the database connection pool used by writer threads, default '
+                                   'is 4. in fast mode every worker process always opens its own connection')
+        database.add_argument('--connect-timeout', dest='connect_timeout', metavar='SECONDS', type=int, default=10,
+                              help='timeout in seconds when connecting to the database, default is 10')
+        database.add_argument('--health-check', dest='health_check', metavar='SECONDS', type=int, default=30,
+                              help='ping a pooled connection before reusing it when it has been idle for SECONDS '
+                                   'seconds and reconnect it if it is broken, -1 to disable, default is 30')
         database.add_argument('-m', '--mysql-command', metavar='DATABASE-CMD', dest='mysql_command',
                               help='providing a database interface, it will show command result when you type database '
                                    'command with -m option, for example: -m "show databases"')
@@ -68,7 +226,7 @@ class CmdLineParser(ArgumentParser):
 
         # Clean module
         clean_cache = parser.add_argument_group('Clean module', 'clean redundant cache')
-        clean_cache.add_argument('--clean-cache', action='store_true', dest='clean_cache', help='clean log files')
+        clean_cache.add_argument('--clean-cache', action='store_true', dest='clean_cache', help='clean log files and checkpoint manifests')
 
         opts = parser.parse_args()
 
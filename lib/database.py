@@ -1,20 +1,171 @@
-import pymysql
-from lib.settings import DATABASE_USER, DATABASE_PASSWORD
+import os
+import re
+import time
+import queue
+import tempfile
+import threading
+from contextlib import nullcontext
+from lib.settings import DATABASE_USER, DATABASE_PASSWORD, REJECT_FILE
 from lib.print_formatter import ColorFormatter
+from lib.schema import null_columns_of
+from lib.reject import RejectFile
+from lib.split_file import find_undecodable
+from lib.stats import PhaseTimer, StageProfiler, write_stats
+from lib.backends import get_backend
+
+# 每个 Database 对象最多在终端显示这么多条插入失败的数据, 其他的只写进 reject 文件
+REJECT_CONSOLE_LIMIT = 10
+# 没有 --profile 的时候 Database.stage() 返回的什么都不做的 context manager
+NO_STAGE = nullcontext()
+
+# LOAD DATA 默认用 \ 做转义字符, 写进临时文件之前要把数据中的 \ 转义掉
+LOAD_DATA_ESCAPE_TABLE = str.maketrans({'\\': '\\\\'})
+
+
+def load_data_fields(row):
+    """把 LOAD DATA 临时文件中的一行还原成数据列表, \\N 还原为 None"""
+    return [None if _ == '\\N' else _.replace('\\\\', '\\') for _ in row.rstrip('\n').split('\t')]
+
+
+class ConnectionPool(object):
+    """
+    A small thread-safe connection pool, 每个连接同一时间只会被一个 Database 对象使用, 连接由 backend 创建
+
+    Usage example:
+    '''
+    pool = ConnectionPool(host='127.0.0.1', database='testdb', pool_size=4)
+    database = Database(host='127.0.0.1', logger=logger, database='testdb', pool=pool)
+    ...
+    database.close()
+    '''
+
+    注意: 连接不能跨进程共享, 多进程的时候每个进程都要创建自己的 ConnectionPool
+    """
+
+    def __init__(self, host, database, pool_size=4, connect_timeout=10, health_check=30, local_infile=False,
+                 backend='mysql', port=None):
+        """
+        :param host: database host
+        :param database: database name, SQLite 为数据库文件的路径
+        :param pool_size: 最多创建多少个连接, 连接都被借走的时候 get_connection 会等待
+        :param connect_timeout: 创建连接的超时时间(秒)
+        :param health_check: 连接空闲超过多少秒, 借出去之前先 ping 一下, 断开了就重连, 小于 0 不检查
+        :param local_infile: 是否允许 LOAD DATA LOCAL INFILE
+        :param backend: lib/backends 中的名字, 例如 mysql, postgresql, sqlite
+        :param port: database port, None 为这个数据库默认的端口
+        """
+
+        self.backend = get_backend(backend)
+        self.host = host
+        self.port = port
+        self.database = database
+        self.pool_size = max(1, pool_size)
+        self.connect_timeout = connect_timeout
+        self.health_check = health_check
+        self.local_infile = local_infile
+        # 空闲的连接, 每一项是 (连接, 归还的时间)
+        self.idle_connections = queue.LifoQueue()
+        self.created_count = 0
+        self.lock = threading.Lock()
+
+    def create_connection(self):
+        """create a new connection"""
+        return self.backend.connect(self.host, self.port, DATABASE_USER, DATABASE_PASSWORD, self.database,
+                                    connect_timeout=self.connect_timeout, local_infile=self.local_infile)
+
+    def get_connection(self, timeout=None):
+        """
+        借一个连接, 有空闲的就用空闲的, 没有空闲的并且还没到 pool_size 就新建一个, 否则等待别人归还
+
+        :param timeout: 等待的超时时间(秒), None 为一直等待
+        :return: connection
+        """
+
+        try:
+            conn, release_time = self.idle_connections.get_nowait()
+        except queue.Empty:
+            with self.lock:
+                can_create = self.created_count < self.pool_size
+                if can_create:
+                    self.created_count += 1
+            if can_create:
+                try:
+                    return self.create_connection()
+                except:
+                    with self.lock:
+                        self.created_count -= 1
+                    raise
+            conn, release_time = self.idle_connections.get(timeout=timeout)
+
+        if 0 <= self.health_check <= time.time() - release_time:
+            try:
+                self.backend.ping(conn)
+            except Exception:
+                # 重连也失败了, 换一个新的连接
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+                try:
+                    conn = self.create_connection()
+                except:
+                    with self.lock:
+                        self.created_count -= 1
+                    raise
+        return conn
+
+    def release_connection(self, conn):
+        """归还连接"""
+        self.idle_connections.put((conn, time.time()))
+
+    def close_all(self):
+        """关闭所有空闲的连接"""
+        while True:
+            try:
+                conn, _ = self.idle_connections.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                conn.close()
+            except Exception:
+                pass
+            with self.lock:
+                self.created_count -= 1
 
 
 class Database(object):
     """Operating database class, including insert, execute sql command, drop etc..."""
 
-    def __init__(self, host, logger, database):
+    def __init__(self, host, logger, database, batch_size=1000, max_packet_size=1024*1024, engine='insert',
+                 load_chunk_size=100000, pool=None, connect_timeout=10, health_check=30, commit_every=0,
+                 commit_interval=0, null_columns=None, bulk_session=False, reject_file=None, stats_file=None,
+                 backend='mysql', port=None, profile=None, vectorize=False):
         self.host = host
+        self.port = port
         self.database=database
         self.logger = logger
-        self.conn = pymysql.connect(host=self.host, user=DATABASE_USER, password=DATABASE_PASSWORD,
-                                    database=self.database, charset='utf8')
         # logger
         self.debug_logger = self.logger.get_logger('debug_logger')
         self.error_logger = self.logger.get_logger('error_logger')
+        # 和具体数据库有关的操作都交给 backend, 见 lib/backends
+        self.backend = get_backend(backend)
+        # 插入数据的方式: insert 使用这个数据库最快的批量写入 (MYSQL 为多行 INSERT 语句, PostgreSQL 为 COPY),
+        # load-data 使用 LOAD DATA LOCAL INFILE, 只有 MYSQL 支持
+        if engine == 'load-data' and not self.backend.load_data:
+            self.debug_logger.warning('{} backend does not support --engine load-data, use insert'.format(
+                self.backend.name))
+            engine = 'insert'
+        self.engine = engine
+        # 没有传入连接池的话就自己创建一个只有一个连接的连接池, 每个进程/线程都必须使用自己的 Database 对象
+        if pool is None:
+            pool = ConnectionPool(host=self.host, database=self.database, pool_size=1,
+                                  connect_timeout=connect_timeout, health_check=health_check,
+                                  local_infile=(self.engine == 'load-data'), backend=self.backend, port=self.port)
+        self.pool = pool
+        self.conn = self.pool.get_connection()
+        # 批量插入, 每一批最多的行数和最大的 sql 语句长度(字节)
+        self.batch_size = max(1, batch_size)
+        self.max_packet_size = max_packet_size
         # 初始化数据库, 返回 cursor 指针
         self.cursor = self.init_database()
         # calculate successful insert sql count
@@ -24,49 +175,184 @@ class Database(object):
         # calculate all of insert sql count
         self.insert_total_count = 0
 
+        # load-data 模式下每次 LOAD DATA 的行数
+        self.load_chunk_size = max(1, load_chunk_size)
+        # 还没有发送到数据库的行, 每一项是 (源文件行号, 一行数据) 元组
+        self.batch_rows = []
+        self.batch_bytes = 0
+        self.batch_table_name = None
+        self.batch_column_list = None
+        self.batch_column_count = 0
+        # 当前表/列的 INSERT 模板和语句中数据以外的部分的长度(字节)
+        self.batch_template = None
+        self.batch_statement_bytes = 0
+        self.batch_skip_error = False
+        # 缓存每个 表/列 对应的 INSERT 模板, key 为 (table_name, column_list)
+        self.insert_templates = {}
+        # 数字和日期类型的列, 空字符串插入为 NULL, 否则严格模式下会插入失败
+        self.null_columns = set(null_columns or [])
+        self.batch_null_indexes = []
+        # 每一列是不是 null_columns, 热点路径上按位置 zip, 不需要每一列都查一次列表
+        self.batch_null_mask = []
+        # create_table 创建的列和类型, 导入完成之后建索引的时候用
+        self.table_columns = []
+        self.column_types = {}
+        # 发送数据和提交事务的用时, 指定了 stats_file 的话 close() 的时候写进文件
+        self.timer = PhaseTimer()
+        self.stats_file = stats_file
+        self.stats_saved = False
+        # --profile 的配置, 包括 dir 和 cprofile. 这时候还记录每个阶段的次数和用时直方图, 调用 insert_data 的地方
+        # 用同一个 profiler 记录读取, 解析和清洗, 见 lib/stats.py 中的 StageProfiler
+        self.profile = profile
+        self.profiler = StageProfiler() if profile else None
+        # --vectorize 的时候调用 insert_data 的地方用 numpy 按批清洗数据, 见 lib/clean.py
+        self.vectorize = vectorize
+
+        # 插入失败的行写进 reject 文件, 不再每一行都写终端, debug.log 和 error.log. None 为 lib/settings.py 中的
+        # REJECT_FILE. 记录在提交事务的时候才写进文件, 没有提交的数据对应的记录在 close() 的时候丢弃
+        self.reject_file = RejectFile(reject_file or REJECT_FILE)
+        self.reject_shown = 0
+        # 当前导入的源文件, 写进 reject 文件
+        self.source_file = None
+
+        # 批量导入的会话设置, 修改之前的值和因为没有权限等原因跳过的变量
+        self.session_saved = {}
+        self.session_skipped = {}
+        if bulk_session:
+            self.apply_bulk_session()
+
+        # 定期提交事务, 每 commit_every 行或者每 commit_interval 秒提交一次, 0 为只在最后提交一次
+        self.commit_every = commit_every
+        self.commit_interval = commit_interval
+        # 已经提交的事务次数, 以及最后一次提交的时候处理过的总行数, 成功和失败的条数和时间
+        self.commit_count = 0
+        self.committed_total_count = 0
+        self.committed_success_count = 0
+        self.committed_failed_count = 0
+        self.last_commit_time = time.time()
+
+    def stage(self, name):
+        """--profile 的时候把 with 里面的用时记录为 name 阶段, 否则什么都不做"""
+        return self.profiler.stage(name) if self.profiler else NO_STAGE
+
     def init_database(self):
         """Return cursor init database"""
-        cursor = self.conn.cursor(cursor=pymysql.cursors.DictCursor)
-        return cursor
+        return self.backend.open_cursor(self.conn, self.engine, self.max_packet_size)
+
+    def apply_bulk_session(self):
+        """
+        把这个连接切换到批量导入的会话设置, 例如 MYSQL 关闭 unique_checks, foreign_key_checks 和 sql_log_bin,
+        修改之前的值保存在 self.session_saved 里面, self.restore_session() 或者 self.close() 的时候恢复
+
+        :return: 成功修改的变量名列表
+        """
+
+        for name, value in self.backend.bulk_session_variables:
+            try:
+                with self.backend.savepoint(self.cursor):
+                    self.cursor.execute(self.backend.variable_sql(name))
+                    rows = self.cursor.fetchall()
+                    old_value = rows[0]['value'] if rows else None
+                    self.cursor.execute(self.backend.set_variable_sql(name, value))
+                self.session_saved[name] = old_value
+            except self.backend.Error as e:
+                # 例如 sql_log_bin 需要 SUPER 或者 SYSTEM_VARIABLES_ADMIN 权限
+                self.session_skipped[name] = str(e)
+                self.debug_logger.warning('skip bulk session variable {}: {}'.format(name, e))
+        self.debug_logger.debug('bulk session applied: {}, skipped: {}'.format(
+            list(self.session_saved), list(self.session_skipped)))
+        return list(self.session_saved)
+
+    def restore_session(self):
+        """
+        恢复 self.apply_bulk_session() 修改过的会话变量, 读不到原来的值的变量恢复为全局的默认值
+
+        :return: 成功恢复的变量名列表
+        """
+
+        restored = []
+        for name, old_value in self.session_saved.items():
+            try:
+                with self.backend.savepoint(self.cursor):
+                    self.cursor.execute(self.backend.set_variable_sql(name, old_value))
+                restored.append(name)
+            except self.backend.Error as e:
+                self.debug_logger.error('restore session variable {} failed: {}'.format(name, e))
+                self.error_logger.error('restore session variable {} failed: {}'.format(name, e))
+        self.session_saved = {}
+        self.debug_logger.debug('bulk session restored: {}'.format(restored))
+        return restored
+
+    def add_indexes(self, table_name, primary_key=None, indexes=None):
+        """
+        导入完成之后建立主键和所有的二级索引, 比导入之前建索引每一行都要维护索引快很多.
+        MYSQL 用一条 ALTER TABLE, TEXT 类型的列只用前 255 个字符建索引, 其他数据库见 backend.index_sql_list
+
+        Usage example:
+        '''
+        database.add_indexes('test_table', primary_key=['id'], indexes=[['email'], ['username', 'age']])
+        '''
+
+        :param table_name: table name
+        :param primary_key: 主键的列名列表, None 为不建主键
+        :param indexes: 索引列表, 每个索引是一个列名列表, 多个列就是联合索引
+        :return: 成功返回 True, 失败返回错误信息
+        """
 
-    def create_table(self, table_name, table_column_list):
+        for index_sql in self.backend.index_sql_list(table_name, primary_key, indexes, self.column_types):
+            self.debug_logger.info(index_sql)
+            try:
+                with self.backend.savepoint(self.cursor):
+                    self.cursor.execute(index_sql)
+                self.conn.commit()
+            except self.backend.Error as e:
+                # 例如主键有重复的值, 数据已经导入了, 只是没有索引
+                ColorFormatter.error('Add index error: {}'.format(e))
+                self.debug_logger.error('{} failed: {}'.format(index_sql, e))
+                self.error_logger.error('{} failed: {}'.format(index_sql, e))
+                return str(e)
+        return True
+
+    def create_table(self, table_name, table_column_list, column_types=None):
+        """
+        :param table_name: table name
+        :param table_column_list: 列名列表
+        :param column_types: {列名: 类型} 字典, 例如 lib/schema.py 推断出来的类型, 没有的列使用 varchar(300)
+        """
+
+        column_types = column_types or {}
+        self.null_columns = set(null_columns_of(column_types))
+        self.table_columns = list(table_column_list)
+        self.column_types = column_types
         try:
-            columns = [ "{} {} {} {}".format(col_name, 'varchar(300)', 'null', 'default NULL') for col_name in table_column_list ]
-            # columns_str data like this ->
-            # id varchar(200) null default NULL, name varchar(200) null default NULL, age varchar(200) null default NULL
-            columns_str = ", ".join(columns)
+            # 不使用自增长索引, 例如 MYSQL 的语句:
+            # CREATE TABLE test_table (id varchar(300) null default NULL, name varchar(300) null default NULL)
+            # CHARACTER SET utf8 COLLATE utf8_general_ci
+            create_table_sql = self.backend.create_table_sql(table_name, table_column_list, column_types)
 
             # write data in debug log
-            self.debug_logger.debug('CREATE TABLE {} ({})'.format(table_name, columns_str))
-            # 创建一个自增长的表
-            # create_table_sql = 'create table {} (id int PRIMARY KEY AUTO_INCREMENT, {})'.format(table_name, columns_str)
-            # 不使用自增长索引
-            create_table_sql = 'CREATE TABLE {} ({}) CHARACTER SET utf8 COLLATE utf8_general_ci'.format(table_name, columns_str)
-            self.cursor.execute(create_table_sql)
+            self.debug_logger.debug(create_table_sql)
+            # 建表失败的时候只撤销这一条语句, 事务中已经写入还没有提交的数据不会丢失
+            with self.backend.savepoint(self.cursor):
+                self.cursor.execute(create_table_sql)
             # 执行事务
             commit_result = self.execute_commit()
             if commit_result:
-                self.debug_logger.info('CREATE TABLE {} ({}) successful'.format(table_name, columns_str))
+                self.debug_logger.info('{} successful'.format(create_table_sql))
                 return 'True'
             else:
-                self.debug_logger.error('CREATE TABLE {} ({}) failed'.format(table_name, columns_str))
-                self.error_logger.error('CREATE TABLE {} ({}) failed'.format(table_name, columns_str))
+                self.debug_logger.error('{} failed'.format(create_table_sql))
+                self.error_logger.error('{} failed'.format(create_table_sql))
                 return 'False'
 
-        except pymysql.err.ProgrammingError as e:
-            ColorFormatter.error('Create table ProgrammingError: {}'.format(e))
-            self.debug_logger.error('Create table ProgrammingError: {}'.format(e))
-            self.error_logger.error('Create table ProgrammingError: {}'.format(e))
-            return 'False'
-
-        except pymysql.err.InternalError as e:
+        except self.backend.Error as e:
             if 'already exists' in str(e):
-                return 'True'
-            else:
-                ColorFormatter.error('Create table InternalError: {}'.format(e))
-                self.debug_logger.error('Create table InternalError: {}'.format(e))
-                self.error_logger.error('Create table InternalError: {}'.format(e))
+                # 表已经存在, 继续往里面插入数据
                 return str(e)
+            ColorFormatter.error('Create table {}: {}'.format(type(e).__name__, e))
+            self.debug_logger.error('Create table {}: {}'.format(type(e).__name__, e))
+            self.error_logger.error('Create table {}: {}'.format(type(e).__name__, e))
+            return 'False'
 
         except Exception as e:
             ColorFormatter.error('Create table Unknow error: {}'.format(e))
@@ -75,52 +361,260 @@ class Database(object):
             self.error_logger.error('Create table Unknow error: {}'.format(e))
             return 'False'
 
-    def insert_data(self, table_name, column_list, data_list, skip_error=False):
+    def get_insert_template(self, table_name, column_list):
+        """
+        获取 表/列 对应的参数化 INSERT 模板, 同一个 表/列 只会生成一次, 例如:
+        INSERT INTO test_table (id, name) VALUES (%s, %s)
+
+        :param table_name: table name
+        :param column_list: all of database table column, 用 , 分隔的字符串
+        :return: INSERT 模板
+        """
+
+        key = (table_name, column_list)
+        template = self.insert_templates.get(key)
+        if template is None:
+            template = self.backend.insert_sql(table_name, column_list)
+            self.insert_templates[key] = template
+            self.debug_logger.debug('cache insert template: %s', template)
+        return template
+
+    def insert_data(self, table_name, column_list, data_list, skip_error=False, line_number=None):
         """
-        insert data into table 这里只执行 sql 插入语句, 但是不提交事务, 提交事务需要 调用 self.execute_commit()
+        insert data into table 这里只把数据放进批量缓冲区, 缓冲区满了才会发送到数据库, 并且不提交事务,
+        提交事务需要 调用 self.execute_commit()
+
+        如果设置了 commit_every 或者 commit_interval, 每次把一批数据发送到数据库之后会检查是否需要提交事务,
+        这样事务的边界总是和批次的边界对齐
+
+        insert 模式下行数达到 batch_size 或者再加一行语句就超过 max_packet_size 字节就用 backend.write_batch 发送,
+        load-data 模式下行数达到 load_chunk_size 就写进临时文件, 再用 LOAD DATA LOCAL INFILE 导入.
+        源文件中不能用 utf8 解码的行 (见 normalize_line) 不会发送到数据库, 直接写进 reject 文件
 
         :param table_name: table name
-        :param column_list: all of database table column
-        :param data_list: data list
+        :param column_list: all of database table column, 用 , 分隔的字符串
+        :param data_list: 一行数据的每一列, 原始数据, 不需要转义
         :param skip_error: skip unimportant insert error information, default False
-        :return:
+        :param line_number: 这一行在源文件中的行号, 插入失败的时候写进 error.log
+        :return: 如果提交了事务返回 True, 这时候这一行以及之前的所有数据都已经提交了
         """
 
-        insert_data_sql = 'INSERT INTO {} ({}) VALUES ({})'.format(table_name, column_list, data_list)
-        try:
-            self.cursor.execute(insert_data_sql)
-            self.insert_success_count += 1
-
-        except pymysql.err.ProgrammingError as e:
-            if not skip_error:
-                ColorFormatter.error('Insert data ProgrammingError: {}, insert data sql is: {}'.format(e, insert_data_sql))
-            self.debug_logger.error('Insert data ProgrammingError: {}, insert data sql is: {}'.format(e, insert_data_sql))
-            self.error_logger.error('Insert data ProgrammingError: {}, insert data sql is: {}'.format(e, insert_data_sql))
-            self.insert_failed_count += 1
+        if (table_name, column_list) != (self.batch_table_name, self.batch_column_list):
+            # 换了表或者列, 先把之前的数据发送出去
+            self.flush_data()
+            self.batch_table_name = table_name
+            self.batch_column_list = column_list
+            self.batch_column_count = len(column_list.split(','))
+            self.batch_template = self.get_insert_template(table_name, column_list)
+            self.batch_statement_bytes = self.backend.statement_size(self.batch_template)
+            self.batch_null_mask = [_.strip() in self.null_columns for _ in column_list.split(',')]
+            self.batch_null_indexes = [i for i, is_null in enumerate(self.batch_null_mask) if is_null]
+        self.batch_skip_error = skip_error
 
-        except pymysql.err.InternalError as e:
-            if not skip_error:
-                # 数据插入 内部错误, 将写入 error_log file
-                ColorFormatter.error('Insert data InternalError: {}, insert data sql is: {}'.format(e, insert_data_sql))
-            self.debug_logger.error("Insert data InternalError: {}, insert data sql is: {}".format(e, insert_data_sql))
-            self.error_logger.error("Insert data InternalError: {}, insert data sql is: {}".format(e, insert_data_sql))
+        undecodable = find_undecodable(data_list)
+        if undecodable:
+            # 源文件中不能用 utf8 解码的行, 原来的字节写进 reject 文件, 不插入数据库
+            self.reject_row(line_number, data_list, 'decode_error', undecodable)
             self.insert_failed_count += 1
+            self.insert_total_count += 1
+            return False
+
+        if self.engine == 'load-data':
+            # 数据中已经没有 \t \r \n 了, 只需要转义 \, None (例如 --replay-rejects 中的 null) 写成 \N
+            data_list = ['\\N' if _ is None else _.translate(LOAD_DATA_ESCAPE_TABLE) for _ in data_list]
+            for i in self.batch_null_indexes:
+                if i < len(data_list) and data_list[i] == '':
+                    data_list[i] = '\\N'
+            self.batch_rows.append((line_number, '\t'.join(data_list) + '\n'))
+            if len(self.batch_rows) >= self.load_chunk_size:
+                self.flush_data()
+                return self.check_commit()
+
+        else:
+            if len(data_list) != self.batch_column_count:
+                # 列数对不上, 不用发送到数据库就知道会失败
+                self.reject_row(line_number, data_list, 'column_count', "Column count doesn't match value count")
+                self.insert_failed_count += 1
+                self.insert_total_count += 1
+                return False
+
+            if self.batch_null_indexes:
+                data_list = [None if is_null and _ == '' else _ for is_null, _ in zip(self.batch_null_mask, data_list)]
+            # 这一行在语句中的长度, 加上它就超过 max_packet_size 的话先把之前的数据发送出去, 这样一批数据
+            # 拼成的语句不会超过 max_packet_size (只有一行就超过的话只能单独发送)
+            row_bytes = self.backend.row_size(self.cursor, self.batch_template, data_list)
+            if self.batch_rows and self.batch_statement_bytes + self.batch_bytes + row_bytes > self.max_packet_size:
+                self.flush_data()
+                # 提交的只是这一行之前的数据, 这一行还没有放进缓冲区, 所以不返回 True
+                self.check_commit()
+            self.batch_bytes += row_bytes
+            self.batch_rows.append((line_number, data_list))
+            if len(self.batch_rows) >= self.batch_size:
+                self.flush_data()
+                return self.check_commit()
+
+        return False
+
+    def reject_row(self, line_number, fields, code, error, always_show=False):
+        """
+        记录插入失败的一行, 写进 reject 文件, 终端最多显示 REJECT_CONSOLE_LIMIT 条
+
+        :param line_number: 这一行在源文件中的行号
+        :param fields: 这一行的数据列表
+        :param code: MYSQL 错误码, 或者 'column_count' 这样的字符串
+        :param error: 错误信息
+        :param always_show: 不管 --skip-error 都显示在终端上, 例如未知的错误
+        """
+
+        with self.stage('reject'):
+            self.reject_file.write(self.batch_table_name, [_.strip() for _ in self.batch_column_list.split(',')],
+                                   self.source_file, line_number, fields, code, error)
+        if (always_show or not self.batch_skip_error) and self.reject_shown < REJECT_CONSOLE_LIMIT:
+            self.reject_shown += 1
+            ColorFormatter.error('Insert data error: {}, line: {}'.format(error, line_number))
+            if self.reject_shown == REJECT_CONSOLE_LIMIT:
+                ColorFormatter.warning('更多插入失败的数据只写进 {}'.format(self.reject_file.path))
+
+    def check_commit(self):
+        """
+        检查是否达到了 commit_every 行或者 commit_interval 秒, 达到了就提交事务
+
+        :return: 如果提交了事务返回 True
+        """
+
+        if self.commit_every and self.insert_total_count - self.committed_total_count >= self.commit_every:
+            return self.execute_commit()
+        if self.commit_interval and time.time() - self.last_commit_time >= self.commit_interval:
+            return self.execute_commit()
+        return False
+
+    def flush_data(self):
+        """把缓冲区里面的数据发送到数据库, 不提交事务"""
+
+        if not self.batch_rows:
+            return
+
+        batch_rows = self.batch_rows
+        self.batch_rows = []
+        self.batch_bytes = 0
+        self.debug_logger.debug('flush %s rows into table %s', len(batch_rows), self.batch_table_name)
+        with self.timer.phase('insert'):
+            if self.engine == 'load-data':
+                self.load_batch(batch_rows)
+            else:
+                self.insert_batch(batch_rows)
+
+    def insert_batch(self, batch_rows):
+        """
+        用 backend.write_batch 插入 batch_rows, 例如 pymysql 会把它们拼成多行 INSERT 语句, PostgreSQL 使用 COPY.
+        如果失败了就把这一批对半拆开再分别插入, 直到找出插入失败的那几行, 这样只有坏数据会写进 reject 文件,
+        同一批里面的好数据照样会插入
+
+        :param batch_rows: (源文件行号, 一行数据) 列表
+        :return:
+        """
+
+        template = self.get_insert_template(self.batch_table_name, self.batch_column_list)
+        try:
+            with self.stage('execute'):
+                self.backend.write_batch(self.cursor, template, self.batch_table_name, self.batch_column_list,
+                                         [_[1] for _ in batch_rows])
+            self.insert_success_count += len(batch_rows)
+            self.insert_total_count += len(batch_rows)
+            return
 
         except Exception as e:
-            ColorFormatter.error('Insert data Unknow error: {}, insert data sql is: {}'.format(e, insert_data_sql))
-            ColorFormatter.fatal('Please contact author')
-            # 写入日志文件
-            self.debug_logger.error("Insert data Unknow error: {}, insert data sql is: {}".format(e, insert_data_sql))
-            self.error_logger.error("Insert data Unknow error: {}, insert data sql is: {}".format(e, insert_data_sql))
-            self.insert_failed_count += 1
+            if len(batch_rows) > 1:
+                self.debug_logger.debug('Insert batch of %s rows failed: %s, split it in half and retry',
+                                        len(batch_rows), e)
+                middle = len(batch_rows) // 2
+                self.insert_batch(batch_rows[:middle])
+                self.insert_batch(batch_rows[middle:])
+                return
+            error = e
+
+        line_number, data_list = batch_rows[0]
+        if isinstance(error, self.backend.Error):
+            # 数据库返回的错误, 例如 ProgrammingError, InternalError
+            error_name = type(error).__name__
+        else:
+            error_name = 'Unknow error'
 
+        code, message = self.backend.split_error(error)
+        self.reject_row(line_number, data_list, code, message, always_show=(error_name == 'Unknow error'))
+
+        self.insert_failed_count += 1
         self.insert_total_count += 1
 
+    def load_batch(self, batch_rows):
+        """
+        把 batch_rows 写进临时文件, 然后用 LOAD DATA LOCAL INFILE 导入. LOAD DATA LOCAL 遇到坏数据不会报错,
+        而是跳过或者截断这一行并返回 warning, 这里把 warning 里面的 "row N" 对应回源文件的行号写进 error.log
+
+        :param batch_rows: (源文件行号, 用 \t 分隔的一行数据) 列表
+        :return:
+        """
+
+        first_line, last_line = batch_rows[0][0], batch_rows[-1][0]
+        spool_fd, spool_path = tempfile.mkstemp(prefix='move_to_database_', suffix='.txt')
+        try:
+            with self.stage('format'), os.fdopen(spool_fd, 'w', encoding='utf8', newline='\n') as f:
+                f.writelines([_[1] for _ in batch_rows])
+
+            with self.stage('execute'):
+                loaded_count, warnings = self.backend.load_file(self.cursor, spool_path, self.batch_table_name,
+                                                                self.batch_column_list)
+
+        except Exception as e:
+            # 整个文件都没有导入进去, 例如服务器没有开启 local_infile
+            ColorFormatter.error('Load data error: {}, lines: {}-{}'.format(e, first_line, last_line))
+            self.debug_logger.error('Load data error: {}, lines: {}-{}'.format(e, first_line, last_line))
+            self.error_logger.error('Load data error: {}, lines: {}-{}'.format(e, first_line, last_line))
+            self.insert_failed_count += len(batch_rows)
+            self.insert_total_count += len(batch_rows)
+            return
+
+        finally:
+            if os.path.exists(spool_path):
+                os.remove(spool_path)
+
+        for warning in warnings:
+            # 例如: Row 3 was truncated; it contained more data than there were input columns
+            # 例如: Data too long for column 'name' at row 5
+            row_match = re.search(r'\brow (\d+)', warning['Message'], re.I)
+            if row_match and 0 < int(row_match.group(1)) <= len(batch_rows):
+                line_number, row = batch_rows[int(row_match.group(1)) - 1]
+                self.reject_row(line_number, load_data_fields(row), warning.get('Code'), warning['Message'])
+                continue
+
+            message = 'Load data {}: {}, lines: {}-{}'.format(
+                warning['Level'], warning['Message'], first_line, last_line)
+            if not self.batch_skip_error:
+                ColorFormatter.error(message)
+            self.debug_logger.error(message)
+            self.error_logger.error(message)
+
+        self.insert_success_count += loaded_count
+        self.insert_failed_count += len(batch_rows) - loaded_count
+        self.insert_total_count += len(batch_rows)
+
     def execute_commit(self):
-        # 执行事务
+        # 先把缓冲区剩下的数据发送出去, 再执行事务
+        self.flush_data()
         try:
-            self.conn.commit()
-            self.debug_logger.debug('execute sql commit')
+            with self.timer.phase('commit'), self.stage('commit'):
+                self.conn.commit()
+            self.commit_count += 1
+            self.debug_logger.debug('execute sql commit %s, %s rows in this transaction, %s rows committed in total',
+                                    self.commit_count, self.insert_total_count - self.committed_total_count,
+                                    self.insert_total_count)
+            self.committed_total_count = self.insert_total_count
+            self.committed_success_count = self.insert_success_count
+            self.committed_failed_count = self.insert_failed_count
+            self.last_commit_time = time.time()
+            # 提交了的数据对应的 reject 记录也写进文件
+            with self.stage('reject'):
+                self.reject_file.flush()
             return True
         except:
             self.debug_logger.error('execute sql commit failed')
@@ -132,14 +626,15 @@ class Database(object):
 
         try:
             drop_table_sql = "DROP TABLE {}".format(table_name)
-            self.cursor.execute(drop_table_sql)
+            with self.backend.savepoint(self.cursor):
+                self.cursor.execute(drop_table_sql)
             self.conn.commit()
             return True
 
-        except pymysql.err.InternalError as e:
-            ColorFormatter.error('InternalError: {}'.format(e))
-            self.debug_logger.error('InternalError: {}'.format(e))
-            self.error_logger.error('InternalError: {}'.format(e))
+        except self.backend.Error as e:
+            ColorFormatter.error('{}: {}'.format(type(e).__name__, e))
+            self.debug_logger.error('{}: {}'.format(type(e).__name__, e))
+            self.error_logger.error('{}: {}'.format(type(e).__name__, e))
             return False
 
         except Exception as e:
@@ -149,9 +644,41 @@ class Database(object):
             self.error_logger.error('Drop table Unknow error: {}'.format(e))
             return True
 
+    def close(self):
+        """
+        把连接还给连接池, 还没有发送的数据和没有提交的数据对应的 reject 记录会被丢弃, 需要的话先调用
+        self.execute_commit()
+        """
+        self.batch_rows = []
+        self.batch_bytes = 0
+        if self.session_saved:
+            # 连接还会被别人借走, 先恢复会话设置
+            self.restore_session()
+        self.reject_file.close()
+        self.save_stats()
+        self.pool.release_connection(self.conn)
+        self.conn = None
+        self.cursor = None
+
+    def save_stats(self):
+        """把这个 Database 对象的阶段用时和插入行数写进 stats_file, 只写一次"""
+        if not self.stats_file or self.stats_saved:
+            return
+        self.stats_saved = True
+        counts = {}
+        if self.profiler:
+            counts['profile'] = self.profiler.to_dict()
+        write_stats(self.stats_file, 'database', self.timer.phases, rows=self.insert_total_count,
+                    success=self.insert_success_count, failed=self.insert_failed_count, commits=self.commit_count,
+                    **counts)
+
     def execute_command(self, cmd):
         """execute sql command, for example: show databases"""
 
         self.cursor.execute(cmd)
+        if self.cursor.description is None:
+            # 没有结果的语句, 例如 DROP TABLE, PostgreSQL 和 SQLite 需要提交事务
+            self.conn.commit()
+            return []
         dict_result = self.cursor.fetchall()
         return dict_result
@@ -0,0 +1,189 @@
+# encoding: utf8
+#!/usr/bin/env python3
+import os
+import pickle
+import shutil
+import hashlib
+import tempfile
+
+# 内存中每个 key 大约占用的字节数: 16 字节的 digest 对象加上 set 的槽位
+KEY_MEMORY = 80
+# key 按 digest 分成多少个分区, 内存不够的时候按分区写到磁盘上
+PARTITION_COUNT = 64
+DIGEST_SIZE = 16
+
+
+def key_indexes_of(column_list, key_columns):
+    """
+    把 --dedupe 指定的列名转换成下标
+
+    :param column_list: 列名列表
+    :param key_columns: 去重用的列名列表, 空的话用整行去重
+    :return: 下标列表, 整行去重的时候为 None, 列名不存在的话 raise ValueError
+    """
+
+    if not key_columns:
+        return None
+    unknown_columns = [_ for _ in key_columns if _ not in column_list]
+    if unknown_columns:
+        raise ValueError('dedupe columns {} do not exist in {}'.format(unknown_columns, column_list))
+    return [column_list.index(_) for _ in key_columns]
+
+
+def row_digest(row, key_indexes=None):
+    """
+    计算一行数据 (或者其中几列) 的 digest, 相同的 key 一定有相同的 digest
+
+    :param row: 数据列表
+    :param key_indexes: 去重用的列的下标, None 为整行
+    :return: 16 字节的 bytes
+    """
+
+    if key_indexes is not None:
+        row = [row[_] if _ < len(row) else '' for _ in key_indexes]
+    # \x1f 是 unit separator, 不会出现在正常的数据里, 避免 ['ab', 'c'] 和 ['a', 'bc'] 相同
+    key = '\x1f'.join(row).encode('utf8', 'surrogateescape')
+    return hashlib.blake2b(key, digest_size=DIGEST_SIZE).digest()
+
+
+class Deduper(object):
+    """
+    Handle streaming deduplication class, 用 digest 的集合判断一行数据是否已经出现过, 重复的行不会插入数据库.
+
+    key 按 digest 分成 PARTITION_COUNT 个分区, 内存中的 key 超过 memory_limit 的时候, 把最大的分区的 key 写到
+    磁盘上, 这个分区之后的数据也先写到磁盘上, 最后由 drain() 逐个分区读回内存去重. 所以内存中最多只有
+    memory_limit 的 key 和一个分区的 key
+
+    Usage example:
+    '''
+    deduper = Deduper(column_list, key_columns=['email'], memory_limit=256*1024*1024)
+    for line_number, row in rows:
+        if deduper.check(row, line_number):
+            insert(row)
+    for line_number, row in deduper.drain():
+        insert(row)
+    deduper.close()
+    '''
+    """
+
+    def __init__(self, column_list, key_columns=None, memory_limit=256*1024*1024, spill_dir=None):
+        self.key_indexes = key_indexes_of(column_list, key_columns)
+        self.max_keys = max(PARTITION_COUNT, memory_limit // KEY_MEMORY)
+        self.spill_dir = spill_dir
+        self.spill_path = None
+
+        self.key_sets = [set() for _ in range(PARTITION_COUNT)]
+        self.key_count = 0
+        # 写到磁盘上的分区, 之后这个分区的数据都先追加到磁盘上的文件里
+        self.spilled = [False] * PARTITION_COUNT
+        self.row_files = [None] * PARTITION_COUNT
+
+        # 重复的行数, 以及暂时写到磁盘上的行数
+        self.duplicate_count = 0
+        self.deferred_count = 0
+
+    def partition_file(self, partition, kind):
+        if self.spill_path is None:
+            self.spill_path = tempfile.mkdtemp(prefix='dedupe_', dir=self.spill_dir)
+        return os.path.join(self.spill_path, '{}_{}'.format(kind, partition))
+
+    def check(self, row, line_number=None):
+        """
+        检查一行数据是否第一次出现
+
+        :param row: 数据列表
+        :param line_number: 行号, 这一行暂时写到磁盘上的时候一起保存, drain() 的时候返回
+        :return: True 为第一次出现, 需要插入数据库; False 为重复或者暂时写到了磁盘上
+        """
+
+        digest = row_digest(row, self.key_indexes)
+        partition = digest[1] % PARTITION_COUNT
+        if self.spilled[partition]:
+            pickle.dump((line_number, digest, row), self.row_files[partition], pickle.HIGHEST_PROTOCOL)
+            self.deferred_count += 1
+            return False
+
+        key_set = self.key_sets[partition]
+        if digest in key_set:
+            self.duplicate_count += 1
+            return False
+        key_set.add(digest)
+        self.key_count += 1
+        if self.key_count > self.max_keys:
+            self.spill()
+        return True
+
+    def filter(self, rows):
+        """
+        过滤 (行号, 字节位置, 数据列表) 生成器, 例如 iter_csv_rows, 只返回第一次出现的行,
+        暂时写到磁盘上的行在最后返回, 字节位置为最后一行的位置
+        """
+
+        position = 0
+        for line_number, position, row in rows:
+            if self.check(row, line_number):
+                yield line_number, position, row
+        for line_number, row in self.drain():
+            yield line_number, position, row
+
+    def spill(self):
+        """把内存中最大的分区的 key 写到磁盘上"""
+        partition = max(range(PARTITION_COUNT), key=lambda _: len(self.key_sets[_]))
+        key_set = self.key_sets[partition]
+        with open(self.partition_file(partition, 'keys'), 'ab') as w:
+            w.write(b''.join(key_set))
+        self.key_count -= len(key_set)
+        self.key_sets[partition] = set()
+        self.spilled[partition] = True
+        self.row_files[partition] = open(self.partition_file(partition, 'rows'), 'ab')
+
+    def drain(self):
+        """
+        逐个读回写到磁盘上的分区去重, 每次只有一个分区的 key 在内存里. 去重之后分区仍然留在磁盘上,
+        所以可以继续 check() 下一个文件, 再 drain() 一次
+
+        :return: 生成器, 每次返回 (行号, 数据列表)
+        """
+
+        for partition in range(PARTITION_COUNT):
+            if not self.spilled[partition] or not self.row_files[partition].tell():
+                continue
+            self.row_files[partition].close()
+
+            key_file = self.partition_file(partition, 'keys')
+            with open(key_file, 'rb') as r:
+                data = r.read()
+            key_set = set([data[_:_ + DIGEST_SIZE] for _ in range(0, len(data), DIGEST_SIZE)])
+
+            new_keys = []
+            with open(self.partition_file(partition, 'rows'), 'rb') as r:
+                while True:
+                    try:
+                        line_number, digest, row = pickle.load(r)
+                    except EOFError:
+                        break
+                    if digest in key_set:
+                        self.duplicate_count += 1
+                        continue
+                    key_set.add(digest)
+                    new_keys.append(digest)
+                    yield line_number, row
+            del key_set
+
+            with open(key_file, 'ab') as w:
+                w.write(b''.join(new_keys))
+            self.row_files[partition] = open(self.partition_file(partition, 'rows'), 'wb')
+
+    def spilled_count(self):
+        """写到磁盘上的分区个数"""
+        return sum(self.spilled)
+
+    def close(self):
+        """删除磁盘上的临时文件"""
+        for row_file in self.row_files:
+            if row_file:
+                row_file.close()
+        self.row_files = [None] * PARTITION_COUNT
+        if self.spill_path:
+            shutil.rmtree(self.spill_path, ignore_errors=True)
+            self.spill_path = None
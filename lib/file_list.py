@@ -0,0 +1,42 @@
+# encoding: utf8
+#!/usr/bin/env python3
+import os
+import glob
+from lib.source import strip_compressed_suffix
+
+
+def expand_input_files(path, suffix=None):
+    """
+    把 -i / -t 的参数展开成文件列表, 可以是一个文件, 一个目录 (包括所有子目录中后缀为 suffix 的文件),
+    或者一个 glob 表达式, 例如 "dumps/**/*.csv". 按文件大小从大到小排序, 这样多进程导入的时候最大的文件最先开始,
+    最后剩下的都是小文件, 每个进程可以差不多同时结束
+
+    Usage example:
+    '''
+    file_list = expand_input_files('dumps/', suffix='.csv')
+    '''
+
+    :param path: 文件, 目录或者 glob 表达式
+    :param suffix: 目录中只选择这个后缀的文件, 不区分大小写, 压缩文件看压缩格式前面的后缀, 例如 dump.csv.gz
+                   的后缀是 .csv, None 为所有文件
+    :return: 文件路径列表, 没有找到文件的话为空列表
+    """
+
+    if os.path.isfile(path):
+        return [path]
+
+    if os.path.isdir(path):
+        file_list = []
+        for root, dirs, files in os.walk(path):
+            # 跳过隐藏目录和隐藏文件
+            dirs[:] = sorted([_ for _ in dirs if not _.startswith('.')])
+            for name in files:
+                if name.startswith('.'):
+                    continue
+                if suffix and not strip_compressed_suffix(name).lower().endswith(suffix.lower()):
+                    continue
+                file_list.append(os.path.join(root, name))
+    else:
+        file_list = [_ for _ in glob.glob(path, recursive=True) if os.path.isfile(_)]
+
+    return sorted(set(file_list), key=lambda _: (-os.path.getsize(_), _))
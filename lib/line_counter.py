@@ -0,0 +1,79 @@
+# encoding: utf8
+#!/usr/bin/env python3
+import os
+import mmap
+from concurrent.futures import ThreadPoolExecutor
+
+# 计算过行数的文件, key 为 (文件绝对路径, 文件大小, 修改时间), 同一个文件在一次运行中最多只计算一次
+_line_count_cache = {}
+
+
+def _count_range(file_path, start, end, block_size):
+    """计算文件 [start, end) 这一段中 \n 的个数"""
+    count = 0
+    with open(file_path, 'rb') as r:
+        r.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            block = r.read(min(block_size, remaining))
+            if not block:
+                break
+            count += block.count(b'\n')
+            remaining -= len(block)
+    return count
+
+
+def _count_mmap(file_path, file_size, block_size):
+    """用 mmap 计算整个文件中 \n 的个数, 由操作系统负责把文件映射进内存, 不需要 read 系统调用"""
+    count = 0
+    with open(file_path, 'rb') as r:
+        with mmap.mmap(r.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            for start in range(0, file_size, block_size):
+                count += m[start:start + block_size].count(b'\n')
+    return count
+
+
+def count_lines(file_path, block_size=1024*1024*4, threads=1, use_mmap=False):
+    """
+    计算文件的行数, 代替 wc -l | awk 命令, 路径中有空格或者特殊字符也没有问题.
+    和 wc -l 不同的是最后一行没有换行符也算一行
+
+    Usage example:
+    '''
+    total_line = count_lines('data.csv', threads=4)
+    '''
+
+    :param file_path: 文件路径
+    :param block_size: 每次读取的字节数
+    :param threads: 大于 1 的时候把文件按字节分成 threads 段, 每个线程计算一段
+    :param use_mmap: 使用 mmap 计算, 只在 threads 为 1 的时候有效
+    :return: 文件的行数
+    """
+
+    stat = os.stat(file_path)
+    key = (os.path.realpath(file_path), stat.st_size, stat.st_mtime_ns)
+    if key in _line_count_cache:
+        return _line_count_cache[key]
+
+    file_size = stat.st_size
+    if file_size == 0:
+        line_count = 0
+    else:
+        if threads > 1 and file_size > block_size:
+            per_size = file_size // threads + 1
+            ranges = [(start, min(start + per_size, file_size)) for start in range(0, file_size, per_size)]
+            with ThreadPoolExecutor(max_workers=threads) as executor:
+                line_count = sum(executor.map(lambda _: _count_range(file_path, _[0], _[1], block_size), ranges))
+        elif use_mmap:
+            line_count = _count_mmap(file_path, file_size, block_size)
+        else:
+            line_count = _count_range(file_path, 0, file_size, block_size)
+
+        # 最后一行没有换行符
+        with open(file_path, 'rb') as r:
+            r.seek(file_size - 1)
+            if r.read(1) != b'\n':
+                line_count += 1
+
+    _line_count_cache[key] = line_count
+    return line_count
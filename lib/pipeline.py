@@ -0,0 +1,369 @@
+# encoding: utf8
+#!/usr/bin/env python3
+import queue
+import threading
+from multiprocessing import Process, Queue
+from multiprocessing.connection import wait
+from lib.database import Database
+from lib.progress_bar import SharedProgress
+from lib.dedupe import Deduper, row_digest, key_indexes_of
+from lib.print_formatter import ColorFormatter
+from lib.stats import StageProfiler, cprofile_dump, write_stats
+
+
+def parse_stage(parser_index, file_path, start, end, row_reader, reader_args, row_queues, batch_size,
+                shared_progress, key_indexes=None, profile=None, stats_file=None):
+    """
+    解析阶段的子进程, 读取文件 [start, end) 这一段, 解析并清洗每一行, 每 batch_size 行打包放进 row_queues.
+    队列满了的时候 put 会阻塞, 数据库慢的话解析进程就停下来等, 内存不会无限增长
+
+    :param row_reader: 生成器函数, row_reader(file_path, start, end, *reader_args, profiler=None) 每次返回
+                       (行号, 下一行开头的字节位置, 清洗之后的数据列表)
+    :param row_queues: 只有一个队列的时候所有写入进程共用; 有多个队列的时候 (--dedupe) 按 key 的 digest 把每一行
+                       分给固定的写入进程, 相同的 key 一定在同一个写入进程里去重
+    :param key_indexes: 去重用的列的下标, None 为整行
+    :param profile: --profile 的配置, 给读取, 解析和清洗计时, 结束的时候写进 stats_file
+    :param stats_file: --stats-file 的路径
+    """
+
+    shared_progress.start(parser_index)
+    profiler = StageProfiler() if profile else None
+    lines, batches = 0, [[] for _ in row_queues]
+    with cprofile_dump(profile, 'parser'):
+        for line_number, next_position, row in row_reader(file_path, start, end, *reader_args, profiler=profiler):
+            queue_index = row_digest(row, key_indexes)[0] % len(row_queues) if len(row_queues) > 1 else 0
+            batch = batches[queue_index]
+            batch.append((line_number, row))
+            lines += 1
+            if len(batch) >= batch_size:
+                row_queues[queue_index].put(batch)
+                batches[queue_index] = []
+                shared_progress.update(parser_index, lines, 0, 0, next_position - start)
+        for queue_index, batch in enumerate(batches):
+            if batch:
+                row_queues[queue_index].put(batch)
+    shared_progress.update(parser_index, lines, 0, 0, end - start)
+    if profiler:
+        write_stats(stats_file, 'parser', {}, lines=lines, profile=profiler.to_dict())
+
+
+def write_stage(writer_index, row_queue, database_config, logger, table_name, column_list, debug_logger,
+                skip_error, shared_progress, dedupe_config=None, source_file=None):
+    """
+    写入阶段的子进程, 不断从 row_queue 取出一批数据插入数据库, 收到 None 就提交事务退出. 每个写入进程都用自己的
+    数据库连接, 事务按 --commit-every / --commit-interval 提交.
+
+    SQLite 这种同一时间只能有一个写事务的数据库, 每一批写完就提交. 不然一个写入进程一直拿着写锁, 去重的时候
+    其他写入进程等锁, 它们的队列满了, 解析进程停在 put 上, 拿着锁的写入进程也等不到下一批数据, 互相卡住
+
+    :param dedupe_config: 创建 Deduper 对象的参数字典, 重复的行不插入数据库, None 为不去重
+    :param source_file: 源文件路径, 写进 reject 文件
+    """
+
+    shared_progress.start(writer_index)
+    with cprofile_dump(database_config.get('profile'), 'writer'):
+        database_obj = Database(logger=logger, **database_config)
+        database_obj.source_file = source_file
+        column_str = ", ".join(column_list)
+        deduper = Deduper(column_list, **dedupe_config) if dedupe_config else None
+
+        # --profile 的时候给去重和插入计时
+        profiler = database_obj.profiler
+        insert_data = profiler.wrap(database_obj.insert_data, 'format') if profiler else database_obj.insert_data
+        check_row = deduper.check if deduper else None
+        if profiler and deduper:
+            check_row = profiler.wrap(check_row, 'dedupe')
+
+        def insert_row(line_number, row):
+            insert_data(table_name=table_name, column_list=column_str, data_list=row, skip_error=skip_error,
+                        line_number=line_number)
+
+        commit_each_batch = database_obj.backend.single_writer
+        while True:
+            batch = row_queue.get()
+            if batch is None:
+                break
+            for line_number, row in batch:
+                if deduper is None or check_row(row, line_number):
+                    insert_row(line_number, row)
+            if commit_each_batch:
+                database_obj.execute_commit()
+            shared_progress.update(writer_index, database_obj.insert_total_count, database_obj.insert_success_count,
+                                   database_obj.insert_failed_count)
+
+        if deduper:
+            # 暂时写到磁盘上的行最后去重插入
+            for count, (line_number, row) in enumerate(deduper.drain(), 1):
+                insert_row(line_number, row)
+                if commit_each_batch and count % database_obj.batch_size == 0:
+                    database_obj.execute_commit()
+            shared_progress.set_duplicates(writer_index, deduper.duplicate_count)
+            debug_logger.info('writer %s skip %s duplicate rows, %s partitions spilled to disk',
+                              writer_index + 1, deduper.duplicate_count, deduper.spilled_count())
+            deduper.close()
+
+        debug_logger.debug('writer %s execute insert sql commit', writer_index + 1)
+        database_obj.execute_commit()
+        shared_progress.update(writer_index, database_obj.insert_total_count, database_obj.insert_success_count,
+                               database_obj.insert_failed_count)
+        database_obj.close()
+
+
+class Pipeline(object):
+    """
+    Handle staged pipeline class, 把 "读取 -> 解析 -> 清洗" 和 "写入数据库" 分成两组进程, 中间用有界队列连接,
+    解析用的 CPU 和等待数据库的网络时间可以重叠在一起
+
+    Usage example:
+    '''
+    pipeline = Pipeline(parser_count=2, writer_count=4, queue_size=64, batch_size=1000, ...)
+    failed_stages = pipeline.run(file_path, ranges, iter_csv_rows, (), table_name, column_list, on_tick=show)
+    pipeline.total_bytes()
+    '''
+    """
+
+    def __init__(self, parser_count, writer_count, queue_size, batch_size, database_config, logger, debug_logger,
+                 error_logger, skip_error=False, dedupe_config=None):
+        self.parser_count = max(1, parser_count)
+        self.writer_count = max(1, writer_count)
+        # 队列中最多 queue_size 批, 也就是最多 queue_size * batch_size 行在内存里等待写入.
+        # 去重的时候每个写入进程一个队列, 解析进程按 key 分配, 否则所有写入进程共用一个队列
+        self.dedupe_config = dedupe_config
+        queue_count = self.writer_count if dedupe_config else 1
+        self.row_queues = [Queue(maxsize=max(1, queue_size // queue_count)) for _ in range(queue_count)]
+        self.batch_size = max(1, batch_size)
+        self.database_config = database_config
+        self.logger = logger
+        self.debug_logger = debug_logger
+        self.error_logger = error_logger
+        self.skip_error = skip_error
+
+        # 解析进程写已经处理的行数和字节数, 写入进程写成功和失败的条数
+        self.parser_progress = SharedProgress(worker_count=self.parser_count)
+        self.writer_progress = SharedProgress(worker_count=self.writer_count)
+
+    def total_bytes(self):
+        return self.parser_progress.total_bytes()
+
+    def total_lines(self):
+        return self.parser_progress.total_lines()
+
+    def total_success(self):
+        return self.writer_progress.total_success()
+
+    def total_failed(self):
+        return self.writer_progress.total_failed()
+
+    def total_duplicates(self):
+        return self.writer_progress.total_duplicates()
+
+    def run(self, file_path, ranges, row_reader, reader_args, table_name, column_list, on_tick=None,
+            tick_interval=2):
+        """
+        运行流水线, 直到所有数据都写入数据库
+
+        :param file_path: 文件路径
+        :param ranges: [(start, end), ...] 字节范围列表, 每个解析进程处理一段, 个数应该和 parser_count 一样
+        :param row_reader: 解析阶段使用的生成器函数, 见 parse_stage
+        :param reader_args: 传给 row_reader 的其他参数
+        :param table_name: table name
+        :param column_list: 列名列表
+        :param on_tick: 每隔 tick_interval 秒调用一次, 例如用来刷新进度条
+        :param tick_interval: 秒
+        :return: 异常退出的阶段名称列表, 例如 ['parser 1'], 全部正常的话为空列表
+        """
+
+        key_indexes, writer_dedupe_config = None, None
+        if self.dedupe_config:
+            key_indexes = key_indexes_of(column_list, self.dedupe_config.get('key_columns'))
+            # 每个写入进程只负责一部分 key, 内存预算平均分给每个写入进程
+            writer_dedupe_config = dict(self.dedupe_config)
+            writer_dedupe_config['memory_limit'] = self.dedupe_config['memory_limit'] // self.writer_count
+
+        writer_list = []
+        for i in range(self.writer_count):
+            process = Process(target=write_stage,
+                              args=(i, self.row_queues[i % len(self.row_queues)], self.database_config, self.logger,
+                                    table_name, column_list, self.debug_logger, self.skip_error,
+                                    self.writer_progress, writer_dedupe_config, file_path))
+            process.start()
+            writer_list.append(process)
+
+        parser_list = []
+        for i, (start, end) in enumerate(ranges):
+            process = Process(target=parse_stage,
+                              args=(i, file_path, start, end, row_reader, reader_args, self.row_queues,
+                                    self.batch_size, self.parser_progress, key_indexes,
+                                    self.database_config.get('profile'), self.database_config.get('stats_file')))
+            process.start()
+            parser_list.append(process)
+        self.debug_logger.info('pipeline started with {} parsers and {} writers'.format(
+            len(parser_list), len(writer_list)))
+
+        # 解析进程都结束了, 再给每个写入进程发一个 None, 队列里剩下的数据写完之后写入进程就会退出
+        failed_stages = self.wait_stage(parser_list, 'parser', on_tick, tick_interval,
+                                        alive_check=writer_list)
+        for i, process in enumerate(writer_list):
+            if process.is_alive():
+                self.row_queues[i % len(self.row_queues)].put(None)
+        failed_stages += self.wait_stage(writer_list, 'writer', on_tick, tick_interval)
+        return failed_stages
+
+    def wait_stage(self, process_list, stage_name, on_tick, tick_interval, alive_check=None):
+        """等待一组进程全部退出, 返回异常退出的进程名称列表"""
+        alive_process = [_ for _ in process_list if _.is_alive()]
+        while alive_process:
+            wait([_.sentinel for _ in alive_process], timeout=tick_interval)
+            alive_process = [_ for _ in process_list if _.is_alive()]
+            if alive_check and not any([_.is_alive() for _ in alive_check]):
+                # 写入进程全部退出了, 解析进程会一直阻塞在满了的队列上
+                ColorFormatter.error('所有写入进程都已经退出, 停止解析进程')
+                self.error_logger.error('all writer processes exited, terminate parser processes')
+                for _ in alive_process:
+                    _.terminate()
+            elif alive_check and len(self.row_queues) > 1 and not all([_.is_alive() for _ in alive_check]):
+                # 每个写入进程有自己的队列, 有一个写入进程退出了, 它的队列就没有人读了
+                ColorFormatter.error('有写入进程已经退出, 停止解析进程')
+                self.error_logger.error('a writer process exited, terminate parser processes')
+                for _ in alive_process:
+                    _.terminate()
+            if on_tick:
+                on_tick()
+
+        failed_stages = []
+        for i, process in enumerate(process_list):
+            process.join()
+            if process.exitcode != 0:
+                failed_stages.append('{} {}'.format(stage_name, i + 1))
+                ColorFormatter.error('{} 进程 {} 异常退出, 退出码: {}'.format(stage_name, i + 1, process.exitcode))
+                self.debug_logger.error('{} {} exit with code {}'.format(stage_name, i + 1, process.exitcode))
+                self.error_logger.error('{} {} exit with code {}'.format(stage_name, i + 1, process.exitcode))
+        return failed_stages
+
+
+class ThreadWriter(object):
+    """
+    Handle thread pool writer class, 只有一个进程, 主线程解析每一行, 每 batch_size 行打包交给写入线程,
+    每个写入线程从 ConnectionPool 借一个自己的连接. pymysql 等待网络的时候会释放 GIL, 所以数据库在另一台机器上,
+    瓶颈是网络延迟的时候, 多个线程可以同时等待, 不需要像 -f 一样启动多个进程和分割文件
+
+    Usage example:
+    '''
+    writer = ThreadWriter(thread_count=8, queue_size=64, batch_size=1000, pool=pool, ...)
+    failed_threads = writer.run(iter_csv_rows(file_path, 0, file_size), table_name, column_list)
+    writer.total_success()
+    '''
+    """
+
+    def __init__(self, thread_count, queue_size, batch_size, database_config, logger, pool, debug_logger,
+                 error_logger, skip_error=False):
+        self.thread_count = max(1, thread_count)
+        # 队列中最多 queue_size 批, 写入线程都很慢的时候主线程就停下来等
+        self.row_queue = queue.Queue(maxsize=max(1, queue_size))
+        self.batch_size = max(1, batch_size)
+        self.database_config = database_config
+        self.logger = logger
+        self.pool = pool
+        self.debug_logger = debug_logger
+        self.error_logger = error_logger
+        self.skip_error = skip_error
+        # 每个线程自己的 Database 对象, 结束之后用来汇总
+        self.database_list = [None] * self.thread_count
+        self.thread_list = []
+        # 源文件路径, 写进 reject 文件
+        self.source_file = None
+        # 异常退出的线程编号
+        self.failed_threads = []
+
+    def total_success(self):
+        return sum([_.insert_success_count for _ in self.database_list if _])
+
+    def total_failed(self):
+        return sum([_.insert_failed_count for _ in self.database_list if _])
+
+    def total_commit(self):
+        return sum([_.commit_count for _ in self.database_list if _])
+
+    def write_thread(self, thread_index, table_name, column_str):
+        """写入线程, 不断从队列取出一批数据插入数据库, 收到 None 就提交事务, 把连接还给连接池"""
+        database_obj = None
+        try:
+            database_obj = Database(logger=self.logger, pool=self.pool, **self.database_config)
+            self.database_list[thread_index] = database_obj
+            database_obj.source_file = self.source_file
+            insert_data = database_obj.insert_data
+            if database_obj.profiler:
+                insert_data = database_obj.profiler.wrap(insert_data, 'format')
+            while True:
+                batch = self.row_queue.get()
+                if batch is None:
+                    break
+                for line_number, row in batch:
+                    insert_data(table_name=table_name, column_list=column_str, data_list=row,
+                                skip_error=self.skip_error, line_number=line_number)
+            self.debug_logger.debug('writer thread %s execute insert sql commit', thread_index + 1)
+            database_obj.execute_commit()
+        except Exception as e:
+            # list.append 是线程安全的
+            self.failed_threads.append(thread_index + 1)
+            ColorFormatter.error('写入线程 {} 异常退出: {}'.format(thread_index + 1, e))
+            self.debug_logger.error('writer thread {} exit with error: {}'.format(thread_index + 1, e))
+            self.error_logger.error('writer thread {} exit with error: {}'.format(thread_index + 1, e))
+        finally:
+            if database_obj:
+                database_obj.close()
+
+    def put_batch(self, batch):
+        """把一批数据放进队列, 队列满了就等待, 写入线程全部退出了返回 False"""
+        while True:
+            try:
+                self.row_queue.put(batch, timeout=1)
+                return True
+            except queue.Full:
+                if not any([_.is_alive() for _ in self.thread_list]):
+                    return False
+
+    def run(self, rows, table_name, column_list, on_progress=None, source_file=None):
+        """
+        在主线程中解析数据, 交给写入线程插入数据库, 直到所有数据都写入
+
+        :param rows: 生成器, 例如 iter_csv_rows(file_path, 0, file_size), 每次返回 (行号, 下一行开头的字节位置, 数据列表)
+        :param table_name: table name
+        :param column_list: 列名列表
+        :param on_progress: 每放进队列一批数据就调用一次, 参数为已经解析到的字节位置, 例如用来刷新进度条
+        :param source_file: 源文件路径, 写进 reject 文件
+        :return: 异常退出的写入线程编号列表, 全部正常的话为空列表
+        """
+
+        self.source_file = source_file
+        column_str = ", ".join(column_list)
+        for i in range(self.thread_count):
+            thread = threading.Thread(target=self.write_thread, args=(i, table_name, column_str), daemon=True)
+            thread.start()
+            self.thread_list.append(thread)
+        self.debug_logger.info('thread writer started with {} threads'.format(self.thread_count))
+
+        batch = []
+        writer_alive = True
+        for line_number, next_position, row in rows:
+            batch.append((line_number, row))
+            if len(batch) >= self.batch_size:
+                writer_alive = self.put_batch(batch)
+                batch = []
+                if not writer_alive:
+                    break
+                if on_progress:
+                    on_progress(next_position)
+
+        if writer_alive:
+            if batch:
+                self.put_batch(batch)
+            for _ in self.thread_list:
+                self.put_batch(None)
+        else:
+            ColorFormatter.error('所有写入线程都已经退出, 停止解析数据')
+            self.error_logger.error('all writer threads exited, stop parsing')
+
+        for thread in self.thread_list:
+            thread.join()
+        return self.failed_threads
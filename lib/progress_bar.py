@@ -1,6 +1,8 @@
 # encoding: utf8
 #!/usr/bin/env python3
 import sys
+import time
+from multiprocessing import Array
 from termcolor import colored
 
 
@@ -104,3 +106,80 @@ class ProgressBar(object):
             print('')
             if self.done_info:
                 print(self.done_info)
+
+    def handle_stream_progress(self, current_progress):
+        """不知道总量的时候 (例如标准输入) 只显示已经处理的数量"""
+        if self.description:
+            progress_bar_str = "{} {}\r".format(self.description, current_progress)
+        else:
+            progress_bar_str = "{}\r".format(current_progress)
+
+        # output progress bar
+        sys.stdout.write(colored(progress_bar_str, 'white'))
+        sys.stdout.flush()
+
+
+class SharedProgress(object):
+    """
+    Handle multiprocessing progress class, 每个进程把自己处理的行数, 成功和失败的条数写进共享内存里自己的那一格,
+    父进程直接读共享内存汇总, 不需要再读写 record_line_N.txt 文件
+
+    Usage example:
+    '''
+    shared_progress = SharedProgress(worker_count=4)
+    # 子进程
+    shared_progress.update(worker_index, lines=10000, success=9990, failed=10)
+    # 父进程
+    shared_progress.total_lines()
+    '''
+    """
+
+    def __init__(self, worker_count):
+        self.worker_count = worker_count
+        # 每个进程只写自己的那一格, 所以不需要锁
+        self.lines = Array('q', worker_count, lock=False)
+        self.success = Array('q', worker_count, lock=False)
+        self.failed = Array('q', worker_count, lock=False)
+        # 每个进程已经处理的字节数, 进度条按字节显示, 不需要知道文件的总行数
+        self.bytes = Array('q', worker_count, lock=False)
+        # 每个进程因为重复 (--dedupe) 跳过的行数
+        self.duplicates = Array('q', worker_count, lock=False)
+        # 每个进程开始和最后一次更新的时间, 用来计算每个进程的速度
+        self.start_time = Array('d', worker_count, lock=False)
+        self.update_time = Array('d', worker_count, lock=False)
+
+    def start(self, worker_index):
+        self.start_time[worker_index] = time.time()
+        self.update_time[worker_index] = self.start_time[worker_index]
+
+    def update(self, worker_index, lines, success, failed, bytes_done=0):
+        self.lines[worker_index] = lines
+        self.success[worker_index] = success
+        self.failed[worker_index] = failed
+        self.bytes[worker_index] = bytes_done
+        self.update_time[worker_index] = time.time()
+
+    def set_duplicates(self, worker_index, duplicates):
+        self.duplicates[worker_index] = duplicates
+
+    def total_lines(self):
+        return sum(self.lines)
+
+    def total_duplicates(self):
+        return sum(self.duplicates)
+
+    def total_bytes(self):
+        return sum(self.bytes)
+
+    def total_success(self):
+        return sum(self.success)
+
+    def total_failed(self):
+        return sum(self.failed)
+
+    def throughput(self, worker_index):
+        """每个进程每秒处理的行数"""
+        elapsed = self.update_time[worker_index] - self.start_time[worker_index]
+        if elapsed <= 0:
+            return 0.0
+        return (self.success[worker_index] + self.failed[worker_index]) / elapsed
@@ -0,0 +1,129 @@
+# encoding: utf8
+#!/usr/bin/env python3
+import os
+import json
+import tempfile
+
+# 缓冲区里攒够这么多条就先写进临时文件, 内存不会无限增长
+REJECT_BUFFER_SIZE = 256
+# flush 的时候每次 os.write 最多写这么多字节, 按行切开
+REJECT_WRITE_SIZE = 1024 * 1024
+
+
+class RejectFile(object):
+    """
+    Handle reject file class, 插入失败的每一行写成一行 JSON, 例如:
+    '''
+    {"table": "test_table", "columns": ["id", "email"], "source": "dump.csv", "line": 42,
+     "fields": ["1", "a@b.com"], "code": 1366, "error": "Incorrect integer value ..."}
+    '''
+    文件用 O_APPEND 打开, 每次 os.write 都是完整的几行, 多个进程和线程可以写同一个文件,
+    修改 fields 之后可以用 --replay-rejects 重新导入
+
+    记录只有 flush() 的时候才写进文件, Database 在提交事务之后调用. 还没有提交的记录先放在内存和临时文件里,
+    进程崩溃的话和没有提交的数据一起丢掉, --resume 重新插入这些数据的时候不会在 reject 文件里写两次
+
+    Usage example:
+    '''
+    reject_file = RejectFile('logs/rejects.jsonl')
+    reject_file.write('test_table', ['id', 'email'], 'dump.csv', 42, ['x', 'a@b.com'], 1366, 'Incorrect integer value')
+    reject_file.flush()
+    reject_file.close()
+    '''
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.fd = None
+        self.buffer = []
+        # 没有 flush 的记录超过 REJECT_BUFFER_SIZE 条的时候写到这个临时文件里
+        self.spool = None
+        self.count = 0
+
+    def write(self, table_name, columns, source, line_number, fields, code, error):
+        record = {
+            'table': table_name,
+            'columns': columns,
+            'source': source,
+            'line': line_number,
+            'fields': fields,
+            'code': code,
+            'error': error,
+        }
+        self.buffer.append(json.dumps(record, ensure_ascii=False) + '\n')
+        self.count += 1
+        if len(self.buffer) >= REJECT_BUFFER_SIZE:
+            if self.spool is None:
+                self.spool = tempfile.TemporaryFile(prefix='rejects_')
+            self.spool.write(self.encode_buffer())
+
+    def encode_buffer(self):
+        data = ''.join(self.buffer).encode('utf8', 'surrogateescape')
+        self.buffer = []
+        return data
+
+    def iter_pending(self):
+        """没有 flush 的记录, 每次返回一行的 bytes"""
+        if self.spool is not None:
+            self.spool.seek(0)
+            for line in self.spool:
+                yield line
+            self.spool.close()
+            self.spool = None
+        if self.buffer:
+            for line in self.encode_buffer().splitlines(True):
+                yield line
+
+    def flush(self):
+        """把 write() 之后的记录都写进 reject 文件"""
+        if self.spool is None and not self.buffer:
+            return
+        if self.fd is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self.fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        chunk, chunk_size = [], 0
+        for line in self.iter_pending():
+            chunk.append(line)
+            chunk_size += len(line)
+            if chunk_size >= REJECT_WRITE_SIZE:
+                os.write(self.fd, b''.join(chunk))
+                chunk, chunk_size = [], 0
+        if chunk:
+            os.write(self.fd, b''.join(chunk))
+
+    def discard(self):
+        """丢掉还没有 flush 的记录, 例如它们对应的数据没有提交"""
+        self.buffer = []
+        if self.spool is not None:
+            self.spool.close()
+            self.spool = None
+
+    def close(self):
+        """关闭文件, 还没有 flush 的记录会被丢掉, 需要的话先调用 self.flush()"""
+        self.discard()
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+def iter_rejects(path):
+    """
+    读取 reject 文件
+
+    :param path: reject 文件路径
+    :return: 生成器, 每次返回 (行号, 记录字典), 不是 JSON 或者缺少字段的行返回 (行号, None)
+    """
+
+    with open(path, 'r', encoding='utf8', errors='surrogateescape') as r:
+        for index, line in enumerate(r, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                yield index, None
+                continue
+            if not isinstance(record, dict) or not all([_ in record for _ in ('table', 'columns', 'fields')]):
+                yield index, None
+                continue
+            yield index, record
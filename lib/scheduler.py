@@ -0,0 +1,238 @@
+# encoding: utf8
+#!/usr/bin/env python3
+import time
+from collections import deque
+from multiprocessing import Pipe, Process, Queue
+from multiprocessing.connection import wait
+from lib.print_formatter import ColorFormatter
+
+# 同一个任务默认最多重试的次数
+MAX_RETRY = 3
+# 结束卡住的子进程时等待它退出的秒数, 超过就直接 kill
+TERMINATE_TIMEOUT = 5
+
+
+def iter_tasks(worker_index, task_queue, result_pipe):
+    """
+    子进程中使用, 不断从自己的任务队列中取任务, 每个任务处理完 (也就是下一次循环开始的时候) 告诉父进程,
+    收到 None 就退出
+
+    Usage example:
+    '''
+    def worker(worker_index, task_queue, result_pipe, *args):
+        database_obj = Database(...)
+        for task_id, task in iter_tasks(worker_index, task_queue, result_pipe):
+            handle(task)
+        database_obj.close()
+    '''
+
+    :param worker_index: 子进程的序号
+    :param task_queue: 这个子进程自己的任务队列
+    :param result_pipe: 这个子进程自己的结果管道, 同步写入, 子进程在任何时候退出都不会影响其他子进程
+    :return: 生成器, 每次返回 (task_id, task)
+    """
+
+    while True:
+        item = task_queue.get()
+        if item is None:
+            return
+        task_id, task = item
+        yield task_id, task
+        result_pipe.send(task_id)
+
+
+class ChunkScheduler(object):
+    """
+    Handle work queue class, 把很多小任务分给 worker_count 个子进程, 哪个子进程空闲了就给它下一个任务,
+    这样最慢的那一段不会拖慢整体. 父进程知道每个子进程手上是哪个任务, 子进程异常退出的话重新启动一个,
+    并且把它手上的任务放回队列最前面, 同一个任务失败超过 max_retry 次就放弃. 设置了 stall_timeout 的话,
+    子进程超过 stall_timeout 秒没有任何进度 (例如卡在一个永远不返回的数据库请求上) 就结束它, 和异常退出一样处理
+
+    worker_target 的参数为 (worker_index, task_queue, result_pipe, *worker_args), 使用 iter_tasks 取任务.
+    每个子进程有自己的任务队列和结果管道, 不和别的子进程共用锁, 子进程异常退出或者被结束的时候
+    不会把其他子进程卡住
+    """
+
+    def __init__(self, worker_target, worker_args, worker_count, debug_logger, error_logger, max_retry=MAX_RETRY,
+                 stall_timeout=0, heartbeat=None):
+        """
+        :param stall_timeout: 秒, 0 为不检查
+        :param heartbeat: heartbeat(task_id) 返回这个任务最后一次有进度的 time.time(), 例如 SharedProgress 的
+                          update_time, 没有的话只按任务开始的时间计算
+        """
+
+        self.worker_target = worker_target
+        self.worker_args = worker_args
+        self.worker_count = max(1, worker_count)
+        self.debug_logger = debug_logger
+        self.error_logger = error_logger
+        self.max_retry = max_retry
+        self.stall_timeout = stall_timeout
+        self.heartbeat = heartbeat
+
+        self.process_list = [None] * self.worker_count
+        self.task_queues = [None] * self.worker_count
+        # 父进程读取每个子进程结果管道的一端, 子进程退出之后为 None
+        self.result_readers = [None] * self.worker_count
+        # 每个子进程手上的任务, 空闲为 None
+        self.assigned = [None] * self.worker_count
+        # 每个子进程拿到手上的任务的时间
+        self.assigned_time = [0.0] * self.worker_count
+        # 每个任务失败的次数
+        self.retries = {}
+        # 重启过的子进程次数
+        self.restart_count = 0
+
+    def start_worker(self, worker_index):
+        self.task_queues[worker_index] = Queue()
+        reader, writer = Pipe(duplex=False)
+        process = Process(target=self.worker_target,
+                          args=(worker_index, self.task_queues[worker_index], writer) + tuple(self.worker_args))
+        process.start()
+        # 父进程不写, 关闭写的一端, 子进程退出的时候 reader 才能读到 EOF
+        writer.close()
+        if self.result_readers[worker_index] is not None:
+            self.result_readers[worker_index].close()
+        self.result_readers[worker_index] = reader
+        self.process_list[worker_index] = process
+        self.debug_logger.debug('start worker {}, pid: {}'.format(worker_index + 1, process.pid))
+
+    def dispatch(self, worker_index, pending):
+        """把下一个任务交给空闲的子进程"""
+        if pending and self.assigned[worker_index] is None:
+            task = pending.popleft()
+            self.assigned[worker_index] = task
+            self.assigned_time[worker_index] = time.time()
+            self.task_queues[worker_index].put(task)
+
+    def terminate_stalled(self):
+        """结束超过 stall_timeout 秒没有进度的子进程, 它手上的任务由 run 按异常退出重试"""
+        now = time.time()
+        for worker_index, process in enumerate(self.process_list):
+            assigned = self.assigned[worker_index]
+            if process is None or assigned is None or not process.is_alive():
+                continue
+            last_time = self.assigned_time[worker_index]
+            if self.heartbeat:
+                last_time = max(last_time, self.heartbeat(assigned[0]))
+            if now - last_time < self.stall_timeout:
+                continue
+
+            ColorFormatter.error('子进程 {} 超过 {} 秒没有进度, 结束这个进程'.format(
+                worker_index + 1, self.stall_timeout))
+            self.debug_logger.error('worker {} made no progress on task {} for {} seconds, terminate it'.format(
+                worker_index + 1, assigned[0], self.stall_timeout))
+            self.error_logger.error('worker {} made no progress on task {} for {} seconds, terminate it'.format(
+                worker_index + 1, assigned[0], self.stall_timeout))
+            process.terminate()
+            process.join(TERMINATE_TIMEOUT)
+            if process.is_alive():
+                process.kill()
+                process.join()
+
+    def read_results(self, timeout):
+        """
+        等待最多 timeout 秒, 读取所有子进程已经完成的任务
+
+        :return: [(worker_index, task_id), ...]
+        """
+
+        readers = [_ for _ in self.result_readers if _ is not None]
+        if not readers:
+            time.sleep(timeout)
+            return []
+
+        results = []
+        for reader in wait(readers, timeout):
+            worker_index = self.result_readers.index(reader)
+            try:
+                while reader.poll():
+                    results.append((worker_index, reader.recv()))
+            except (EOFError, OSError):
+                # 子进程退出了, 或者在写结果的中间被结束了, 由 run 检查异常退出的子进程
+                reader.close()
+                self.result_readers[worker_index] = None
+        return results
+
+    def run(self, tasks, on_tick=None, tick_interval=2, no_retry=()):
+        """
+        运行所有任务, 直到所有任务都完成或者放弃
+
+        :param tasks: [(task_id, task), ...] 任务列表, task 需要可以 pickle
+        :param on_tick: 每隔 tick_interval 秒调用一次, 例如用来刷新进度条
+        :param tick_interval: 秒
+        :param no_retry: 失败一次就放弃的 task_id 集合, 例如不能从中间继续, 重新处理会插入重复数据的任务
+        :return: (完成的 task_id 集合, 放弃的 task_id 集合)
+        """
+
+        pending = deque(tasks)
+        task_ids = set([_[0] for _ in tasks])
+        done, failed = set(), set()
+
+        for worker_index in range(min(self.worker_count, len(pending))):
+            self.start_worker(worker_index)
+            self.dispatch(worker_index, pending)
+
+        while len(done | failed) < len(task_ids):
+            for worker_index, task_id in self.read_results(tick_interval):
+                done.add(task_id)
+                failed.discard(task_id)
+                assigned = self.assigned[worker_index]
+                if assigned is not None and assigned[0] == task_id:
+                    self.assigned[worker_index] = None
+                    self.dispatch(worker_index, pending)
+
+            if self.stall_timeout:
+                self.terminate_stalled()
+
+            # 检查异常退出的子进程
+            for worker_index, process in enumerate(self.process_list):
+                if process is None or process.is_alive():
+                    continue
+                assigned = self.assigned[worker_index]
+                if assigned is None:
+                    continue
+
+                task_id = assigned[0]
+                self.assigned[worker_index] = None
+                self.retries[task_id] = self.retries.get(task_id, 0) + 1
+                ColorFormatter.error('子进程 {} 异常退出, 退出码: {}, 任务 {} 第 {} 次失败'.format(
+                    worker_index + 1, process.exitcode, task_id, self.retries[task_id]))
+                self.debug_logger.error('worker {} exit with code {}, task {} failed {} times'.format(
+                    worker_index + 1, process.exitcode, task_id, self.retries[task_id]))
+                self.error_logger.error('worker {} exit with code {}, task {} failed {} times'.format(
+                    worker_index + 1, process.exitcode, task_id, self.retries[task_id]))
+                if task_id in done:
+                    pass
+                elif task_id in no_retry:
+                    failed.add(task_id)
+                    ColorFormatter.fatal('任务 {} 不能重试, 放弃这个任务'.format(task_id))
+                    self.error_logger.error('give up task {} which can not be retried'.format(task_id))
+                elif self.retries[task_id] > self.max_retry:
+                    failed.add(task_id)
+                    ColorFormatter.fatal('任务 {} 失败超过 {} 次, 放弃这个任务'.format(task_id, self.max_retry))
+                    self.error_logger.error('give up task {} after {} retries'.format(task_id, self.max_retry))
+                else:
+                    # 放回队列最前面, 马上重试
+                    pending.appendleft(assigned)
+
+                if pending:
+                    self.restart_count += 1
+                    self.start_worker(worker_index)
+                    self.dispatch(worker_index, pending)
+
+            if on_tick:
+                on_tick()
+
+        # 所有任务都结束了, 通知子进程退出
+        for worker_index, process in enumerate(self.process_list):
+            if process is not None and process.is_alive():
+                self.task_queues[worker_index].put(None)
+        for process in self.process_list:
+            if process is not None:
+                process.join()
+        for reader in self.result_readers:
+            if reader is not None:
+                reader.close()
+
+        return done, failed
@@ -0,0 +1,135 @@
+# encoding: utf8
+#!/usr/bin/env python3
+import re
+import math
+from datetime import datetime
+
+# 没有样本数据的列, 以及不指定 --infer-schema 的时候使用的类型
+DEFAULT_COLUMN_TYPE = 'varchar(300)'
+# 超过这个长度就用 TEXT, 和以前的 varchar(300) 一样, 一行的总长度不会超过 MYSQL 的限制
+VARCHAR_LIMIT = 300
+# VARCHAR 最短的长度
+VARCHAR_MIN = 16
+INT_MAX = 2147483647
+# 19 位的数字可能超过 BIGINT 的范围
+BIGINT_DIGITS = 18
+
+# 0 开头的数字 (例如 007, 手机号, 邮编) 当成字符串, 不然开头的 0 会丢掉
+INT_RE = re.compile(r'^[+-]?(0|[1-9][0-9]*)$')
+DATE_RE = re.compile(r'^[0-9]{4}-[0-9]{2}-[0-9]{2}$')
+DATETIME_RE = re.compile(r'^[0-9]{4}-[0-9]{2}-[0-9]{2}[ T][0-9]{2}:[0-9]{2}:[0-9]{2}$')
+# --column-type 只允许简单的类型, 例如 int, bigint unsigned, varchar(64), decimal(10,2), text
+# 字符串类型的列保留空字符串
+STRING_TYPE_RE = re.compile(r'^(var)?char|^(tiny|medium|long)?text|^enum|^set', re.I)
+COLUMN_TYPE_RE = re.compile(r'^[A-Za-z]+( ?\([0-9]+( ?, ?[0-9]+)?\))?( unsigned)?$')
+
+
+class ColumnStats(object):
+    """记录一列样本数据的统计信息, 每个值只检查它还可能是的类型"""
+
+    def __init__(self):
+        self.candidates = {'int', 'date', 'datetime'}
+        self.non_empty = 0
+        self.max_length = 0
+        self.max_abs = 0
+
+    def add(self, value):
+        # 空字符串会插入为空, 不影响类型
+        if value == '':
+            return
+        self.non_empty += 1
+        self.max_length = max(self.max_length, len(value))
+
+        if 'int' in self.candidates:
+            if INT_RE.match(value) and len(value.lstrip('+-')) <= BIGINT_DIGITS:
+                self.max_abs = max(self.max_abs, abs(int(value)))
+            else:
+                self.candidates.discard('int')
+        if 'date' in self.candidates and not (DATE_RE.match(value) and is_valid_time(value, '%Y-%m-%d')):
+            self.candidates.discard('date')
+        if 'datetime' in self.candidates and not (DATETIME_RE.match(value) and
+                                                  is_valid_time(value.replace('T', ' '), '%Y-%m-%d %H:%M:%S')):
+            self.candidates.discard('datetime')
+
+    def column_type(self, margin=2.0):
+        """
+        根据样本选择最窄的类型, 数字的最大值和字符串的最大长度都乘以 margin 作为余量
+
+        :param margin: 余量倍数
+        :return: MYSQL 类型
+        """
+
+        if not self.non_empty:
+            return DEFAULT_COLUMN_TYPE
+        if 'int' in self.candidates:
+            return 'int' if self.max_abs * margin <= INT_MAX else 'bigint'
+        if 'datetime' in self.candidates:
+            return 'datetime'
+        if 'date' in self.candidates:
+            return 'date'
+
+        length = max(VARCHAR_MIN, int(math.ceil(self.max_length * margin)))
+        if length > VARCHAR_LIMIT:
+            return 'text'
+        return 'varchar({})'.format(length)
+
+
+def is_valid_time(value, time_format):
+    try:
+        datetime.strptime(value, time_format)
+        return True
+    except ValueError:
+        return False
+
+
+def infer_column_types(column_list, rows, margin=2.0):
+    """
+    根据样本数据推断每一列的类型: INT/BIGINT, DATE/DATETIME, 合适长度的 VARCHAR, 很长的用 TEXT
+
+    Usage example:
+    '''
+    column_types = infer_column_types(['id', 'email'], [['1', 'a@b.com'], ['2', 'c@d.com']])
+    # {'id': 'int', 'email': 'varchar(16)'}
+    '''
+
+    :param column_list: 列名列表
+    :param rows: 样本数据, 每一行是一个数据列表
+    :param margin: 余量倍数
+    :return: {列名: 类型} 字典
+    """
+
+    stats = [ColumnStats() for _ in column_list]
+    for row in rows:
+        for column_stats, value in zip(stats, row):
+            column_stats.add(value)
+    return dict([(column, column_stats.column_type(margin)) for column, column_stats in zip(column_list, stats)])
+
+
+def null_columns_of(column_types):
+    """
+    不是字符串类型的列, 例如 int, date, 这些列的空字符串要插入为 NULL
+
+    :param column_types: {列名: 类型} 字典
+    :return: 列名列表
+    """
+
+    return [column for column, column_type in column_types.items()
+            if not STRING_TYPE_RE.match(column_type)]
+
+
+def parse_column_types(specs):
+    """
+    解析 --column-type 参数, 例如 ['id=bigint', 'email=varchar(128)']
+
+    :param specs: "列名=类型" 列表
+    :return: {列名: 类型} 字典, 格式不对的话 raise ValueError
+    """
+
+    column_types = {}
+    for spec in specs or []:
+        column, _, column_type = spec.partition('=')
+        column, column_type = column.strip(), column_type.strip()
+        if not column or not COLUMN_TYPE_RE.match(column_type):
+            raise ValueError('invalid column type "{}", use the format COLUMN=TYPE, for example id=bigint'.format(spec))
+        column_types[column] = column_type
+    return column_types
@@ -10,4 +10,7 @@ TABLE_NAME = 'test_table'
 # ['path']
 ROOT_PATH = os.getcwd()
 LOG_PATH = os.path.join(ROOT_PATH, 'logs')
-SPLIT_PATH = os.path.join(ROOT_PATH, 'split')
+# 没有指定 --reject-file 的时候, 插入失败的行写进这个文件
+REJECT_FILE = os.path.join(LOG_PATH, 'rejects.jsonl')
+# 断点续传的 checkpoint manifest 存放的目录
+CHECKPOINT_PATH = os.path.join(ROOT_PATH, 'checkpoint')
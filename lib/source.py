@@ -0,0 +1,140 @@
+# encoding: utf8
+#!/usr/bin/env python3
+import io
+import os
+import sys
+import bz2
+import gzip
+import lzma
+import stat
+from lib.split_file import normalize_line, read_file_range
+
+# 可以边读边解压的压缩格式, 都是标准库自带的
+COMPRESSED_SUFFIXES = {
+    '.gz': gzip,
+    '.bz2': bz2,
+    '.xz': lzma,
+    '.lzma': lzma,
+}
+
+
+def is_stream_source(path):
+    """
+    是否只能从头到尾顺序读取: - (标准输入), 压缩文件, 或者命名管道. 这些输入不能 seek, 也不能事先计算行数
+
+    :param path: -i / -t 的参数
+    :return: bool
+    """
+
+    if path == '-':
+        return True
+    if not os.path.exists(path):
+        return False
+    if os.path.splitext(path)[1].lower() in COMPRESSED_SUFFIXES:
+        return True
+    try:
+        return stat.S_ISFIFO(os.stat(path).st_mode)
+    except OSError:
+        return False
+
+
+def strip_compressed_suffix(name):
+    """去掉压缩格式的后缀, 例如 dump.csv.gz 返回 dump.csv, 不是压缩文件的话原样返回"""
+    root, ext = os.path.splitext(name)
+    return root if ext.lower() in COMPRESSED_SUFFIXES else name
+
+
+def read_source_range(file_path, start, end):
+    """
+    和 read_file_range 一样读取 [start, end) 这一段的每一行, 压缩文件和命名管道用 StreamSource 从头读到尾,
+    这时候 start 必须是 0, 位置是已经读取的 (压缩) 字节数
+
+    :return: 生成器, 每次返回 (这一行开头的字节位置, 下一行开头的字节位置, 这一行的字符串)
+    """
+
+    if not is_stream_source(file_path):
+        yield from read_file_range(file_path, start, end)
+        return
+
+    source = StreamSource(file_path)
+    try:
+        line_position = 0
+        for consumed, one_line in source.iter_lines():
+            yield line_position, consumed, one_line
+            line_position = consumed
+    finally:
+        source.close()
+
+
+class CountingReader(io.RawIOBase):
+    """包装原始的文件对象, 记录已经读取了多少字节, 压缩文件就是已经读取的压缩数据的字节数"""
+
+    def __init__(self, raw):
+        super(CountingReader, self).__init__()
+        self.raw = raw
+        self.consumed = 0
+        # 标准输入和管道用 read1, 有多少读多少, 不用等到读满整个缓冲区
+        self.read_raw = getattr(raw, 'read1', raw.read)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.read_raw(len(buffer))
+        size = len(data)
+        buffer[:size] = data
+        self.consumed += size
+        return size
+
+
+class StreamSource(object):
+    """
+    Handle streaming input source class, 从标准输入, 命名管道或者 .gz / .bz2 / .xz 压缩文件中边读边解压,
+    不需要先把文件解压到磁盘上. 进度按已经读取的压缩数据字节数计算, 因为总行数不知道
+
+    Usage example:
+    '''
+    source = StreamSource('dump.csv.gz')
+    for consumed, line in source.iter_lines():
+        print(consumed, source.total_size, line)
+    source.close()
+    '''
+    """
+
+    def __init__(self, path):
+        self.path = path
+        if path == '-':
+            self.raw = sys.stdin.buffer
+            self.total_size = None
+        else:
+            self.raw = open(path, 'rb')
+            file_stat = os.fstat(self.raw.fileno())
+            # 命名管道不知道总大小
+            self.total_size = file_stat.st_size if stat.S_ISREG(file_stat.st_mode) else None
+
+        self.counter = CountingReader(self.raw)
+        module = COMPRESSED_SUFFIXES.get(os.path.splitext(path)[1].lower())
+        if module:
+            self.reader = module.open(self.counter, 'rb')
+        else:
+            self.reader = io.BufferedReader(self.counter, buffer_size=1024*1024)
+
+    @property
+    def consumed(self):
+        """已经读取的 (压缩) 字节数"""
+        return self.counter.consumed
+
+    def iter_lines(self):
+        """
+        读取每一行, 和 read_file_range 一样统一换行符
+
+        :return: 生成器, 每次返回 (已经读取的字节数, 这一行的字符串)
+        """
+
+        for line in self.reader:
+            yield self.counter.consumed, normalize_line(line)
+
+    def close(self):
+        self.reader.close()
+        if self.raw is not sys.stdin.buffer:
+            self.raw.close()
@@ -2,26 +2,22 @@
 #!/usr/bin/env python3
 from lib.print_formatter import ColorFormatter
 from lib.Logger import Logger
-from lib.settings import SPLIT_PATH
-import subprocess
-import sys
 import os
+import re
+
+# normalize_line 用 surrogateescape 保留下来的不能用 utf8 解码的字节
+UNDECODABLE_PATTERN = re.compile('[\udc80-\udcff]')
 
 
 def split_file(file_path, log_level, split_count=os.cpu_count()):
     """
-    有可能每个系统的换行符不一样, 可能会造成数据分割之后的数据"变多"
-    例如:
-    如果有一行的数据为: CHEN^M GUIDE,,,VSA,USER,NAME, Python 会把 ^M 当成换行符, 从而数据变成两行:
-    1. CHEN
-    2.  GUIDE,,,VSA,USER,NAME,
-
-    这个只能当做坏数据处理, 使用 error.log 手动导入即可, 不过这种情况应该不会很多, so do not worry about it.
+    不再把原文件重新写成 split/split_file_N.txt, 而是按字节把文件分成 split_count 段, 每一段的边界都对齐到换行符,
+    每个进程自己打开原文件, 只处理 [start, end) 这一段
 
     :param file_path: 需要分割文件的文件路径
     :param log_level: log level
     :param split_count: 需要分成多少份
-    :return: Boolean, 成功或者失败
+    :return: [(start, end), ...] 字节范围列表, 失败的话返回 False
     """
 
     try:
@@ -31,89 +27,97 @@ def split_file(file_path, log_level, split_count=os.cpu_count()):
         debug_logger = logger.get_logger(logger_name='debug_logger')
         # error.log 只包含错误信息
         error_logger = logger.get_logger(logger_name='error_logger')
-        # normalization file path
-        file_path = '\ '.join(file_path.split())
-
-        ColorFormatter.info('开始计算需要分割的文件 "{}" 的行数'.format(file_path))
-        debug_logger.info('开始计算需要分割的文件 "{}" 的行数'.format(file_path))
-        # 计算 csv 文件的行
-        cmd = "wc -l %s | awk '{print $1}'" % file_path
-        debug_logger.debug('开始运行 {} 命令'.format(cmd))
-        p = subprocess.Popen(cmd, stderr=subprocess.PIPE, stdout=subprocess.PIPE, shell=True)
-        (stdout, stderr) = p.communicate()
-        return_code = p.returncode
-        if return_code != 0:
-            ColorFormatter.error('计算需要分割文件 "{}" 行数时出错, 出错信息为: {}'.format(file_path, stderr.strip()))
-            debug_logger.error('计算需要分割文件 "{}" 行数时出错, 出错信息为: {}'.format(file_path, stderr.strip()))
-            error_logger.error('计算需要分割文件 "{}" 行数时出错, 出错信息为: {}'.format(file_path, stderr.strip()))
-            ColorFormatter.fatal('Please contact author or look through logs/error.log file to examine error place')
-            # 异常退出
-            sys.exit(1)
-        else:
-            ColorFormatter.info('计算需要分割文件 "{}" 行数结束, 一共 {} 行'.format(file_path, str(stdout.strip())))
-            debug_logger.debug('计算需要分割文件 "{}" 行数命令结果, 返回码: {}, 输出为: {}'.format(
-                file_path, return_code, stdout.strip()))
-            file_line = int(stdout.strip())
-            debug_logger.info('计算需要分割文件 "{}" 行数结束, 一共 {} 行'.format(file_path, str(file_line)))
-
-        if file_line > 0:
-            per_file_line = int(file_line / split_count)
-        else:
-            per_file_line = 1
-
-        # 计数器
-        flag = 0
-        # 文件名
-        name = 1
-        # 存放数据
-        data_list = []
-
-        ColorFormatter.info('开始分割文件')
-        debug_logger.info('开始分割文件')
-
-        file_path = ''.join(file_path.split('\\'))
-        try:
-            with open(file_path, 'r') as r:
-                for line in r:
-                    flag += 1
-                    data_list.append(line)
-
-                    # 如果等于设置的每个文件的行数, 就分一个文件, 直到全部分完
-                    if flag == per_file_line:
-                        split_file = os.path.join(SPLIT_PATH, 'split_file_{}.txt'.format(str(name)))
-                        with open(split_file, 'w+') as f:
-                            for data in data_list:
-                                f.write(data)
-                        ColorFormatter.info("文件{}: {} 分割完成".format(name, split_file))
-                        debug_logger.info("文件{}: {} 分割完成".format(name, split_file))
-
-                        # 分割一次 重新初始化一次
-                        name += 1
-                        flag = 0
-                        data_list = []
-        except Exception as e:
-            ColorFormatter.error('分割文件 {} 时候出错, 出错信息为: {}'.format(name, e))
-            ColorFormatter.fatal('Please contact author')
-            debug_logger.error('分割文件 {} 时候出错, 出错信息为: {}'.format(name, e))
-            error_logger.error('分割文件 {} 时候出错, 出错信息为: {}'.format(name, e))
 
+        file_size = os.path.getsize(file_path)
+        ColorFormatter.info('开始计算文件 "{}" 的分割位置, 文件大小为 {} 字节'.format(file_path, file_size))
+        debug_logger.info('开始计算文件 "{}" 的分割位置, 文件大小为 {} 字节'.format(file_path, file_size))
+
+        split_count = max(1, split_count)
+        offsets = [0]
         try:
-            if name != split_count:
-                # 如果不相等, 就是还有多出来的数据
-                last_split_file = os.path.join(SPLIT_PATH, 'split_file_{}.txt'.format(str(name - 1)))
-                # 处理最后一批
-                with open(last_split_file,'a+') as f_target:
-                    for data in data_list:
-                        f_target.write(data)
+            with open(file_path, 'rb') as r:
+                for i in range(1, split_count):
+                    position = int(file_size * i / split_count)
+                    if position <= offsets[-1]:
+                        continue
+                    # 从前一个字节开始读到换行符, 这样刚好落在换行符上的位置也不会跳过一整行
+                    r.seek(position - 1)
+                    r.readline()
+                    position = r.tell()
+                    if offsets[-1] < position < file_size:
+                        offsets.append(position)
         except Exception as e:
-            ColorFormatter.error('分割文件 合并最后一个文件时出错, 出错信息为: {}'.format(e))
+            ColorFormatter.error('计算文件 "{}" 分割位置时出错, 出错信息为: {}'.format(file_path, e))
             ColorFormatter.fatal('Please contact author')
-            debug_logger.error('分割文件 合并最后一个文件时出错, 出错信息为: {}'.format(e))
-            error_logger.error('分割文件 合并最后一个文件时出错, 出错信息为: {}'.format(e))
+            debug_logger.error('计算文件 "{}" 分割位置时出错, 出错信息为: {}'.format(file_path, e))
+            error_logger.error('计算文件 "{}" 分割位置时出错, 出错信息为: {}'.format(file_path, e))
+            return False
+        offsets.append(file_size)
+
+        ranges = list(zip(offsets[:-1], offsets[1:]))
+        for name, (start, end) in enumerate(ranges, 1):
+            debug_logger.info("文件{}: [{}, {}) 分割完成".format(name, start, end))
 
-        ColorFormatter.success("文件 {} 分割完成".format(file_path))
-        debug_logger.info("文件 {} 分割完成".format(file_path))
-        return True
+        ColorFormatter.success("文件 {} 分割完成, 一共 {} 段".format(file_path, len(ranges)))
+        debug_logger.info("文件 {} 分割完成, 一共 {} 段".format(file_path, len(ranges)))
+        return ranges
 
     except:
         return False
+
+
+def normalize_line(line):
+    """
+    在 bytes 上统一换行符并解码: 去掉行尾的 \r\n 或者 \n, 行中间单独的 \r (^M) 也去掉.
+    不能用 utf8 解码的字节不替换成 U+FFFD, 而是用 surrogateescape 原样保留下来, Database.insert_data
+    用 find_undecodable 找出这样的行写进 reject 文件, 写的时候还原成原来的字节
+
+    :param line: 一行 bytes
+    :return: 这一行的字符串
+    """
+
+    line = line.rstrip(b'\r\n')
+    if b'\r' in line:
+        line = line.replace(b'\r', b'')
+    return line.decode('utf8', errors='surrogateescape')
+
+
+def find_undecodable(fields):
+    """
+    找出一行数据中 normalize_line 保留下来的不能用 utf8 解码的字节
+
+    :param fields: 数据列表
+    :return: 错误信息, 例如 "'utf8' codec can't decode byte 0xff in column 2", 全部都能解码的话返回 None
+    """
+
+    for index, field in enumerate(fields, 1):
+        # 纯 ASCII 的字符串 isascii 不需要遍历
+        if field and not field.isascii():
+            match = UNDECODABLE_PATTERN.search(field)
+            if match:
+                return "'utf8' codec can't decode byte 0x{:02x} in column {}".format(
+                    ord(match.group()) - 0xdc00, index)
+    return None
+
+
+def read_file_range(file_path, start, end):
+    """
+    读取文件 [start, end) 这一段的每一行, start 必须是一行的开头.
+    读取的时候直接在 bytes 上统一换行符: 去掉行尾的 \r\n 或者 \n, 行中间单独的 \r (^M) 也去掉,
+    不会再把一行拆成两行, 也不需要先用 dos2unix 把整个文件重写一遍
+
+    :param file_path: 文件路径
+    :param start: 开始的字节位置
+    :param end: 结束的字节位置, 从这个位置开始的行不会被读取
+    :return: 生成器, 每次返回 (这一行开头的字节位置, 下一行开头的字节位置, 这一行的字符串)
+    """
+
+    with open(file_path, 'rb') as r:
+        r.seek(start)
+        position = start
+        for line in r:
+            if position >= end:
+                break
+            line_position = position
+            position += len(line)
+            yield line_position, position, normalize_line(line)
@@ -0,0 +1,272 @@
+# encoding: utf8
+#!/usr/bin/env python3
+import os
+import json
+import time
+import cProfile
+import resource
+from contextlib import contextmanager
+
+# 每个进程记录的阶段: 计算行数, 分割文件, 发送数据 (INSERT / LOAD DATA), 提交事务
+PHASES = ('count', 'split', 'insert', 'commit')
+# --profile 记录的更细的阶段: 读取一行, csv 解析 / txt 分隔, 清洗, 去重, 放进批量缓冲区 (load-data 模式下还有
+# 转义和写临时文件), 发送到数据库 (executemany / COPY / LOAD DATA, 驱动拼 sql 语句也在里面), 写 reject 文件, 提交事务
+PROFILE_STAGES = ('read', 'parse', 'clean', 'dedupe', 'format', 'execute', 'reject', 'commit')
+# 直方图第 i 格是用时小于 2 ** i 微秒 (并且不小于 2 ** (i - 1) 微秒) 的次数, 最后一格包括所有更慢的
+HISTOGRAM_BUCKETS = 32
+
+
+class PhaseTimer(object):
+    """
+    记录每个阶段累计用了多少秒, 同一个阶段可以计时很多次
+
+    Usage example:
+    '''
+    timer = PhaseTimer()
+    with timer.phase('count'):
+        count_lines(file_path)
+    print(timer.phases)  # {'count': 0.12}
+    '''
+    """
+
+    def __init__(self):
+        self.phases = {}
+
+    def add(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    @contextmanager
+    def phase(self, name):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start_time)
+
+
+class StageProfiler(object):
+    """
+    --profile 使用, 记录每个阶段的总用时, 次数和用时直方图. 阶段可以嵌套, 记录的是去掉里面的阶段之后自己的用时,
+    例如 parse 里面调用了 read, parse 只算 csv 解析本身. 没有 --profile 的时候不创建这个对象, 热点循环里面
+    也就没有任何计时的开销
+
+    Usage example:
+    '''
+    profiler = StageProfiler()
+    rows = csv.reader(profiler.iterate(lines, 'read'))
+    for row in profiler.iterate(rows, 'parse'):
+        row = profiler.wrap(clean_file_string, 'clean')(row)
+    profiler.to_dict()
+    '''
+    """
+
+    def __init__(self):
+        self.seconds = {}
+        self.calls = {}
+        self.histograms = {}
+        # 所有阶段已经记录的用时, 外层的阶段用它减去里面的阶段的用时
+        self.nested = 0.0
+
+    def add(self, name, seconds):
+        self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+        self.calls[name] = self.calls.get(name, 0) + 1
+        self.nested += seconds
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = [0] * HISTOGRAM_BUCKETS
+        histogram[min(int(seconds * 1000000).bit_length(), HISTOGRAM_BUCKETS - 1)] += 1
+
+    @contextmanager
+    def stage(self, name):
+        nested = self.nested
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start_time - (self.nested - nested))
+
+    def wrap(self, func, name):
+        """返回一个计时的 func, 每调用一次记录一次 name 阶段"""
+        perf_counter = time.perf_counter
+
+        def timed(*args, **kwargs):
+            nested = self.nested
+            start_time = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.add(name, perf_counter() - start_time - (self.nested - nested))
+        return timed
+
+    def iterate(self, iterable, name):
+        """迭代 iterable, 每取一项记录一次 name 阶段, 例如 csv.reader 每解析一行"""
+        perf_counter = time.perf_counter
+        iterator = iter(iterable)
+        while True:
+            nested = self.nested
+            start_time = perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            self.add(name, perf_counter() - start_time - (self.nested - nested))
+            yield item
+
+    def to_dict(self):
+        return {
+            'seconds': dict([(name, round(seconds, 6)) for name, seconds in self.seconds.items()]),
+            'calls': dict(self.calls),
+            'histograms': dict([(name, list(histogram)) for name, histogram in self.histograms.items()]),
+        }
+
+
+@contextmanager
+def cprofile_dump(profile, role):
+    """
+    --profile --cprofile 的时候用 cProfile 统计 with 里面的代码, 结束的时候写进 {profile dir}/{role}_{pid}.prof,
+    可以用 python3 -m pstats 或者 snakeviz 查看
+
+    :param profile: --profile 的配置, 包括 dir 和 cprofile, None 的话什么都不做
+    :param role: 进程的角色, 例如 worker, parser, writer
+    """
+
+    if not profile or not profile.get('cprofile'):
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        os.makedirs(profile['dir'], exist_ok=True)
+        profiler.dump_stats(os.path.join(profile['dir'], '{}_{}.prof'.format(role, os.getpid())))
+
+
+def write_stats(path, role, phases, **counts):
+    """
+    把这个进程的统计信息作为一行 JSON 追加到 --stats-file, 和 reject 文件一样用 O_APPEND 和一次 os.write,
+    多个进程可以写同一个文件
+
+    :param path: 统计文件路径, None 的话什么都不做
+    :param role: 进程的角色, 例如 database, split
+    :param phases: {阶段: 秒数} 字典
+    :param counts: 其他计数, 例如 rows, success, failed, 以及 --profile 的 StageProfiler.to_dict()
+    :return:
+    """
+
+    if not path:
+        return
+    record = {
+        'pid': os.getpid(),
+        'role': role,
+        'phases': dict([(name, round(seconds, 6)) for name, seconds in phases.items()]),
+        # Linux 上的单位是 KB
+        'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+    record.update(counts)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+    try:
+        os.write(fd, (json.dumps(record) + '\n').encode('utf8'))
+    finally:
+        os.close(fd)
+
+
+def merge_stats(path):
+    """
+    合并统计文件中所有进程的记录, 阶段用时和行数相加, 内存取最大值
+
+    :param path: 统计文件路径
+    :return: 合并之后的字典, 文件不存在的话各项都是 0
+    """
+
+    merged = {
+        'records': 0,
+        'phases': dict([(_, 0.0) for _ in PHASES]),
+        'rows': 0,
+        'success': 0,
+        'failed': 0,
+        'commits': 0,
+        'max_rss_kb': 0,
+    }
+    if not os.path.exists(path):
+        return merged
+    with open(path, 'r', encoding='utf8') as r:
+        for line in r:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            merged['records'] += 1
+            for name, seconds in record.get('phases', {}).items():
+                merged['phases'][name] = merged['phases'].get(name, 0.0) + seconds
+            for key in ('rows', 'success', 'failed', 'commits'):
+                merged[key] += record.get(key, 0)
+            merged['max_rss_kb'] = max(merged['max_rss_kb'], record.get('max_rss_kb', 0))
+    merged['phases'] = dict([(name, round(seconds, 6)) for name, seconds in merged['phases'].items()])
+    return merged
+
+
+def histogram_percentile(histogram, percent):
+    """直方图中 percent% 的次数都小于的用时 (微秒), 只精确到 2 的幂"""
+    total = sum(histogram)
+    if not total:
+        return 0
+    limit, count = total * percent / 100.0, 0
+    for i, bucket_count in enumerate(histogram):
+        count += bucket_count
+        if count >= limit:
+            return 2 ** i
+    return 2 ** (len(histogram) - 1)
+
+
+def merge_profile(path):
+    """
+    合并统计文件中所有进程的 --profile 记录, 每个阶段的用时, 次数和直方图相加
+
+    :param path: 统计文件路径
+    :return: 报告字典, 包括每个阶段的合计 stages, 每个进程的 processes 和用时最多的阶段 bottleneck
+    """
+
+    stages, processes = {}, []
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf8') as r:
+            for line in r:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                profile = record.get('profile')
+                if not profile:
+                    continue
+                processes.append({'pid': record.get('pid'), 'role': record.get('role'),
+                                  'rows': record.get('rows', 0), 'seconds': profile['seconds']})
+                for name, seconds in profile['seconds'].items():
+                    stage = stages.setdefault(name, {'seconds': 0.0, 'calls': 0,
+                                                     'histogram': [0] * HISTOGRAM_BUCKETS})
+                    stage['seconds'] += seconds
+                    stage['calls'] += profile['calls'].get(name, 0)
+                    for i, bucket_count in enumerate(profile['histograms'].get(name, [])):
+                        stage['histogram'][min(i, HISTOGRAM_BUCKETS - 1)] += bucket_count
+
+    total_seconds = sum([_['seconds'] for _ in stages.values()])
+    report_stages = {}
+    for name, stage in stages.items():
+        histogram = stage['histogram']
+        report_stages[name] = {
+            'seconds': round(stage['seconds'], 6),
+            'percent': round(stage['seconds'] * 100 / total_seconds, 2) if total_seconds else 0,
+            'calls': stage['calls'],
+            'mean_us': round(stage['seconds'] * 1000000 / stage['calls'], 3) if stage['calls'] else 0,
+            'p50_us': histogram_percentile(histogram, 50),
+            'p90_us': histogram_percentile(histogram, 90),
+            'p99_us': histogram_percentile(histogram, 99),
+            # {"小于多少微秒": 次数}, 只保留不为 0 的格子
+            'histogram_us': dict([(str(2 ** i), _) for i, _ in enumerate(histogram) if _]),
+        }
+    return {
+        'stages': report_stages,
+        'bottleneck': max(stages, key=lambda _: stages[_]['seconds']) if stages else None,
+        'processes': processes,
+    }
@@ -2,20 +2,37 @@
 #!/usr/bin/env python3
 import csv
 import os
+import json
+import itertools
 import sys
 import time
-import pymysql
+import shutil
 from termcolor import colored
-from lib.settings import DATABASE, DATABASE_USER, DATABASE_PASSWORD, LOG_PATH, SPLIT_PATH, TABLE_NAME
+from lib.settings import DATABASE, DATABASE_USER, DATABASE_PASSWORD, LOG_PATH, TABLE_NAME, REJECT_FILE, \
+    CHECKPOINT_PATH
 from lib.Logger import Logger
-from lib.progress_bar import ProgressBar
+from lib.progress_bar import ProgressBar, SharedProgress
 from lib.print_formatter import ColorFormatter
 from lib.split_file import split_file
 from lib.cmdline import CmdLineParser
-from lib.database import Database
-import subprocess
+from lib.database import Database, ConnectionPool
+from lib.backends import get_backend, BACKEND_DRIVERS
+from lib.checkpoint import Checkpoint
+from lib.line_counter import count_lines
+from lib.scheduler import ChunkScheduler, iter_tasks
+from lib.pipeline import Pipeline, ThreadWriter
+from lib.file_list import expand_input_files
+from lib.source import StreamSource, is_stream_source, read_source_range
+from lib.schema import infer_column_types, parse_column_types, null_columns_of
+from lib.dedupe import Deduper, key_indexes_of
+from lib.reject import RejectFile, iter_rejects
+from lib.stats import PhaseTimer, StageProfiler, cprofile_dump, merge_stats, merge_profile, write_stats
+from lib.clean import clean_file_string, split_txt_line, repair_txt_fields, clean_txt_line, clean_csv_batch, \
+    clean_txt_batch, vectorize_rows, vectorize_supported
 import platform
-from multiprocessing import Process
+
+# 计算文件行数时使用的线程数
+COUNT_THREADS = min(4, os.cpu_count() or 1)
 
 
 def banner():
@@ -39,190 +56,1301 @@ def banner():
     """, 'cyan'))
 
 
-def handle_data_to_database(suffix_name, database_obj, table_name, debug_logger, error_logger, skip_error=False):
-    one_split_file = os.path.join(SPLIT_PATH, 'split_file_{}.txt'.format(str(suffix_name)))
-    record_line_file = os.path.join(SPLIT_PATH, 'record_line_{}.txt'.format(str(suffix_name)))
-    with open(one_split_file, 'r') as r:
-        # 这里是用, 分隔的 csv文件
-        line = csv.reader(r, delimiter=',', quoting=csv.QUOTE_NONE)
-        columns_str = ''
-
-        # 计算 csv 文件的行
-        cmd = "wc -l %s | awk '{print $1}'" % one_split_file
-        debug_logger.debug('开始运行 {} 命令'.format(cmd))
-        p = subprocess.Popen(cmd, stderr=subprocess.PIPE, stdout=subprocess.PIPE, shell=True)
-        (stdout, stderr) = p.communicate()
-        return_code = p.returncode
-        if return_code != 0 or stderr:
-            ColorFormatter.error('计算文件 "{}" 行数时出错, 出错信息为: {}'.format(one_split_file, str(stderr.strip())))
-            debug_logger.error('计算文件 "{}" 行数时出错, 出错信息为: {}'.format(one_split_file, str(stderr.strip())))
-            error_logger.error('计算文件 "{}" 行数时出错, 出错信息为: {}'.format(one_split_file, str(stderr.strip())))
-            # 异常退出
-            sys.exit(1)
+def read_csv_header(file_path):
+    """读取 csv 文件第一个不为空的行, 也就是所有数据的列名"""
+    for _, _, one_line in read_source_range(file_path, 0, os.path.getsize(file_path)):
+        all_cols = next(csv.reader([one_line], delimiter=',', quoting=csv.QUOTE_NONE), [])
+        if all_cols:
+            return all_cols
+    return []
+
+
+def create_csv_table(database_obj, table_name, all_cols, debug_logger, error_logger, column_types=None):
+    """
+    用 csv 文件的列名或者 txt 文件的 -c 列名创建数据库表, 在父进程中创建一次, 然后才开始插入数据
+
+    :param database_obj: Database 对象
+    :param table_name: table name
+    :param all_cols: 列名列表
+    :param debug_logger: debug logger
+    :param error_logger: error logger
+    :param column_types: {列名: 类型} 字典, 见 resolve_column_types
+    :return: 创建成功或者表已经存在返回 True, 否则返回 False, 不能再往这个表插入数据
+    """
+
+    debug_logger.debug('create table {}'.format(table_name))
+    create_result = database_obj.create_table(table_name=table_name, table_column_list=all_cols,
+                                              column_types=column_types)
+    if create_result == 'True':
+        debug_logger.info('create table {} successful'.format(table_name))
+        ColorFormatter.success('创建表 "{}" 成功'.format(table_name))
+    elif 'already exists' in create_result or 'Duplicate column name' in create_result:
+        debug_logger.warning('table "{}" has been existed'.format(table_name))
+        ColorFormatter.info('表 "{}" 已经存在'.format(table_name))
+    else:
+        debug_logger.error('create table "{}" failed'.format(table_name))
+        error_logger.error('create table "{}" failed'.format(table_name))
+        ColorFormatter.fatal('创建表 "{}" 失败'.format(table_name))
+        return False
+    return True
+
+
+def take_sample(rows, schema_config):
+    """
+    取出推断列类型用的样本, 最多 sample_rows 行或者 sample_bytes 字节
+
+    :param rows: 生成器, 每次返回 (行号, 字节位置, 数据列表), 例如 iter_csv_rows
+    :param schema_config: 推断列类型的配置, None 或者不需要推断的时候不读取样本
+    :return: 样本列表
+    """
+
+    sample = []
+    if not schema_config or not schema_config['infer']:
+        return sample
+
+    start_position = None
+    for row in rows:
+        sample.append(row)
+        if start_position is None:
+            start_position = row[1]
+        if len(sample) >= schema_config['sample_rows'] or row[1] - start_position >= schema_config['sample_bytes']:
+            break
+    return sample
+
+
+def sample_file(file_path, file_type, separator, column_list, schema_config):
+    """从文件开头取出推断列类型用的样本, 见 take_sample"""
+    if not schema_config or not schema_config['infer']:
+        return []
+    file_size = os.path.getsize(file_path)
+    if file_type == 'csv':
+        rows = iter_csv_rows(file_path, 0, file_size)
+    else:
+        rows = iter_txt_rows(file_path, 0, file_size, separator, len(column_list))
+    return take_sample(rows, schema_config)
+
+
+def resolve_column_types(column_list, sample, schema_config, debug_logger, database_config=None):
+    """
+    根据样本推断每一列的类型, 再用 --column-type 指定的类型覆盖
+
+    :param column_list: 列名列表
+    :param sample: take_sample 取出的样本
+    :param schema_config: 推断列类型的配置, 包括 infer, sample_rows, sample_bytes, margin, overrides
+    :param debug_logger: debug logger
+    :param database_config: 子进程和写入线程创建 Database 对象用的配置, 数字和日期类型的列会写进 null_columns
+    :return: {列名: 类型} 字典, 不需要推断也没有覆盖的时候为 None
+    """
+
+    if not schema_config:
+        return None
+
+    column_types = {}
+    if schema_config['infer']:
+        column_types = infer_column_types(column_list, [_[2] for _ in sample], margin=schema_config['margin'])
+        ColorFormatter.info('根据 {} 行样本推断列的类型: {}'.format(
+            len(sample), ', '.join(['{} {}'.format(_, column_types[_]) for _ in column_list])))
+        debug_logger.info('infer column types from {} sample rows: {}'.format(len(sample), column_types))
+
+    for column, column_type in schema_config['overrides'].items():
+        if column in column_list:
+            column_types[column] = column_type
         else:
-            ColorFormatter.info('计算 "{}" 文件行数结束, 一共 "{}" 行'.format(one_split_file, str(stdout.strip())))
-            debug_logger.info('计算 "{}" 文件行数结束, 一共 "{}" 行'.format(one_split_file, str(stdout.strip())))
+            ColorFormatter.warning('--column-type 指定的列 "{}" 不存在'.format(column))
+            debug_logger.warning('column "{}" of --column-type does not exist'.format(column))
+
+    if database_config is not None:
+        database_config['null_columns'] = null_columns_of(column_types)
+    return column_types
+
+
+def insert_csv_range(file_path, start, end, database_obj, table_name, columns, debug_logger, error_logger,
+                     skip_error=False, checkpoint=None, resume_record=None, progress_bar=None, shared_progress=None,
+                     progress_index=0, line_prefix=None, deduper=None):
+    """
+    把 csv 文件 [start, end) 这一段的数据插入数据库, 单进程的时候就是 [0, 文件大小) 整个文件, 第一段的第一行是列名,
+    会被跳过. 列名和数据库表在调用之前就已经由父进程准备好了
+
+    :param file_path: csv 文件路径
+    :param start: 这一段开始的字节位置
+    :param end: 这一段结束的字节位置
+    :param database_obj: Database 对象, 多进程的时候同一个子进程会用它处理很多段
+    :param table_name: table name
+    :param columns: 列名列表
+    :param debug_logger: debug logger
+    :param error_logger: error logger
+    :param skip_error: skip unimportant insert error information, default False
+    :param checkpoint: Checkpoint 对象, 每次提交事务之后记录这一段已经提交到的位置
+    :param resume_record: 上一次保存的 checkpoint 记录, 从它记录的位置继续处理
+    :param progress_bar: 单进程的时候显示进度条
+    :param shared_progress: 多进程的时候把已经处理的行数, 成功和失败的条数写进共享内存
+    :param progress_index: 多进程的时候这一段在 shared_progress 中的位置
+    :param line_prefix: 一次导入多个文件的时候加在行号前面的文件名, 这样 error.log 中可以知道是哪个文件的哪一行
+    :param deduper: Deduper 对象, 重复的行不插入数据库, 暂时写到磁盘上的行在这一段的最后插入.
+                    这时候不能使用 checkpoint, 因为提交的位置之前可能还有没有插入的行
+    :return:
+    """
+
+    # 断点续传, 从上次提交的位置继续
+    offset, lines, committed_rows = start, 0, 0
+    if resume_record:
+        offset, lines, committed_rows = resume_record['offset'], resume_record['lines'], resume_record['committed_rows']
+
+    # Database 对象的计数是累计的, 这一段的数量要减去开始之前的数量, 再加上上次已经提交的数量
+    resume_success = resume_record.get('success_rows', 0) if resume_record else 0
+    resume_failed = resume_record.get('failed_rows', 0) if resume_record else 0
+    base_success = database_obj.insert_success_count - resume_success
+    base_failed = database_obj.insert_failed_count - resume_failed
+    base_committed = database_obj.committed_total_count - committed_rows
+    base_committed_success = database_obj.committed_success_count - resume_success
+    base_committed_failed = database_obj.committed_failed_count - resume_failed
+
+    def save_checkpoint(offset_position, lines_read, done=False):
+        checkpoint.save(start, end, offset_position, lines_read, database_obj.committed_total_count - base_committed,
+                        done=done, success_rows=database_obj.committed_success_count - base_committed_success,
+                        failed_rows=database_obj.committed_failed_count - base_committed_failed)
+
+    # 当前这一行: [这一行开头的字节位置, 下一行开头的字节位置, 一共读了多少行]
+    current = [offset, offset, lines]
+    database_obj.source_file = file_path
+
+    def iter_lines():
+        for line_position, next_position, one_line in read_source_range(file_path, offset, end):
+            current[0], current[1] = line_position, next_position
+            current[2] += 1
+            yield one_line
+
+    # --profile 的时候给读取, 解析, 清洗, 去重和插入分别计时, 否则直接使用原来的函数, 没有额外的开销
+    profiler = database_obj.profiler
+    # --vectorize 的时候每 VECTORIZE_BATCH_ROWS 行一起清洗
+    vectorize = database_obj.vectorize
+    text_lines, insert_data = iter_lines(), database_obj.insert_data
+    clean_row = clean_csv_batch if vectorize else clean_file_string
+    check_row = deduper.check if deduper else None
+    if profiler:
+        text_lines = profiler.iterate(text_lines, 'read')
+        clean_row = profiler.wrap(clean_row, 'clean')
+        insert_data = profiler.wrap(insert_data, 'format')
+        if deduper:
+            check_row = profiler.wrap(check_row, 'dedupe')
+
+    # 这里是用, 分隔的 csv文件
+    line = csv.reader(text_lines, delimiter=',', quoting=csv.QUOTE_NONE)
+    if profiler:
+        line = profiler.iterate(line, 'parse')
+    columns_str = ", ".join(columns)
+    # 只有第一段的第一行是列名, 续传的时候列名那一行已经处理过了
+    header_done = not (start == 0 and offset == 0)
+
+    count = 1
+
+    # 每一行带上读到它的时候的 current, 按批清洗的时候读取比插入提前一批, 不能再直接用 current
+    rows = ((current[0], current[1], current[2], all_cols) for all_cols in line)
+    if vectorize:
+        rows = vectorize_rows(rows, clean_row)
+
+    # 这里可能会出错 -> _csv.Error: field larger than field limit (131072)
+    for line_position, next_position, lines_read, all_cols in rows:
+        # 跳过空行
+        if all_cols:
+            if not header_done:
+                # 第一行是列名, 已经用来创建过数据库表了
+                header_done = True
+            else:
+                # 不为第一行
+                #  剔除 \r\n 的列, --vectorize 的时候已经按批清洗过了
+                if not vectorize:
+                    all_cols = clean_row(all_cols)
+                # 第一段可以知道真实的行号, 其他段只能记录这一行开头的字节位置
+                line_number = lines_read if start == 0 else 'offset {}'.format(line_position)
+                if line_prefix:
+                    line_number = '{}:{}'.format(line_prefix, line_number)
+                committed = False
+                if deduper is None or check_row(all_cols, line_number):
+                    committed = insert_data(table_name=table_name, column_list=columns_str, data_list=all_cols,
+                                            skip_error=skip_error, line_number=line_number)
+                if committed and checkpoint:
+                    # 这一行以及之前的数据都已经提交了
+                    save_checkpoint(next_position, lines_read)
+
+            if progress_bar:
+                progress_bar.handle_progress()
+
+            if shared_progress and count % 1000 == 0:
+                # 每 1000 行更新一次共享内存
+                shared_progress.update(progress_index, lines_read, database_obj.insert_success_count - base_success,
+                                       database_obj.insert_failed_count - base_failed, next_position - start)
+
+            count += + 1
+
+    if deduper:
+        # 暂时写到磁盘上的行最后去重插入
+        for line_number, all_cols in deduper.drain():
+            insert_data(table_name=table_name, column_list=columns_str, data_list=all_cols, skip_error=skip_error,
+                        line_number=line_number)
+
+    # 事务提交, 插入数据
+    debug_logger.debug('execute insert sql commit')
+    if database_obj.execute_commit():
+        debug_logger.info('execute insert sql commit successful')
+        if checkpoint:
+            save_checkpoint(end, current[2], done=True)
+
+    if shared_progress:
+        shared_progress.update(progress_index, current[2], database_obj.insert_success_count - base_success,
+                               database_obj.insert_failed_count - base_failed, end - start)
+
+
+def load_checkpoint(checkpoint, resume, debug_logger):
+    """
+    --resume 的时候读取上一次导入的 checkpoint, 否则 (或者没有可以继续的 checkpoint) 清除旧的 checkpoint
+
+    :param checkpoint: Checkpoint 对象
+    :param resume: 是否断点续传
+    :param debug_logger: debug logger
+    :return: {start: record} 字典
+    """
+
+    records = checkpoint.load() if resume else {}
+    if records:
+        committed_rows = sum([_['committed_rows'] for _ in records.values()])
+        ColorFormatter.info('从 checkpoint 继续导入文件 "{}", 已经提交了 "{}" 条数据'.format(
+            checkpoint.file_path, committed_rows))
+        debug_logger.info('resume file "{}" from checkpoint {}, {} rows committed'.format(
+            checkpoint.file_path, checkpoint.manifest_path, committed_rows))
+    else:
+        if resume:
+            ColorFormatter.warning('没有找到文件 "{}" 可以继续的 checkpoint, 从头开始导入'.format(checkpoint.file_path))
+            debug_logger.warning('no checkpoint to resume file "{}"'.format(checkpoint.file_path))
+        checkpoint.clear()
+    return records
+
+
+def chunk_worker(worker_index, task_queue, result_pipe, file_type, file_path, columns, separator, database_config,
+                 logger, table_name, debug_logger, error_logger, skip_error=False, checkpoint=None,
+                 shared_progress=None):
+    """
+    多进程的子进程, 不断从任务队列中取一段 [start, end) 处理, 直到父进程通知退出. 每一段开始的时候读取这一段的
+    checkpoint, 所以父进程把异常退出的子进程手上的那一段交给新的子进程的时候, 会从上次提交的位置继续
+    """
+
+    # --profile --cprofile 的时候每个子进程写一个自己的 cProfile 文件
+    with cprofile_dump(database_config.get('profile'), 'worker'):
+        # 每个进程都用自己的数据库连接, 不能和父进程或者其他进程共用一个 socket
+        database_obj = Database(logger=logger, **database_config)
+
+        for chunk_index, (start, end) in iter_tasks(worker_index, task_queue, result_pipe):
+            resume_record = checkpoint.load_chunk(start) if checkpoint else None
+            if resume_record and resume_record['done']:
+                shared_progress.update(chunk_index, resume_record['lines'], resume_record.get('success_rows', 0),
+                                       resume_record.get('failed_rows', 0), end - start)
+                continue
+
+            shared_progress.start(chunk_index)
+            debug_logger.info('worker %s 开始处理文件 "%s" 的第 %s 段 [%s, %s)',
+                              worker_index + 1, file_path, chunk_index + 1, start, end)
+
+            if file_type == 'csv':
+                insert_csv_range(file_path, start, end, database_obj, table_name, columns, debug_logger, error_logger,
+                                 skip_error=skip_error, checkpoint=checkpoint, resume_record=resume_record,
+                                 shared_progress=shared_progress, progress_index=chunk_index)
+            else:
+                insert_txt_range(file_path, start, end, database_obj, table_name, columns, separator, debug_logger,
+                                 skip_error=skip_error, checkpoint=checkpoint, resume_record=resume_record,
+                                 shared_progress=shared_progress, progress_index=chunk_index)
+
+        database_obj.close()
+        debug_logger.info('worker %s insert data to database done', worker_index + 1)
 
-        count = 1
 
-        # 这里可能会出错 -> _csv.Error: field larger than field limit (131072)
-        for all_cols in line:
+def iter_csv_rows(file_path, start, end, vectorize=False, profiler=None):
+    """
+    流水线的解析阶段使用, 读取 csv 文件 [start, end) 这一段, 跳过第一段的列名和空行
+
+    :param vectorize: --vectorize 的时候每 VECTORIZE_BATCH_ROWS 行用 clean_csv_batch 一起清洗
+    :param profiler: --profile 的时候给读取, 解析和清洗计时的 StageProfiler
+    :return: 生成器, 每次返回 (行号, 下一行开头的字节位置, 清洗之后的数据列表)
+    """
+
+    # 当前这一行: [这一行开头的字节位置, 下一行开头的字节位置, 一共读了多少行]
+    current = [start, start, 0]
+
+    def iter_lines():
+        for line_position, next_position, one_line in read_source_range(file_path, start, end):
+            current[0], current[1] = line_position, next_position
+            current[2] += 1
+            yield one_line
+
+    text_lines, clean_row = iter_lines(), clean_csv_batch if vectorize else clean_file_string
+    if profiler:
+        text_lines = profiler.iterate(text_lines, 'read')
+        clean_row = profiler.wrap(clean_row, 'clean')
+    reader = csv.reader(text_lines, delimiter=',', quoting=csv.QUOTE_NONE)
+    if profiler:
+        reader = profiler.iterate(reader, 'parse')
+
+    def iter_raw_rows():
+        # 只有第一段的第一行是列名
+        header_done = start != 0
+        for all_cols in reader:
             # 跳过空行
             if all_cols:
-                if suffix_name == 1:
-                    if count == 1:
-                        # 第一个分割文件的第一行，获取所有数据的列名, 然后创建数据库表
-                        columns_str =  ", ".join(all_cols)
-
-                        debug_logger.debug('create table {}'.format(table_name))
-                        create_result = database_obj.create_table(table_name=table_name, table_column_list=all_cols)
-                        if create_result == 'True':
-                            debug_logger.info('create table {} successful'.format(table_name))
-                            ColorFormatter.success('创建表 "{}" 成功'.format(table_name))
-                        elif 'already exists' or 'Duplicate column name' in create_result:
-                            debug_logger.warning('table "{}" has been existed'.format(table_name))
-                            ColorFormatter.info('表 "{}" 已经存在'.format(table_name))
-                        else:
-                            debug_logger.error('create table "{}" failed'.format(table_name))
-                            error_logger.error('create table "{}" failed'.format(table_name))
-                            ColorFormatter.error('创建表 "{}" 失败'.format(table_name))
-                    else:
-                        # 不为第一行
-                        #  剔除 \r\n 的列
-                        all_cols = escape_file_string(all_cols)
-                        # 将每一列的数据拼成一行
-                        data_list = ', '.join(['"{}"'.format(_) for _ in all_cols])
-                        database_obj.insert_data(table_name=table_name, column_list=columns_str,
-                                                 data_list=data_list, skip_error=skip_error)
-                else:
-                    # 不为第一行
-                    #  剔除 \r\n 的列
-                    all_cols = escape_file_string(all_cols)
-                    # 将每一列的数据拼成一行
-                    data_list = ', '.join(['"{}"'.format(_) for _ in all_cols])
-                    database_obj.insert_data(table_name=table_name, column_list=columns_str,
-                                             data_list=data_list, skip_error=skip_error)
+                if not header_done:
+                    header_done = True
+                    continue
+                # 第一段可以知道真实的行号, 其他段只能记录这一行开头的字节位置
+                line_number = current[2] if start == 0 else 'offset {}'.format(current[0])
+                yield line_number, current[1], all_cols
 
-                if count % 50000 == 0:
-                    # 每次 5万 5万 的存
-                    with open(record_line_file, 'w') as f:
-                        f.write("{}\r\n".format(str(count)))
+    if vectorize:
+        yield from vectorize_rows(iter_raw_rows(), clean_row)
+        return
 
-                count += + 1
+    for line_number, next_position, all_cols in iter_raw_rows():
+        yield line_number, next_position, clean_row(all_cols)
 
-        with open(record_line_file, 'w') as f:
-            f.write("{}\r\n".format(str(count-1)))
 
-        # 事务提交, 插入数据
-        debug_logger.debug('execute insert sql commit')
-        database_obj.execute_commit()
-        debug_logger.info('execute insert sql commit successful')
+def iter_txt_rows(file_path, start, end, separator, column_count, vectorize=False, profiler=None):
+    """
+    流水线的解析阶段使用, 读取 txt 文件 [start, end) 这一段, 每一行都按 separator 分隔并对齐到 column_count 列
 
-    r.close()
-    debug_logger.info('insert data to database done')
+    :param vectorize: --vectorize 的时候每 VECTORIZE_BATCH_ROWS 行用 clean_txt_batch 一起分隔和清洗
+    :param profiler: --profile 的时候给读取, 分隔和清洗计时的 StageProfiler
+    :return: 生成器, 每次返回 (行号, 下一行开头的字节位置, 清洗之后的数据列表)
+    """
+
+    if vectorize:
+        def clean_batch(lines):
+            return clean_txt_batch(lines, separator, column_count)
+
+        text_lines = read_source_range(file_path, start, end)
+        if profiler:
+            text_lines = profiler.iterate(text_lines, 'read')
+            clean_batch = profiler.wrap(clean_batch, 'clean')
+        for line_number, (line_position, next_position, row) in enumerate(vectorize_rows(text_lines, clean_batch), 1):
+            line_number = line_number if start == 0 else 'offset {}'.format(line_position)
+            yield line_number, next_position, row
+        return
+
+    if profiler:
+        split_line = profiler.wrap(split_txt_line, 'parse')
+        repair_fields = profiler.wrap(repair_txt_fields, 'clean')
+        for line_number, (line_position, next_position, line) in enumerate(
+                profiler.iterate(read_source_range(file_path, start, end), 'read'), 1):
+            line_number = line_number if start == 0 else 'offset {}'.format(line_position)
+            yield line_number, next_position, repair_fields(split_line(line, separator), column_count)
+        return
+
+    for line_number, (line_position, next_position, line) in enumerate(read_source_range(file_path, start, end), 1):
+        line_number = line_number if start == 0 else 'offset {}'.format(line_position)
+        yield line_number, next_position, clean_txt_line(line, separator, column_count)
+
+
+def check_dedupe_columns(column_list, dedupe_config, debug_logger, error_logger):
+    """检查 --dedupe 指定的列是否都存在, 不存在的话显示错误信息并返回 False"""
+    if not dedupe_config:
+        return True
+    try:
+        key_indexes_of(column_list, dedupe_config['key_columns'])
+        return True
+    except ValueError as e:
+        ColorFormatter.fatal('--dedupe 指定的列不存在: {}'.format(e))
+        debug_logger.error(str(e))
+        error_logger.error(str(e))
+        return False
+
+
+def show_duplicates(duplicate_count, debug_logger):
+    """在汇总信息中显示 --dedupe 跳过的重复数据条数"""
+    ColorFormatter.info('去重跳过 "{}" 条重复的数据'.format(duplicate_count))
+    debug_logger.info('skip {} duplicate rows'.format(duplicate_count))
 
 
-def escape_file_string(string_list):
+def run_pipeline(file_path, table_name, column_list, row_reader, reader_args, pipeline_config, log_level,
+                 debug_logger, error_logger):
     """
-    wash data and split / ' " \r \n \t etc bad data
-    剔除和修改文件中的 \ \r \n \t " ' 的坏数据
-    仅仅适用于文件 string
-    :param string_list: string list
-    :return: 源数据
+    用 解析 -> 写入 流水线导入一个文件, 按字节把文件分成解析进程个数段, 显示进度条和汇总信息
+
+    :param file_path: 文件路径
+    :param table_name: table name
+    :param column_list: 列名列表, 数据库表需要已经创建好了
+    :param row_reader: iter_csv_rows 或者 iter_txt_rows
+    :param reader_args: 传给 row_reader 的其他参数
+    :param pipeline_config: 创建 Pipeline 对象的参数字典
+    :param log_level: log level
+    :param debug_logger: debug logger
+    :param error_logger: error logger
+    :return: 全部正常结束返回 True
     """
 
-    # 剔除 \ \r \n \t " ' 的坏数据
-    if isinstance(string_list, list):
-        string_list = [ _.replace('\\', '\\\\').replace('\r', '').replace('\n', '').replace('\t', '').replace('"', '\\"').replace("'", "\\'") for _ in string_list ]
+    start_time = time.time()
+    pipeline = Pipeline(debug_logger=debug_logger, error_logger=error_logger, **pipeline_config)
+    timer = PhaseTimer()
+    with timer.phase('split'):
+        ranges = split_file(file_path, log_level, split_count=pipeline.parser_count)
+    write_stats(pipeline_config['database_config'].get('stats_file'), 'split', timer.phases)
+    if not ranges:
+        ColorFormatter.error('原数据文件分割失败')
+        debug_logger.error('原数据文件分割失败')
+        error_logger.error('原数据文件分割失败')
+        return False
+
+    ColorFormatter.info('启用流水线导入数据库, {} 个解析进程, {} 个写入进程'.format(len(ranges), pipeline.writer_count))
+    debug_logger.info('启用流水线导入数据库, {} 个解析进程, {} 个写入进程'.format(len(ranges), pipeline.writer_count))
+
+    # 进度条 对象, 按解析进程已经处理的字节数显示进度
+    file_size = os.path.getsize(file_path)
+    progress_bar = ProgressBar(total_line=max(1, file_size), description='正在插入数据(字节): ')
+
+    def show_progress():
+        all_progress = pipeline.total_bytes()
+        if all_progress < file_size:
+            # 打印进度条
+            progress_bar.handle_multiprocessing_progress(current_progress=all_progress)
+
+    failed_stages = pipeline.run(file_path, ranges, row_reader, reader_args, table_name, column_list,
+                                 on_tick=show_progress)
+    progress_bar.handle_multiprocessing_progress(current_progress=max(1, file_size))
+
+    end_time = time.time()
+    print(colored('总共用时: {:.2f}秒'.format(end_time - start_time), 'white'))
+
+    if failed_stages:
+        ColorFormatter.fatal('流水线中有进程异常退出: {}'.format(', '.join(failed_stages)))
     else:
-        string_list =  string_list.replace('\\', '\\\\').replace('\r', '').replace('\n', '').replace('\t', '').replace('"', '\\"').replace("'", "\\'")
-    return string_list
+        ColorFormatter.success('插入数据完成')
+        debug_logger.info('insert data to database done')
+
+    # 显示汇总信息
+    ColorFormatter.info('总共读取 "{}" 行, 插入 "{}" 条数据, 成功 "{}" 条, 失败 "{}" 条'.format(
+        pipeline.total_lines(),
+        pipeline.total_success() + pipeline.total_failed(),
+        pipeline.total_success(),
+        pipeline.total_failed()
+    ))
+    debug_logger.info('总共读取 "{}" 行, 插入 "{}" 条数据, 成功 "{}" 条, 失败 "{}" 条'.format(
+        pipeline.total_lines(),
+        pipeline.total_success() + pipeline.total_failed(),
+        pipeline.total_success(),
+        pipeline.total_failed()
+    ))
+    if pipeline.dedupe_config:
+        show_duplicates(pipeline.total_duplicates(), debug_logger)
+    return not failed_stages
+
+
+def run_thread_writer(file_path, table_name, column_list, row_reader, reader_args, writer_config, debug_logger,
+                      error_logger, dedupe_config=None):
+    """
+    单进程解析文件, 用写入线程池把数据插入数据库, 显示进度条和汇总信息
+
+    :param file_path: 文件路径
+    :param table_name: table name
+    :param column_list: 列名列表, 数据库表需要已经创建好了
+    :param row_reader: iter_csv_rows 或者 iter_txt_rows
+    :param reader_args: 传给 row_reader 的其他参数
+    :param writer_config: 创建 ThreadWriter 对象的参数字典
+    :param debug_logger: debug logger
+    :param error_logger: error logger
+    :param dedupe_config: 创建 Deduper 对象的参数字典, 主线程解析的时候去重, None 为不去重
+    :return: 全部正常结束返回 True
+    """
+
+    start_time = time.time()
+    writer = ThreadWriter(debug_logger=debug_logger, error_logger=error_logger, **writer_config)
+    ColorFormatter.info('启用 {} 个写入线程导入数据库'.format(writer.thread_count))
+    debug_logger.info('启用 {} 个写入线程导入数据库'.format(writer.thread_count))
+
+    # 进度条 对象, 按已经解析的字节数显示进度
+    file_size = os.path.getsize(file_path)
+    progress_bar = ProgressBar(total_line=max(1, file_size), description='正在插入数据(字节): ')
+
+    def show_progress(position):
+        if position < file_size:
+            # 打印进度条
+            progress_bar.handle_multiprocessing_progress(current_progress=position)
+
+    # --profile 的时候给主线程的读取, 解析, 清洗和去重计时, 写入线程的在它们自己的 Database 对象里面
+    database_config = writer_config['database_config']
+    profiler = StageProfiler() if database_config.get('profile') else None
+    rows = row_reader(file_path, 0, file_size, *reader_args, profiler=profiler)
+    deduper = Deduper(column_list, **dedupe_config) if dedupe_config else None
+    if deduper:
+        rows = deduper.filter(rows)
+        if profiler:
+            rows = profiler.iterate(rows, 'dedupe')
+    failed_threads = writer.run(rows, table_name, column_list, on_progress=show_progress, source_file=file_path)
+    progress_bar.handle_multiprocessing_progress(current_progress=max(1, file_size))
+    if profiler:
+        write_stats(database_config.get('stats_file'), 'reader', {}, profile=profiler.to_dict())
+
+    end_time = time.time()
+    print(colored('总共用时: {:.2f}秒'.format(end_time - start_time), 'white'))
+
+    if failed_threads:
+        ColorFormatter.fatal('有 {} 个写入线程异常退出'.format(len(failed_threads)))
+    else:
+        ColorFormatter.success('插入数据完成')
+        debug_logger.info('insert data to database done')
+
+    # 显示汇总信息
+    ColorFormatter.info('总共插入 "{}" 条数据, 成功 "{}" 条, 失败 "{}" 条, 提交事务 "{}" 次'.format(
+        writer.total_success() + writer.total_failed(),
+        writer.total_success(),
+        writer.total_failed(),
+        writer.total_commit()
+    ))
+    debug_logger.info('总共插入 "{}" 条数据, 成功 "{}" 条, 失败 "{}" 条, 提交事务 "{}" 次'.format(
+        writer.total_success() + writer.total_failed(),
+        writer.total_success(),
+        writer.total_failed(),
+        writer.total_commit()
+    ))
+    if deduper:
+        show_duplicates(deduper.duplicate_count, debug_logger)
+        deduper.close()
+    return not failed_threads
+
+
+def insert_txt_range(file_path, start, end, database_obj, table_name, column_list, separator, debug_logger,
+                     skip_error=False, checkpoint=None, resume_record=None, progress_bar=None, shared_progress=None,
+                     progress_index=0, line_prefix=None, deduper=None):
+    """
+    把 txt 文件 [start, end) 这一段的数据插入数据库, 每一行都按 separator 分隔并对齐到 column_list 的列数
+
+    :param file_path: txt 文件路径
+    :param start: 这一段开始的字节位置
+    :param end: 这一段结束的字节位置
+    :param database_obj: Database 对象
+    :param table_name: table name
+    :param column_list: 列名列表
+    :param separator: 分隔符
+    :param debug_logger: debug logger
+    :param skip_error: skip unimportant insert error information, default False
+    :param checkpoint: Checkpoint 对象, 每次提交事务之后记录这一段已经提交到的位置
+    :param resume_record: 上一次保存的 checkpoint 记录, 从它记录的位置继续处理
+    :param progress_bar: 单进程的时候显示进度条
+    :param shared_progress: 多进程的时候把已经处理的行数, 成功和失败的条数写进共享内存
+    :param progress_index: 多进程的时候这一段在 shared_progress 中的位置
+    :param line_prefix: 一次导入多个文件的时候加在行号前面的文件名
+    :param deduper: Deduper 对象, 见 insert_csv_range
+    :return:
+    """
 
+    # 断点续传, 从上次提交的位置继续
+    offset, lines, committed_rows = start, 0, 0
+    if resume_record:
+        offset, lines, committed_rows = resume_record['offset'], resume_record['lines'], resume_record['committed_rows']
+
+    # Database 对象的计数是累计的, 这一段的数量要减去开始之前的数量, 再加上上次已经提交的数量
+    resume_success = resume_record.get('success_rows', 0) if resume_record else 0
+    resume_failed = resume_record.get('failed_rows', 0) if resume_record else 0
+    base_success = database_obj.insert_success_count - resume_success
+    base_failed = database_obj.insert_failed_count - resume_failed
+    base_committed = database_obj.committed_total_count - committed_rows
+    base_committed_success = database_obj.committed_success_count - resume_success
+    base_committed_failed = database_obj.committed_failed_count - resume_failed
+
+    def save_checkpoint(offset_position, done=False):
+        checkpoint.save(start, end, offset_position, lines, database_obj.committed_total_count - base_committed,
+                        done=done, success_rows=database_obj.committed_success_count - base_committed_success,
+                        failed_rows=database_obj.committed_failed_count - base_committed_failed)
+
+    column_str = ", ".join(column_list)
+    database_obj.source_file = file_path
+
+    # --profile 的时候给读取, 分隔, 清洗, 去重和插入分别计时, 见 insert_csv_range
+    profiler = database_obj.profiler
+    text_lines, insert_data = read_source_range(file_path, offset, end), database_obj.insert_data
+    check_row = deduper.check if deduper else None
+    if profiler:
+        text_lines = profiler.iterate(text_lines, 'read')
+        split_line = profiler.wrap(split_txt_line, 'parse')
+        repair_fields = profiler.wrap(repair_txt_fields, 'clean')
+        insert_data = profiler.wrap(insert_data, 'format')
+        if deduper:
+            check_row = profiler.wrap(check_row, 'dedupe')
+
+    # --vectorize 的时候每 VECTORIZE_BATCH_ROWS 行一起分隔和清洗, 每一项的最后一个元素换成清洗之后的数据列表
+    vectorize = database_obj.vectorize
+    if vectorize:
+        def clean_batch(batch_lines):
+            return clean_txt_batch(batch_lines, separator, len(column_list))
+
+        if profiler:
+            clean_batch = profiler.wrap(clean_batch, 'clean')
+        text_lines = vectorize_rows(text_lines, clean_batch)
+
+    for line_position, next_position, line in text_lines:
+        lines += 1
+        # 第一段可以知道真实的行号, 其他段只能记录这一行开头的字节位置
+        line_number = lines if start == 0 else 'offset {}'.format(line_position)
+        if line_prefix:
+            line_number = '{}:{}'.format(line_prefix, line_number)
+        # 清洗坏行
+        if vectorize:
+            data_line_list = line
+        elif profiler:
+            data_line_list = repair_fields(split_line(line, separator), len(column_list))
+        else:
+            data_line_list = clean_txt_line(line, separator, len(column_list))
+        # 执行sql语句
+        committed = False
+        if deduper is None or check_row(data_line_list, line_number):
+            committed = insert_data(table_name=table_name, column_list=column_str, data_list=data_line_list,
+                                    skip_error=skip_error, line_number=line_number)
+        if committed and checkpoint:
+            # 这一行以及之前的数据都已经提交了
+            save_checkpoint(next_position)
+
+        if progress_bar:
+            progress_bar.handle_progress()
+
+        if shared_progress and lines % 1000 == 0:
+            # 每 1000 行更新一次共享内存
+            shared_progress.update(progress_index, lines, database_obj.insert_success_count - base_success,
+                                   database_obj.insert_failed_count - base_failed, next_position - start)
+
+    if deduper:
+        # 暂时写到磁盘上的行最后去重插入
+        for line_number, data_line_list in deduper.drain():
+            insert_data(table_name=table_name, column_list=column_str, data_list=data_line_list,
+                        skip_error=skip_error, line_number=line_number)
+
+    # 事务提交, 插入数据
+    debug_logger.debug('execute insert sql commit')
+    if database_obj.execute_commit():
+        debug_logger.info('execute insert sql commit successful')
+        if checkpoint:
+            save_checkpoint(end, done=True)
 
-def insert_txt_to_database(txt_files, separator, database_obj, column_list, debug_logger, error_logger,
-                           table_name=TABLE_NAME, skip_error=False):
-    cmd = 'dos2unix {}'.format(txt_files)
-    debug_logger.debug('开始运行 {} 命令'.format(cmd))
-    p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True)
-    stdout, stderr = p.communicate()
-    return_code = p.returncode
-
-    if return_code == 0 and not 'Skipping' in str(stderr.strip()):
-        ColorFormatter.info("dos2unix 命令转换成功")
-        debug_logger.info("dos2unix 命令转换成功")
-
-        # 计算文件的行
-        cmd = "wc -l %s | awk '{print $1}'" % txt_files
-        debug_logger.debug('开始运行 {} 命令'.format(cmd))
-        p = subprocess.Popen(cmd, stderr=subprocess.PIPE, stdout=subprocess.PIPE, shell=True)
-        (stdout, stderr) = p.communicate()
-        return_code = p.returncode
-        if return_code == 0 and not stderr:
-            ColorFormatter.info('计算 "{}" 文件行数结束, 一共 "{}" 行'.format(txt_files, str(stdout.strip())))
-            debug_logger.info('计算 "{}" 文件行数结束, 一共 "{}" 行'.format(txt_files, str(stdout.strip())))
-
-            # 处理数据
-            with open(txt_files, 'r') as r:
-                # 进度条
-                progress_bar = ProgressBar(total_line=int(stdout.strip()), description="插入数据中")
-
-                # 创建表
-                database_obj.create_table(table_name=table_name, table_column_list=column_list)
-                # 处理每一行的数据
-                for line in r:
-                    # 过滤掉 空行
-                    if line:
-                        # 去掉两头的空格
-                        line = line.strip()
-                        # 清洗坏行
-                        data_line_list = []
-                        lines = line.split(separator)
-                        lines = escape_file_string(lines)
-                        lines = [ _.strip() for _ in lines if _ ]
-
-                        if len(lines) == len(column_list):
-                            data_line_list = lines
-                        elif len(lines) > len(column_list):
-                            # split出来的长度 大于 column_list 的长度
-                            for i in range(len(column_list)):
-                                data_line_list.append(lines[i])
-                        else:
-                            # split 出来的长度 小于 column_list 的长度, 剩余的用 空字符 填充
-                            data_line_list = lines
-                            for _ in range(len(column_list) - len(data_line_list)):
-                                data_line_list.append('')
+    if shared_progress:
+        shared_progress.update(progress_index, lines, database_obj.insert_success_count - base_success,
+                               database_obj.insert_failed_count - base_failed, end - start)
 
-                        # 将每一列的数据拼成一行
-                        data_list = ', '.join(['"{}"'.format(_) for _ in data_line_list])
 
-                        # 执行sql语句
-                        column_str = ", ".join(column_list)
-                        database_obj.insert_data(table_name=table_name, column_list=column_str, data_list=data_list, skip_error=skip_error)
-                        progress_bar.handle_progress()
+def insert_txt_to_database(txt_files, separator, database_obj, column_list, debug_logger, error_logger,
+                           table_name=TABLE_NAME, skip_error=False, pipeline_config=None, log_level='WARNING',
+                           writer_config=None, fast_config=None, column_types=None, dedupe_config=None):
+    # 换行符在读取的时候统一, 不再用 dos2unix 修改源文件
+    # 创建表
+    if not create_csv_table(database_obj, table_name, column_list, debug_logger, error_logger,
+                            column_types=column_types):
+        sys.exit(1)
 
-                # 事务提交, 插入数据
-                debug_logger.debug('execute insert sql commit')
-                database_obj.execute_commit()
-                debug_logger.info('execute insert sql commit successful')
+    # 流水线和写入线程池模式传给 iter_txt_rows 的参数
+    reader_args = (separator, len(column_list), database_obj.vectorize)
+    if pipeline_config:
+        # 流水线模式, 不需要计算行数, 进度条按字节显示
+        if not run_pipeline(txt_files, table_name, column_list, iter_txt_rows, reader_args, pipeline_config,
+                            log_level, debug_logger, error_logger):
+            sys.exit(1)
+        return
 
-            r.close()
-            debug_logger.info('insert data to database done')
+    if writer_config:
+        # 写入线程池模式
+        if not run_thread_writer(txt_files, table_name, column_list, iter_txt_rows, reader_args, writer_config,
+                                 debug_logger, error_logger, dedupe_config=dedupe_config):
+            sys.exit(1)
+        return
 
-        else:
-            # 计算行数的时候出错了
-            ColorFormatter.error('计算文件 "{}" 行数时出错, 出错信息为: {}'.format(txt_files, str(stderr.strip())))
-            debug_logger.error('计算文件 "{}" 行数时出错, 出错信息为: {}'.format(txt_files, str(stderr.strip())))
-            error_logger.error('计算文件 "{}" 行数时出错, 出错信息为: {}'.format(txt_files, str(stderr.strip())))
-            # 异常退出
+    if fast_config:
+        # 多进程, 和 csv 文件一样按字节分段, 每个子进程用自己的连接, 按 -F 分隔并对齐到 -c 的列数
+        if not import_file_fast(txt_files, 'txt', table_name, column_list, separator, debug_logger=debug_logger,
+                                error_logger=error_logger, skip_error=skip_error, **fast_config):
             sys.exit(1)
+        return
 
-    else:
-        ColorFormatter.error('dos2unix转换时出错, 出错信息为: {}'.format(str(stderr.strip())))
-        debug_logger.error('dos2unix转换时出错, 出错信息为: {}'.format(str(stderr.strip())))
-        error_logger.error('dos2unix转换时出错, 出错信息为: {}'.format(str(stderr.strip())))
+    # 计算文件的行
+    debug_logger.debug('开始计算文件 "{}" 的行数'.format(txt_files))
+    try:
+        with database_obj.timer.phase('count'):
+            txt_file_line = count_lines(txt_files, threads=COUNT_THREADS)
+    except OSError as e:
+        # 计算行数的时候出错了
+        ColorFormatter.error('计算文件 "{}" 行数时出错, 出错信息为: {}'.format(txt_files, e))
+        debug_logger.error('计算文件 "{}" 行数时出错, 出错信息为: {}'.format(txt_files, e))
+        error_logger.error('计算文件 "{}" 行数时出错, 出错信息为: {}'.format(txt_files, e))
         # 异常退出
         sys.exit(1)
 
+    ColorFormatter.info('计算 "{}" 文件行数结束, 一共 "{}" 行'.format(txt_files, txt_file_line))
+    debug_logger.info('计算 "{}" 文件行数结束, 一共 "{}" 行'.format(txt_files, txt_file_line))
+
+    # 进度条
+    progress_bar = ProgressBar(total_line=max(1, txt_file_line), description="插入数据中")
+
+    # 处理每一行的数据
+    deduper = Deduper(column_list, **dedupe_config) if dedupe_config else None
+    insert_txt_range(txt_files, 0, os.path.getsize(txt_files), database_obj, table_name, column_list, separator,
+                     debug_logger, skip_error=skip_error, progress_bar=progress_bar, deduper=deduper)
+    debug_logger.info('insert data to database done')
+    if deduper:
+        show_duplicates(deduper.duplicate_count, debug_logger)
+        deduper.close()
+
+
+def import_file_fast(file_path, file_type, table_name, columns, separator, worker_count, chunk_size, resume,
+                     database_config, logger, log_level, debug_logger, error_logger, skip_error=False, stall_timeout=0):
+    """
+    多进程导入一个大文件, 按字节把文件分成很多小段放进任务队列, worker_count 个子进程从队列中取, -i 和 -t 共用.
+    数据库表需要已经创建好了
+
+    :param file_path: 文件路径
+    :param file_type: 'csv' 或者 'txt'
+    :param table_name: table name
+    :param columns: 列名列表
+    :param separator: txt 文件的分隔符
+    :param worker_count: 子进程的个数
+    :param chunk_size: 每一段大约多少字节
+    :param resume: 是否断点续传
+    :param stall_timeout: 子进程超过 stall_timeout 秒没有进度就结束它, 这一段从 checkpoint 重新开始, 0 为不检查
+    :return: 全部正常结束返回 True
+    """
+
+    start_time = time.time()
+
+    # 使用多核前, 按字节把大文件分成很多小段放进任务队列, 不会重新写一遍文件
+    ColorFormatter.info('启用多进程导入数据库')
+    ColorFormatter.info('开始分割原数据文件')
+
+    # 断点续传的话直接使用上次分割的结果, 否则开始分割
+    checkpoint = Checkpoint(file_path, table_name)
+    saved_records = load_checkpoint(checkpoint, resume, debug_logger)
+    file_size = os.path.getsize(file_path)
+    worker_count = max(1, worker_count or 1)
+    if saved_records:
+        split_result = sorted([(_['start'], _['end']) for _ in saved_records.values()])
+    else:
+        chunk_count = max(worker_count, -(-file_size // max(1, chunk_size)))
+        timer = PhaseTimer()
+        with timer.phase('split'):
+            split_result = split_file(file_path, log_level, split_count=chunk_count)
+        write_stats(database_config.get('stats_file'), 'split', timer.phases)
+        for start, end in split_result or []:
+            checkpoint.save(start, end, start, 0, 0)
+    if split_result:
+        ColorFormatter.success('原数据文件分割完成')
+        debug_logger.info('原数据文件分割完成')
+    else:
+        ColorFormatter.error('原数据文件分割失败')
+        debug_logger.error('原数据文件分割失败')
+        error_logger.error('原数据文件分割失败')
+        return False
+    # 分割完成
+
+    # 共享内存里每一段有自己的一格, 上次已经处理完的段直接算作完成
+    shared_progress = SharedProgress(worker_count=len(split_result))
+    tasks = []
+    for i, (start, end) in enumerate(split_result):
+        record = saved_records.get(start)
+        if record and record['done']:
+            shared_progress.update(i, record['lines'], record.get('success_rows', 0),
+                                   record.get('failed_rows', 0), end - start)
+        else:
+            tasks.append((i, (start, end)))
+
+    # 多进程, 使用多核一起干, 空闲的进程从任务队列取下一段, 异常退出的进程由 scheduler 重启
+    ColorFormatter.info('一共 {} 段, 还需要处理 {} 段, 使用 {} 个进程'.format(
+        len(split_result), len(tasks), min(worker_count, len(tasks))))
+    debug_logger.info('一共 {} 段, 还需要处理 {} 段, 使用 {} 个进程'.format(
+        len(split_result), len(tasks), min(worker_count, len(tasks))))
+    scheduler = ChunkScheduler(
+        worker_target=chunk_worker,
+        worker_args=(file_type, file_path, columns, separator, database_config, logger, table_name,
+                     debug_logger, error_logger, skip_error, checkpoint, shared_progress),
+        worker_count=worker_count, debug_logger=debug_logger, error_logger=error_logger,
+        stall_timeout=stall_timeout, heartbeat=lambda task_id: shared_progress.update_time[task_id])
+
+    # 进度条 对象, 按已经处理的字节数显示进度, 不需要再计算文件的总行数
+    progress_bar = ProgressBar(total_line=max(1, file_size), description='正在插入数据(字节): ')
+
+    def show_progress():
+        all_progress = shared_progress.total_bytes()
+        if all_progress < file_size:
+            # 打印进度条
+            progress_bar.handle_multiprocessing_progress(current_progress=all_progress)
+
+    # 每 2 秒读一次共享内存, 所有段都完成或者放弃了就结束
+    done_chunks, failed_chunks = scheduler.run(tasks, on_tick=show_progress)
+    progress_bar.handle_multiprocessing_progress(current_progress=max(1, file_size))
+
+    end_time = time.time()
+    print(colored('总共用时: {:.2f}秒'.format(end_time - start_time), 'white'))
+
+    # 每一段的速度
+    for i in sorted(done_chunks):
+        debug_logger.info('第 %s 段处理 %s 行, 成功 %s 条, 失败 %s 条, 速度 %.2f 条/秒',
+                          i + 1, shared_progress.lines[i], shared_progress.success[i],
+                          shared_progress.failed[i], shared_progress.throughput(i))
+    if scheduler.restart_count:
+        ColorFormatter.warning('重启了 {} 次子进程'.format(scheduler.restart_count))
+        debug_logger.warning('重启了 {} 次子进程'.format(scheduler.restart_count))
+
+    if failed_chunks:
+        ColorFormatter.fatal('有 {} 段导入失败, 修复问题之后可以加上 --resume 选项继续导入'.format(
+            len(failed_chunks)))
+        error_logger.error('{} chunks failed: {}'.format(
+            len(failed_chunks), [split_result[_] for _ in sorted(failed_chunks)]))
+    else:
+        ColorFormatter.success('插入数据完成')
+        debug_logger.info('insert data to database done')
+
+    # 显示汇总信息
+    ColorFormatter.info('总共插入 "{}" 条数据, 成功 "{}" 条, 失败 "{}" 条'.format(
+        shared_progress.total_success() + shared_progress.total_failed(),
+        shared_progress.total_success(),
+        shared_progress.total_failed()
+    ))
+    debug_logger.info('总共插入 "{}" 条数据, 成功 "{}" 条, 失败 "{}" 条'.format(
+        shared_progress.total_success() + shared_progress.total_failed(),
+        shared_progress.total_success(),
+        shared_progress.total_failed()
+    ))
+    return not failed_chunks
+
+
+def file_worker(worker_index, task_queue, result_pipe, file_type, table_name, columns, separator, database_config,
+                logger, debug_logger, error_logger, skip_error=False, shared_progress=None, dedupe_config=None):
+    """
+    一次导入多个文件的时候的子进程, 不断从任务队列中取一个文件整个导入, 直到父进程通知退出.
+    每个文件开始的时候读取它的 checkpoint, 所以异常退出的子进程手上的文件交给新的子进程的时候, 会从上次提交的位置
+    继续, 也可以 --resume. 去重的时候只有一个子进程, 所有文件共用一个 Deduper. 去重和压缩文件不使用 checkpoint
+    """
+
+    # --profile --cprofile 的时候每个子进程写一个自己的 cProfile 文件
+    with cprofile_dump(database_config.get('profile'), 'worker'):
+        # 每个进程都用自己的数据库连接
+        database_obj = Database(logger=logger, **database_config)
+        deduper = Deduper(columns, **dedupe_config) if dedupe_config else None
+
+        for file_index, file_path in iter_tasks(worker_index, task_queue, result_pipe):
+            file_size = os.path.getsize(file_path)
+            shared_progress.start(file_index)
+            debug_logger.info('worker %s 开始处理文件 "%s"', worker_index + 1, file_path)
+
+            if deduper or is_stream_source(file_path):
+                duplicate_count = deduper.duplicate_count if deduper else 0
+                if file_type == 'csv':
+                    insert_csv_range(file_path, 0, file_size, database_obj, table_name, columns, debug_logger,
+                                     error_logger, skip_error=skip_error, shared_progress=shared_progress,
+                                     progress_index=file_index, line_prefix=file_path, deduper=deduper)
+                else:
+                    insert_txt_range(file_path, 0, file_size, database_obj, table_name, columns, separator,
+                                     debug_logger, skip_error=skip_error, shared_progress=shared_progress,
+                                     progress_index=file_index, line_prefix=file_path, deduper=deduper)
+                if deduper:
+                    shared_progress.set_duplicates(file_index, deduper.duplicate_count - duplicate_count)
+                continue
+
+            # 父进程已经清除了不能继续的 checkpoint, 这里读到的是 --resume 或者上一次异常退出的子进程留下的
+            checkpoint = Checkpoint(file_path, table_name)
+            resume_record = checkpoint.load_chunk(0)
+            if resume_record and resume_record['done']:
+                shared_progress.update(file_index, resume_record['lines'], resume_record.get('success_rows', 0),
+                                       resume_record.get('failed_rows', 0), file_size)
+                continue
+            if not resume_record:
+                checkpoint.save(0, file_size, 0, 0, 0)
+            if file_type == 'csv':
+                insert_csv_range(file_path, 0, file_size, database_obj, table_name, columns, debug_logger, error_logger,
+                                 skip_error=skip_error, checkpoint=checkpoint, resume_record=resume_record,
+                                 shared_progress=shared_progress, progress_index=file_index, line_prefix=file_path)
+            else:
+                insert_txt_range(file_path, 0, file_size, database_obj, table_name, columns, separator, debug_logger,
+                                 skip_error=skip_error, checkpoint=checkpoint, resume_record=resume_record,
+                                 shared_progress=shared_progress, progress_index=file_index, line_prefix=file_path)
+
+        if deduper:
+            deduper.close()
+        database_obj.close()
+        debug_logger.info('worker %s insert data to database done', worker_index + 1)
+
+
+def import_files(file_list, file_type, table_name, columns, separator, worker_count, database_config, logger,
+                 debug_logger, error_logger, skip_error=False, resume=False, dedupe_config=None, stall_timeout=0):
+    """
+    一次导入多个文件, 按文件大小从大到小把文件分给 worker_count 个子进程, 所有文件共用一个进度条和汇总信息.
+    数据库表需要已经创建好了
+
+    :param file_list: 文件路径列表, 已经按文件大小从大到小排序
+    :param file_type: 'csv' 或者 'txt'
+    :param table_name: table name
+    :param columns: 列名列表
+    :param separator: txt 文件的分隔符
+    :param worker_count: 子进程的个数
+    :param resume: 是否断点续传
+    :param dedupe_config: 创建 Deduper 对象的参数字典, 不同文件之间的重复数据也要去掉, 所以只用一个子进程,
+                          子进程异常退出的话它手上的文件不会重试, 压缩文件也一样
+    :param stall_timeout: 子进程超过 stall_timeout 秒没有进度就结束它, 0 为不检查
+    :return: 全部正常结束返回 True
+    """
+
+    start_time = time.time()
+    if dedupe_config and worker_count > 1:
+        ColorFormatter.warning('--dedupe 导入多个文件的时候只使用一个进程, 这样不同文件之间的重复数据也可以去掉')
+        debug_logger.warning('--dedupe with multiple files uses one worker process')
+        worker_count = 1
+    ColorFormatter.info('一共 {} 个文件, 使用 {} 个进程导入'.format(len(file_list), min(worker_count, len(file_list))))
+    debug_logger.info('一共 {} 个文件, 使用 {} 个进程导入'.format(len(file_list), min(worker_count, len(file_list))))
+
+    if not dedupe_config:
+        # 子进程总是从 checkpoint 继续, 不是 --resume 的时候先清除上一次的 checkpoint
+        for file_path in [_ for _ in file_list if not is_stream_source(_)]:
+            checkpoint = Checkpoint(file_path, table_name)
+            record = checkpoint.load_chunk(0) if resume else None
+            if not record or record['end'] != os.path.getsize(file_path):
+                # 没有可以继续的 checkpoint, 或者上一次是用 -f 分段导入的, 不能接着用
+                checkpoint.clear()
+            elif not record['done']:
+                ColorFormatter.info('从 checkpoint 继续导入文件 "{}", 已经提交了 "{}" 条数据'.format(
+                    file_path, record['committed_rows']))
+                debug_logger.info('resume file "{}" from checkpoint {}, {} rows committed'.format(
+                    file_path, checkpoint.manifest_path, record['committed_rows']))
+
+    shared_progress = SharedProgress(worker_count=len(file_list))
+    # 去重的时候已经见过的 key 只在子进程的内存里, 压缩文件不能 seek, 子进程异常退出之后这些文件不能从中间继续,
+    # 从头再导入一次会插入重复的数据, 所以不重试
+    no_retry = set([i for i, file_path in enumerate(file_list) if dedupe_config or is_stream_source(file_path)])
+    scheduler = ChunkScheduler(
+        worker_target=file_worker,
+        worker_args=(file_type, table_name, columns, separator, database_config, logger, debug_logger, error_logger,
+                     skip_error, shared_progress, dedupe_config),
+        worker_count=worker_count, debug_logger=debug_logger, error_logger=error_logger,
+        stall_timeout=stall_timeout, heartbeat=lambda task_id: shared_progress.update_time[task_id])
+
+    # 进度条 对象, 按所有文件已经处理的字节数显示进度
+    total_size = sum([os.path.getsize(_) for _ in file_list])
+    progress_bar = ProgressBar(total_line=max(1, total_size), description='正在插入数据(字节): ')
+
+    def show_progress():
+        all_progress = shared_progress.total_bytes()
+        if all_progress < total_size:
+            # 打印进度条
+            progress_bar.handle_multiprocessing_progress(current_progress=all_progress)
+
+    done_files, failed_files = scheduler.run(list(enumerate(file_list)), on_tick=show_progress, no_retry=no_retry)
+    progress_bar.handle_multiprocessing_progress(current_progress=max(1, total_size))
+
+    end_time = time.time()
+    print(colored('总共用时: {:.2f}秒'.format(end_time - start_time), 'white'))
+
+    # 每个文件的速度
+    for i in sorted(done_files):
+        debug_logger.info('文件 "%s" 处理 %s 行, 成功 %s 条, 失败 %s 条, 速度 %.2f 条/秒',
+                          file_list[i], shared_progress.lines[i], shared_progress.success[i],
+                          shared_progress.failed[i], shared_progress.throughput(i))
+
+    if failed_files:
+        ColorFormatter.fatal('有 {} 个文件导入失败'.format(len(failed_files)))
+        for i in sorted(failed_files):
+            ColorFormatter.error('导入失败的文件: "{}"'.format(file_list[i]))
+            error_logger.error('import file "{}" failed'.format(file_list[i]))
+    else:
+        ColorFormatter.success('插入数据完成')
+        debug_logger.info('insert data to database done')
+
+    # 显示汇总信息
+    ColorFormatter.info('总共导入 "{}" 个文件, 插入 "{}" 条数据, 成功 "{}" 条, 失败 "{}" 条'.format(
+        len(done_files),
+        shared_progress.total_success() + shared_progress.total_failed(),
+        shared_progress.total_success(),
+        shared_progress.total_failed()
+    ))
+    debug_logger.info('总共导入 "{}" 个文件, 插入 "{}" 条数据, 成功 "{}" 条, 失败 "{}" 条'.format(
+        len(done_files),
+        shared_progress.total_success() + shared_progress.total_failed(),
+        shared_progress.total_success(),
+        shared_progress.total_failed()
+    ))
+    if dedupe_config:
+        show_duplicates(shared_progress.total_duplicates(), debug_logger)
+    return not failed_files
+
+
+def show_profile(stats_file, profile, debug_logger):
+    """
+    --profile 的时候合并所有进程的阶段用时, 写进 {profile dir}/profile.json, 并按用时从多到少显示每个阶段.
+    多进程的用时是所有进程相加的, 包括等待数据库的时间, 所以会比总共用时多
+
+    :param stats_file: 所有进程写统计信息的 --stats-file
+    :param profile: --profile 的配置, 包括 dir 和 cprofile
+    :param debug_logger: debug logger
+    :return: 报告字典
+    """
+
+    report = merge_profile(stats_file)
+    report['phases'] = merge_stats(stats_file)['phases']
+    report_path = os.path.join(profile['dir'], 'profile.json')
+    os.makedirs(profile['dir'], exist_ok=True)
+    with open(report_path, 'w', encoding='utf8') as w:
+        json.dump(report, w, indent=2)
+
+    stages = report['stages']
+    ColorFormatter.info('{} 个进程各阶段的用时, 最慢的是 "{}":'.format(len(report['processes']), report['bottleneck']))
+    for name in sorted(stages, key=lambda _: stages[_]['seconds'], reverse=True):
+        stage = stages[name]
+        ColorFormatter.info('    {:<8} {:>10.3f}秒 {:>6.2f}%  {} 次, 平均 {:.1f} 微秒, p50 < {} 微秒, p99 < {} 微秒'.format(
+            name, stage['seconds'], stage['percent'], stage['calls'], stage['mean_us'], stage['p50_us'],
+            stage['p99_us']))
+    ColorFormatter.info('profile 报告已经写进 "{}"'.format(report_path))
+    debug_logger.info('profile report is written to {}: {}'.format(report_path, dict(
+        [(name, stage['seconds']) for name, stage in stages.items()])))
+    return report
+
+
+def finish_load(database_obj, table_name, index_config, debug_logger, error_logger):
+    """
+    导入完成之后恢复批量导入的会话设置, 再用一条 ALTER TABLE 建立主键和索引, 并显示在汇总信息中
+
+    :param database_obj: 主进程的 Database 对象, 也就是创建表的那个
+    :param table_name: table name
+    :param index_config: 主键和索引的配置, 包括 primary_key 和 indexes, None 为不建索引
+    :param debug_logger: debug logger
+    :param error_logger: error logger
+    :return: 成功返回 True
+    """
+
+    # 主进程的计数和用时, 子进程的在它们 close() 的时候已经写进 --stats-file 了
+    database_obj.save_stats()
+    if database_obj.profile:
+        show_profile(database_obj.stats_file, database_obj.profile, debug_logger)
+
+    if database_obj.session_saved or database_obj.session_skipped:
+        skipped = list(database_obj.session_skipped)
+        restored = database_obj.restore_session()
+        ColorFormatter.info('批量导入会话设置: 已关闭并恢复 {}{}'.format(
+            ', '.join(restored) or '无', ', 没有权限跳过 {}'.format(', '.join(skipped)) if skipped else ''))
+        debug_logger.info('bulk session restored: {}, skipped: {}'.format(restored, skipped))
+
+    reject_path = database_obj.reject_file.path
+    if os.path.exists(reject_path) and os.path.getsize(reject_path):
+        ColorFormatter.info('插入失败的数据已经写进 "{}", 修改之后可以用 --replay-rejects 重新导入'.format(reject_path))
+        debug_logger.info('rejected rows are written to {}'.format(reject_path))
+
+    if not index_config:
+        return True
+
+    def columns_exist(index_columns):
+        # 不存在的列不建索引
+        unknown_columns = [_ for _ in index_columns if _ not in database_obj.table_columns]
+        if unknown_columns:
+            ColorFormatter.warning('列 "{}" 不存在, 跳过索引 ({})'.format(', '.join(unknown_columns),
+                                                                     ', '.join(index_columns)))
+            debug_logger.warning('columns {} do not exist, skip index {}'.format(unknown_columns, index_columns))
+            return False
+        return True
+
+    primary_key = index_config['primary_key'] if columns_exist(index_config['primary_key']) else []
+    indexes = [_ for _ in index_config['indexes'] if _ and columns_exist(_)]
+
+    ColorFormatter.info('开始为表 {} 建立索引'.format(table_name))
+    start_time = time.time()
+    result = database_obj.add_indexes(table_name, primary_key=primary_key, indexes=indexes)
+    if result is True:
+        ColorFormatter.success('建立索引完成, 主键: {}, 索引: {}, 用时: {:.2f}秒'.format(
+            ', '.join(primary_key) or '无', '; '.join([', '.join(_) for _ in indexes]) or '无',
+            time.time() - start_time))
+        debug_logger.info('add indexes to table {} done, primary key: {}, indexes: {}'.format(
+            table_name, primary_key, indexes))
+        return True
+
+    ColorFormatter.error('建立索引失败, 数据已经导入, 可以手动建立索引: {}'.format(result))
+    error_logger.error('add indexes to table {} failed: {}'.format(table_name, result))
+    return False
+
+
+def import_stream(source_path, file_type, table_name, column_list, separator, database_obj, writer_config,
+                  debug_logger, error_logger, skip_error=False, schema_config=None, dedupe_config=None):
+    """
+    从标准输入, 命名管道或者压缩文件中边读边导入, 这些输入不能 seek, 所以只能在一个进程中从头到尾顺序处理,
+    可以配合 --writer-threads 使用. csv 文件的列名从输入的第一行读取
+
+    :param source_path: - 或者文件路径
+    :param file_type: 'csv' 或者 'txt'
+    :param table_name: table name
+    :param column_list: txt 文件的列名列表, csv 文件为 None
+    :param separator: txt 文件的分隔符
+    :param database_obj: Database 对象
+    :param writer_config: 创建 ThreadWriter 对象的参数字典, None 为不使用写入线程
+    :param schema_config: 推断列类型的配置, 见 resolve_column_types, 样本是输入开头的数据
+    :param dedupe_config: 创建 Deduper 对象的参数字典, None 为不去重
+    :return: 全部正常结束返回 True
+    """
+
+    start_time = time.time()
+    try:
+        source = StreamSource(source_path)
+    except OSError as e:
+        ColorFormatter.error('打开 "{}" 时出错, 出错信息为: {}'.format(source_path, e))
+        debug_logger.error('打开 "{}" 时出错, 出错信息为: {}'.format(source_path, e))
+        error_logger.error('打开 "{}" 时出错, 出错信息为: {}'.format(source_path, e))
+        return False
+    ColorFormatter.info('开始流式读取 "{}"'.format(source_path))
+    debug_logger.info('开始流式读取 "{}"'.format(source_path))
+
+    # 当前读到第几行
+    current = [0]
+
+    def iter_text():
+        for consumed, one_line in source.iter_lines():
+            current[0] += 1
+            yield one_line
+
+    if file_type == 'csv':
+        reader = csv.reader(iter_text(), delimiter=',', quoting=csv.QUOTE_NONE)
+        # 第一个不为空的行是列名
+        column_list = next((_ for _ in reader if _), [])
+
+        def iter_rows():
+            for all_cols in reader:
+                # 跳过空行
+                if all_cols:
+                    yield current[0], source.consumed, clean_file_string(all_cols)
+    else:
+        def iter_rows():
+            for one_line in iter_text():
+                yield current[0], source.consumed, clean_txt_line(one_line, separator, len(column_list))
+
+    # 输入只能读一次, 样本读出来之后放回数据的最前面
+    rows = iter_rows()
+    sample = take_sample(rows, schema_config)
+    rows = itertools.chain(sample, rows)
+    column_types = resolve_column_types(column_list, sample, schema_config, debug_logger,
+                                        database_config=writer_config['database_config'] if writer_config else None)
+    if not create_csv_table(database_obj, table_name, column_list, debug_logger, error_logger,
+                            column_types=column_types):
+        source.close()
+        return False
+
+    if not check_dedupe_columns(column_list, dedupe_config, debug_logger, error_logger):
+        source.close()
+        return False
+    deduper = Deduper(column_list, **dedupe_config) if dedupe_config else None
+    if deduper:
+        rows = deduper.filter(rows)
+
+    # 进度条 对象, 按已经读取的压缩字节数显示, 标准输入和管道不知道总大小, 只显示已经读取的字节数
+    if source.total_size:
+        progress_bar = ProgressBar(total_line=source.total_size, description='正在插入数据(读取字节): ')
+    else:
+        progress_bar = ProgressBar(total_line=1, description='正在插入数据, 已经读取字节: ')
+
+    def show_progress(consumed):
+        if not source.total_size:
+            progress_bar.handle_stream_progress(consumed)
+        elif consumed < source.total_size:
+            progress_bar.handle_multiprocessing_progress(current_progress=consumed)
+
+    failed = False
+    if writer_config:
+        writer = ThreadWriter(debug_logger=debug_logger, error_logger=error_logger, **writer_config)
+        failed = bool(writer.run(rows, table_name, column_list, on_progress=show_progress, source_file=source_path))
+        success_count, failed_count = writer.total_success(), writer.total_failed()
+    else:
+        column_str = ", ".join(column_list)
+        database_obj.source_file = source_path
+        count = 0
+        for line_number, consumed, data_list in rows:
+            database_obj.insert_data(table_name=table_name, column_list=column_str, data_list=data_list,
+                                     skip_error=skip_error, line_number=line_number)
+            count += 1
+            if count % 1000 == 0:
+                show_progress(consumed)
+        # 事务提交, 插入数据
+        debug_logger.debug('execute insert sql commit')
+        database_obj.execute_commit()
+        success_count, failed_count = database_obj.insert_success_count, database_obj.insert_failed_count
+    source.close()
+
+    if source.total_size:
+        progress_bar.handle_multiprocessing_progress(current_progress=source.total_size)
+    else:
+        progress_bar.handle_stream_progress(source.consumed)
+        print('')
+
+    end_time = time.time()
+    print(colored('总共用时: {:.2f}秒'.format(end_time - start_time), 'white'))
+
+    if failed:
+        ColorFormatter.fatal('有写入线程异常退出')
+    else:
+        ColorFormatter.success('插入数据完成')
+        debug_logger.info('insert data to database done')
+
+    # 显示汇总信息
+    ColorFormatter.info('总共读取 "{}" 行, 插入 "{}" 条数据, 成功 "{}" 条, 失败 "{}" 条'.format(
+        current[0], success_count + failed_count, success_count, failed_count))
+    debug_logger.info('总共读取 "{}" 行, 插入 "{}" 条数据, 成功 "{}" 条, 失败 "{}" 条'.format(
+        current[0], success_count + failed_count, success_count, failed_count))
+    if deduper:
+        show_duplicates(deduper.duplicate_count, debug_logger)
+        deduper.close()
+    return not failed
+
+
+
+def replay_rejects(reject_path, database_obj, debug_logger, error_logger, table_name=None, skip_error=False):
+    """
+    把 reject 文件中的数据重新批量插入数据库, 再次失败的数据写进新的 reject 文件
+
+    :param reject_path: reject 文件路径
+    :param database_obj: Database 对象
+    :param debug_logger: debug logger
+    :param error_logger: error logger
+    :param table_name: 插入到这个表, None 为 reject 文件中记录的表
+    :param skip_error: skip unimportant insert error information, default False
+    :return: 正常结束返回 True
+    """
+
+    if not os.path.isfile(reject_path):
+        ColorFormatter.fatal('File "{}" not exists'.format(reject_path))
+        debug_logger.error('File "{}" not exists'.format(reject_path))
+        return False
+
+    # 不能一边读一边写同一个文件
+    retry_path = database_obj.reject_file.path
+    if os.path.abspath(retry_path) == os.path.abspath(reject_path):
+        retry_path = '{}.replay.jsonl'.format(os.path.splitext(reject_path)[0])
+    if os.path.exists(retry_path):
+        os.remove(retry_path)
+    database_obj.reject_file.close()
+    database_obj.reject_file = RejectFile(retry_path)
+
+    start_time = time.time()
+    ColorFormatter.info('开始重新导入 "{}" 中的数据'.format(reject_path))
+    debug_logger.info('replay rejected rows from {}'.format(reject_path))
+
+    bad_records = 0
+    for index, record in iter_rejects(reject_path):
+        if record is None:
+            bad_records += 1
+            debug_logger.warning('skip invalid record at line {} of {}'.format(index, reject_path))
+            error_logger.error('skip invalid record at line {} of {}'.format(index, reject_path))
+            continue
+        database_obj.source_file = record.get('source')
+        database_obj.insert_data(table_name=table_name or record['table'], column_list=', '.join(record['columns']),
+                                 data_list=record['fields'], skip_error=skip_error, line_number=record.get('line'))
+
+    # 事务提交, 插入数据
+    debug_logger.debug('execute insert sql commit')
+    database_obj.execute_commit()
+    database_obj.reject_file.close()
+
+    end_time = time.time()
+    print(colored('总共用时: {:.2f}秒'.format(end_time - start_time), 'white'))
+
+    # 显示汇总信息
+    ColorFormatter.info('总共重新插入 "{}" 条数据, 成功 "{}" 条, 失败 "{}" 条, 无法解析 "{}" 行'.format(
+        database_obj.insert_total_count, database_obj.insert_success_count, database_obj.insert_failed_count,
+        bad_records))
+    debug_logger.info('总共重新插入 "{}" 条数据, 成功 "{}" 条, 失败 "{}" 条, 无法解析 "{}" 行'.format(
+        database_obj.insert_total_count, database_obj.insert_success_count, database_obj.insert_failed_count,
+        bad_records))
+    if database_obj.insert_failed_count:
+        ColorFormatter.warning('再次插入失败的数据写进了 "{}"'.format(retry_path))
+    return True
+
 
 def main():
     banner()
@@ -285,14 +1413,146 @@ def main():
     # error.log 只包含错误信息
     error_logger = logger.get_logger(logger_name='error_logger')
 
+    # --profile 的配置, 没有指定 --stats-file 的话每个进程的记录写在 profile 目录里面
+    profile_config = None
+    if opts.profile:
+        profile_config = {
+            'dir': opts.profile_dir or os.path.join(LOG_PATH, 'profile'),
+            'cprofile': opts.cprofile,
+        }
+        if not opts.stats_file:
+            opts.stats_file = os.path.join(profile_config['dir'], 'stats.jsonl')
+
+    # --vectorize 需要 numpy, -t 的分隔符只能是一个字符 (-F '\\t' 是 \t), 不满足的时候还是一行一行清洗
+    vectorize_separator = '\t' if opts.separator == '\\t' else opts.separator
+    if opts.vectorize and not vectorize_supported(vectorize_separator if opts.txt_to_database else None):
+        ColorFormatter.warning('--vectorize 需要安装 numpy, 并且 -F 只能是一个字符 (不能是 \\r 或者 \\n), '
+                               '忽略这个选项, 一行一行清洗数据')
+        debug_logger.warning('--vectorize needs numpy and a one character -F, clean the rows one by one')
+        opts.vectorize = False
+
+    # 数据库配置, 多进程的时候每个进程用这个配置创建自己的 Database 对象和连接
+    database_config = {
+        'backend': opts.backend,
+        'host': opts.host,
+        'port': opts.port,
+        'database': opts.database_name,
+        'batch_size': opts.batch_size,
+        'max_packet_size': opts.max_packet_size,
+        'engine': opts.engine,
+        'load_chunk_size': opts.load_chunk_size,
+        'connect_timeout': opts.connect_timeout,
+        'health_check': opts.health_check,
+        'commit_every': opts.commit_every,
+        'commit_interval': opts.commit_interval,
+        'bulk_session': opts.bulk_session,
+        # 插入失败的行只写进 reject 文件
+        'reject_file': opts.reject_file or REJECT_FILE,
+        # 每个进程的阶段用时, benchmarks/ 用来比较不同版本
+        'stats_file': opts.stats_file,
+        'profile': profile_config,
+        # 按批清洗数据, 见 lib/clean.py
+        'vectorize': opts.vectorize,
+    }
+
+    # 导入完成之后建立的主键和索引
+    index_config = None
+    if opts.primary_key or opts.indexes:
+        index_config = {
+            'primary_key': [_.strip() for _ in (opts.primary_key or '').split(',') if _.strip()],
+            'indexes': [[_.strip() for _ in index.split(',') if _.strip()] for index in opts.indexes or []],
+        }
+
+    # 去重的配置, --dedupe 后面没有列名的话用整行去重
+    dedupe_config = None
+    if opts.dedupe is not None:
+        dedupe_config = {
+            'key_columns': [_.strip() for _ in opts.dedupe.split(',') if _.strip()],
+            'memory_limit': max(1, opts.dedupe_memory) * 1024 * 1024,
+            'spill_dir': opts.spill_dir,
+        }
+        if opts.resume:
+            ColorFormatter.warning('--dedupe 不支持 --resume, 忽略这个选项')
+            debug_logger.warning('--resume is not supported with --dedupe')
+            opts.resume = False
+
+    # 流水线模式的配置, 解析进程和写入进程的个数, 以及它们之间的队列最多可以有多少批数据.
+    # -f 去重的时候也用流水线, 解析进程按 key 的 digest 把每一行分给固定的写入进程
+    pipeline_config = None
+    if opts.pipeline:
+        pipeline_config = {
+            'parser_count': opts.parsers,
+            'writer_count': opts.writers,
+        }
+    elif opts.fast and dedupe_config and not opts.writer_threads:
+        pipeline_config = {
+            'parser_count': opts.workers or 1,
+            'writer_count': opts.workers or 1,
+        }
+    if pipeline_config:
+        pipeline_config.update({
+            'queue_size': opts.queue_size,
+            'batch_size': opts.batch_size,
+            'database_config': database_config,
+            'logger': logger,
+            'skip_error': opts.skip_error,
+            'dedupe_config': dedupe_config,
+        })
+
+    # 推断列类型的配置, 不指定 --infer-schema 和 --column-type 的话所有列都是 varchar(300)
+    schema_config = None
+    if opts.infer_schema or opts.column_types:
+        try:
+            schema_config = {
+                'infer': opts.infer_schema,
+                'sample_rows': max(1, opts.sample_rows),
+                'sample_bytes': max(1, opts.sample_bytes),
+                'margin': max(1.0, opts.type_margin),
+                'overrides': parse_column_types(opts.column_types),
+            }
+        except ValueError as e:
+            ColorFormatter.fatal(str(e))
+            debug_logger.error(str(e))
+            error_logger.error(str(e))
+            sys.exit(1)
+
+    # 数据库 backend, 没有安装对应的驱动的话直接退出
+    try:
+        backend = get_backend(opts.backend)
+    except ImportError as e:
+        ColorFormatter.fatal('{} backend needs a database driver: {}, please install it first, for example: '
+                             'pip install {}'.format(opts.backend, e, BACKEND_DRIVERS.get(opts.backend, '')))
+        debug_logger.error('Import {} backend error: {}'.format(opts.backend, e))
+        error_logger.error('Import {} backend error: {}'.format(opts.backend, e))
+        sys.exit(1)
+
     # 初始化数据库
     try:
-        database = Database(host='127.0.0.1', database=opts.database_name, logger=logger)
-    except pymysql.err.InternalError as e:
-        ColorFormatter.error('Init database InternalError: {}'.format(e))
-        debug_logger.error('Init database InternalError: {}'.format(e))
-        error_logger.error('Init database InternalError: {}'.format(e))
-        if 'Unknown database' in str(e):
+        # 每个写入线程都要从连接池借一个连接, 主线程自己还占用一个
+        pool_size = max(opts.pool_size, opts.writer_threads + 1) if opts.writer_threads else opts.pool_size
+        pool = ConnectionPool(host=database_config['host'], database=database_config['database'],
+                              pool_size=pool_size, connect_timeout=opts.connect_timeout,
+                              health_check=opts.health_check, local_infile=(opts.engine == 'load-data'),
+                              backend=backend, port=database_config['port'])
+        database = Database(logger=logger, pool=pool, **database_config)
+
+        # 写入线程池模式的配置
+        writer_config = None
+        if opts.writer_threads and not pipeline_config:
+            writer_config = {
+                'thread_count': opts.writer_threads,
+                'queue_size': opts.queue_size,
+                'batch_size': opts.batch_size,
+                'database_config': database_config,
+                'logger': logger,
+                'pool': pool,
+                'skip_error': opts.skip_error,
+            }
+    except backend.Error as e:
+        ColorFormatter.error('Init database {}: {}'.format(type(e).__name__, e))
+        debug_logger.error('Init database {}: {}'.format(type(e).__name__, e))
+        error_logger.error('Init database {}: {}'.format(type(e).__name__, e))
+        if 'Unknown database' in str(e) or 'does not exist' in str(e):
             ColorFormatter.fatal('Please open the lib/settings.py file and move to database section content, modify '
                                  'DATABASE parameter and try again, for example see below: ')
             error_string = """
@@ -341,236 +1601,198 @@ def main():
                 # 执行完 drop table 就正常退出程序
                 sys.exit(0)
 
-            if opts.csv_to_database:
-                csv_file_path = opts.csv_to_database
+            if opts.replay_rejects:
+                if not replay_rejects(opts.replay_rejects, database, debug_logger, error_logger,
+                                      table_name=opts.table_name, skip_error=opts.skip_error):
+                    sys.exit(1)
+                # 安全退出
+                sys.exit(0)
+
+            if (opts.csv_to_database or opts.txt_to_database) and not opts.resume:
+                # 新的一次导入, 清空上一次的 reject 文件和统计文件
+                for path in (database_config['reject_file'], database_config['stats_file']):
+                    if path and os.path.exists(path):
+                        os.remove(path)
+                if profile_config and os.path.isdir(profile_config['dir']):
+                    # 上一次的 profile 报告和 cProfile 文件
+                    for name in os.listdir(profile_config['dir']):
+                        if name == 'profile.json' or name.endswith('.prof'):
+                            os.remove(os.path.join(profile_config['dir'], name))
 
-                if not os.path.isfile(csv_file_path):
+            if opts.csv_to_database:
+                # 可以是一个文件, 一个目录或者一个 glob 表达式, 标准输入和命名管道不展开
+                if is_stream_source(opts.csv_to_database):
+                    csv_file_list = [opts.csv_to_database]
+                else:
+                    csv_file_list = expand_input_files(opts.csv_to_database, suffix='.csv')
+
+                if len(csv_file_list) == 1 and is_stream_source(csv_file_list[0]):
+                    # 标准输入, 命名管道或者压缩文件, 只能顺序读取
+                    if opts.fast or opts.pipeline or opts.resume:
+                        ColorFormatter.warning('流式读取的时候不支持 -f, --pipeline 和 --resume, 忽略这些选项')
+                        debug_logger.warning('-f, --pipeline and --resume are not supported for streaming input')
+                    if not import_stream(csv_file_list[0], 'csv', TABLE_NAME, None, None, database, writer_config,
+                                         debug_logger, error_logger, skip_error=opts.skip_error,
+                                         schema_config=schema_config, dedupe_config=dedupe_config):
+                        sys.exit(1)
+                    if not finish_load(database, TABLE_NAME, index_config, debug_logger, error_logger):
+                        sys.exit(1)
+                    # 安全退出
+                    sys.exit(0)
+
+                if not csv_file_list:
                     # 不存在 csv 文件
-                    debug_logger.warning('File "{}" not exists'.format(csv_file_path))
-                    ColorFormatter.fatal('File "{}" not exists'.format(csv_file_path))
+                    debug_logger.warning('File "{}" not exists'.format(opts.csv_to_database))
+                    ColorFormatter.fatal('File "{}" not exists'.format(opts.csv_to_database))
                     time.sleep(1)
                     ColorFormatter.fatal('Program exit')
                     debug_logger.warning('Program exist')
                     sys.exit(1)
 
-                else:
-                    if opts.fast:
-                        start_time = time.time()
-
-                        # 使用多核前, 将大文件进行分割, 分割成 4 份, 再加上不足的那一份
-                        ColorFormatter.info('启用多进程导入数据库')
-                        ColorFormatter.info('开始分割原数据文件')
-
-                        # 这里需要再分割前 删除 split 目录下的所有文件
-                        cmd = 'rm -rf split && mkdir split'
-                        debug_logger.debug('开始运行 {} 命令'.format(cmd))
-                        p = subprocess.Popen(cmd, stderr=subprocess.PIPE, stdout=subprocess.PIPE, shell=True)
-                        (stdout, stderr) = p.communicate()
-                        return_code = p.returncode
-                        if return_code != 0 or stderr:
-                            ColorFormatter.error('删除split文件时出错, 出错信息为: {}'.format(stderr.strip()))
-                            debug_logger.error('删除split文件时出错, 出错信息为: {}'.format(stderr.strip()))
-                            error_logger.error('删除split文件时出错, 出错信息为: {}'.format(stderr.strip()))
-                            # 异常退出
-                            sys.exit(1)
-                        else:
-                            ColorFormatter.success('初始化split文件夹成功')
-                            debug_logger.debug('初始化split文件夹成功, 返回码: {}, 输出为: {}'.format(
-                                return_code, stdout))
-                            debug_logger.info('初始化split文件夹成功')
-
-                        # 开始分割
-                        split_result = split_file(csv_file_path, log_level)
-                        if split_result:
-                            ColorFormatter.success('原数据文件分割完成')
-                            debug_logger.info('原数据文件分割完成')
-                        else:
-                            ColorFormatter.error('原数据文件分割失败')
-                            ColorFormatter.fatal('异常, 退出程序')
-                            debug_logger.error('原数据文件分割失败')
-                            error_logger.error('原数据文件分割失败')
-                            sys.exit(1)
-                        # 分割完成
-
-                        # 多进程, 使用多核一起干
-                        table_name = TABLE_NAME
-                        process_list = []
-
-                        for i in range(1, os.cpu_count()+1):
-                            process = Process(target=handle_data_to_database,
-                                              args=(i, database, table_name, debug_logger, error_logger, opts.skip_error, ))
-                            process_list.append(process)
-                            process.start()
-
-                        # 计算 csv 文件的总行
-                        cmd = "wc -l split/split_file_* | grep total | awk '{print $1}'"
-                        debug_logger.debug('开始运行 {} 命令'.format(cmd))
-                        p = subprocess.Popen(cmd, stderr=subprocess.PIPE, stdout=subprocess.PIPE, shell=True)
-                        (stdout, stderr) = p.communicate()
-                        try:
-                            total_lines = int(stdout.strip())
-                        except:
-                            total_lines = 0
-                        return_code = p.returncode
-                        if return_code != 0 or stderr:
-                            ColorFormatter.error('计算文件 "{}" 总行数 时出错, 出错信息为: {}'.format(csv_file_path, stderr.strip()))
-                            debug_logger.error('计算文件 "{}" 总行数 时出错, 出错信息为: {}'.format(csv_file_path, stderr.strip()))
-                            error_logger.error('计算文件 "{}" 总行数 时出错, 出错信息为: {}'.format(csv_file_path, stderr.strip()))
-                            ColorFormatter.fatal('Please contact author or look through logs/error.log file to examine error place')
-                            # 异常退出
-                            sys.exit(1)
+                elif len(csv_file_list) > 1:
+                    # 一次导入多个文件, 用最大的文件的列名创建一次数据库表, 列名不一样的文件跳过
+                    table_name = TABLE_NAME
+                    columns = read_csv_header(csv_file_list[0])
+                    if not check_dedupe_columns(columns, dedupe_config, debug_logger, error_logger):
+                        sys.exit(1)
+                    sample = sample_file(csv_file_list[0], 'csv', None, columns, schema_config)
+                    column_types = resolve_column_types(columns, sample, schema_config, debug_logger,
+                                                        database_config=database_config)
+                    if not create_csv_table(database, table_name, columns, debug_logger, error_logger,
+                                            column_types=column_types):
+                        sys.exit(1)
+                    import_file_list = []
+                    for file_path in csv_file_list:
+                        if read_csv_header(file_path) == columns:
+                            import_file_list.append(file_path)
                         else:
-                            ColorFormatter.info('计算文件 "{}" 总行数结束, 一共 {} 行'.format(csv_file_path, str(total_lines)))
-                            debug_logger.debug('计算文件 "{}" 总行数命令结果, 返回码: {}, 输出为: {}'.format(
-                                csv_file_path, return_code, str(total_lines)))
-                            debug_logger.info('计算需要分割文件 "{}" 行数结束, 一共 {} 行'.format(csv_file_path, str(total_lines)))
-
-                        # 进度条 对象
-                        progress_bar = ProgressBar(total_line=total_lines, description='正在插入数据: ')
-                        while True:
-                            # 每 2 秒读一次总数文件
-                            time.sleep(2)
-                            all_progress = 0
-                            for suffix_name in range(1, os.cpu_count()+1):
-                                record_line_file = os.path.join(SPLIT_PATH, 'record_line_{}.txt'.format(str(suffix_name)))
-                                try:
-                                    with open(record_line_file, 'r') as r:
-                                        per_line = r.readline()
-                                    all_progress += int(per_line)
-                                except:
-                                    # 有可能开始还没有读到文件
-                                    pass
-
-                            # 打印进度条
-                            progress_bar.handle_multiprocessing_progress(current_progress=all_progress)
-
-                            if all_progress >= total_lines:
-                                # 有可能这个判断不准确, 然后卡在这里
-                                break
-
-                        for _ in process_list:
-                            _.join()
+                            ColorFormatter.warning('文件 "{}" 的列名和表 "{}" 不一样, 跳过这个文件'.format(
+                                file_path, table_name))
+                            debug_logger.warning('columns of file "{}" do not match table "{}", skip it'.format(
+                                file_path, table_name))
+                            error_logger.error('columns of file "{}" do not match table "{}", skip it'.format(
+                                file_path, table_name))
+                    if not import_files(import_file_list, 'csv', table_name, columns, None, max(1, opts.workers or 1),
+                                        database_config, logger, debug_logger, error_logger,
+                                        skip_error=opts.skip_error, resume=opts.resume, dedupe_config=dedupe_config,
+                                        stall_timeout=opts.stall_timeout):
+                        sys.exit(1)
 
-                        end_time = time.time()
-                        print(colored('总共用时: {}'.format(end_time - start_time), 'white'))
-
-                        # 清除 split 文件夹
-                        cmd = "rm -rf split"
-                        debug_logger.debug('开始运行 {} 命令'.format(cmd))
-                        p = subprocess.Popen(cmd, stderr=subprocess.PIPE, stdout=subprocess.PIPE, shell=True)
-                        (stdout, stderr) = p.communicate()
-                        return_code = p.returncode
-                        if return_code != 0 or stderr:
-                            ColorFormatter.error('清除 split 文件夹时出错, 出错信息为: {}'.format(csv_file_path, stderr.strip()))
-                            debug_logger.error('清除 split 文件夹时出错, 出错信息为: {}'.format(csv_file_path, stderr.strip()))
-                            error_logger.error('清除 split 文件夹时出错, 出错信息为: {}'.format(csv_file_path, stderr.strip()))
-                            ColorFormatter.fatal('Please contact author or look through logs/error.log file to examine error place')
-                            # 异常退出
+                else:
+                    csv_file_path = csv_file_list[0]
+                    # 列名和数据库表只在父进程中准备一次, 然后才开始插入数据
+                    table_name = TABLE_NAME
+                    columns = read_csv_header(csv_file_path)
+                    if not check_dedupe_columns(columns, dedupe_config, debug_logger, error_logger):
+                        sys.exit(1)
+                    sample = sample_file(csv_file_path, 'csv', None, columns, schema_config)
+                    column_types = resolve_column_types(columns, sample, schema_config, debug_logger,
+                                                        database_config=database_config)
+                    if not create_csv_table(database, table_name, columns, debug_logger, error_logger,
+                                            column_types=column_types):
+                        sys.exit(1)
+
+                    if pipeline_config:
+                        # 流水线模式, 解析和写入由不同的进程完成
+                        if opts.resume:
+                            ColorFormatter.warning('流水线模式不支持 --resume, 忽略这个选项')
+                            debug_logger.warning('--resume is not supported with --pipeline')
+                        if not run_pipeline(csv_file_path, table_name, columns, iter_csv_rows,
+                                            (database.vectorize, ), pipeline_config, log_level, debug_logger,
+                                            error_logger):
                             sys.exit(1)
-                        else:
-                            ColorFormatter.info('清除 split 文件夹成功')
-                            debug_logger.debug('清除 split 文件夹成功')
 
-                        ColorFormatter.success('插入数据完成')
-                        debug_logger.info('insert data to database done')
+                    elif writer_config:
+                        # 单进程解析, 写入线程池插入数据
+                        if opts.resume:
+                            ColorFormatter.warning('写入线程池模式不支持 --resume, 忽略这个选项')
+                            debug_logger.warning('--resume is not supported with --writer-threads')
+                        if not run_thread_writer(csv_file_path, table_name, columns, iter_csv_rows,
+                                                 (database.vectorize, ), writer_config, debug_logger, error_logger,
+                                                 dedupe_config=dedupe_config):
+                            sys.exit(1)
 
-                        # 显示汇总信息
-                        # 多进程无法显示 失败 和 成功 的条数, 暂时丢着吧
+                    elif opts.fast:
+                        if not import_file_fast(csv_file_path, 'csv', table_name, columns, None, opts.workers,
+                                                opts.chunk_size, opts.resume, database_config, logger, log_level,
+                                                debug_logger, error_logger, skip_error=opts.skip_error,
+                                                stall_timeout=opts.stall_timeout):
+                            sys.exit(1)
 
                     else:
                         # 单进程, 速度很慢
                         start_time = time.time()
-                        table_name = TABLE_NAME
-
-                        with open(csv_file_path, 'r') as r:
-                            # 这里是用, 分隔的 csv文件
-                            line = csv.reader(r, delimiter=',', quoting=csv.QUOTE_NONE)
-                            csv_file_path = '\ '.join(csv_file_path.split())
-                            columns_str = ''
-
-                            ColorFormatter.info('开始计算csv文件 {} 的行数'.format(csv_file_path))
-                            debug_logger.info('开始计算csv文件 {} 的行数'.format(csv_file_path))
-                            # 计算 csv 文件的行
-                            cmd = "wc -l %s | awk '{print $1}'" % csv_file_path
-                            debug_logger.debug('开始运行 {} 命令'.format(cmd))
-                            p = subprocess.Popen(cmd, stderr=subprocess.PIPE, stdout=subprocess.PIPE, shell=True)
-                            (stdout, stderr) = p.communicate()
-                            return_code = p.returncode
-                            if return_code != 0 or stderr:
-                                ColorFormatter.error('计算csv文件 "{}" 行数时出错, 出错信息为: {}'.format(csv_file_path, stderr.strip()))
-                                debug_logger.error('计算csv文件 "{}" 行数时出错, 出错信息为: {}'.format(csv_file_path, stderr.strip()))
-                                error_logger.error('计算csv文件 "{}" 行数时出错, 出错信息为: {}'.format(csv_file_path, stderr.strip()))
-                                # 异常退出
-                                sys.exit(1)
-                            else:
-                                ColorFormatter.info('计算 "{}" 文件行数结束, 一共 "{}" 行'.format(csv_file_path, stdout.strip()))
-                                debug_logger.debug('计算 "{}" 文件行数命令结果, 返回码: {}, 输出为: {}'.format(
-                                    csv_file_path, return_code, stdout.strip()))
-                                csv_file_line = int(stdout.strip())
-                                debug_logger.info('计算 "{}" 文件行数结束, 一共 "{}" 行'.format(csv_file_path, csv_file_line))
-
-                            # 进度条 对象
-                            progress_bar = ProgressBar(total_line=csv_file_line, description='正在插入数据: ')
-
-                            count = 1
-                            for all_cols in line:
-                                # 跳过空行
-                                if all_cols:
-                                    if count == 1:
-                                        # 第一行，获取所有数据的列名, 然后创建数据库表
-                                        columns_str =  ", ".join(all_cols)
-
-                                        debug_logger.debug('create table {}'.format(table_name))
-                                        create_result = database.create_table(table_name=table_name, table_column_list=all_cols)
-                                        if create_result == 'True':
-                                            debug_logger.info('create table {} successful'.format(table_name))
-                                            ColorFormatter.success('创建表 "{}" 成功'.format(table_name))
-                                        elif 'already exists' or 'Duplicate column name' in create_result:
-                                            debug_logger.warning('table "{}" has been existed'.format(table_name))
-                                            ColorFormatter.info('表 "{}" 已经存在'.format(table_name))
-                                        else:
-                                            debug_logger.error('create table "{}" failed'.format(table_name))
-                                            error_logger.error('create table "{}" failed'.format(table_name))
-                                            ColorFormatter.error('创建表 "{}" 失败'.format(table_name))
-
-                                    else:
-                                        # 不为第一行
-                                        #  剔除 \r\n 的列
-                                        all_cols = escape_file_string(all_cols)
-                                        # 将每一列的数据拼成一行
-                                        data_list = ', '.join(['"{}"'.format(_) for _ in all_cols])
-                                        database.insert_data(table_name=table_name, column_list=columns_str,
-                                                             data_list=data_list, skip_error=opts.skip_error)
-
-                                    progress_bar.handle_progress()
-                                    count += + 1
-
-                            # 事务提交, 插入数据
-                            debug_logger.debug('execute insert sql commit')
-                            database.execute_commit()
-                            debug_logger.info('execute insert sql commit successful')
-
-                            # 输出插入数据总共用时
-                            end_time = time.time()
-                            print(colored('总共用时: {:.2f}秒'.format(end_time - start_time), 'white'))
-
-                        r.close()
+
+                        # 断点续传, 单进程的时候整个文件就是一段
+                        checkpoint = Checkpoint(csv_file_path, table_name)
+                        saved_records = load_checkpoint(checkpoint, opts.resume, debug_logger)
+                        file_size = os.path.getsize(csv_file_path)
+                        if saved_records and (list(saved_records) != [0] or saved_records[0]['end'] != file_size):
+                            # 上一次是用 -f 分段导入的, 从第一段提交到的位置读到文件结尾的话, 其他段已经提交的数据
+                            # 会再插入一次
+                            ColorFormatter.fatal('文件 "{}" 上一次是用 -f 分段导入的, 请用 -f --resume 继续导入'.format(
+                                csv_file_path))
+                            debug_logger.error('checkpoint of "{}" has {} chunks, resume it with -f'.format(
+                                csv_file_path, len(saved_records)))
+                            sys.exit(1)
+                        resume_record = saved_records.get(0)
+                        if not resume_record:
+                            checkpoint.save(0, file_size, 0, 0, 0)
+
+                        ColorFormatter.info('开始计算csv文件 {} 的行数'.format(csv_file_path))
+                        debug_logger.info('开始计算csv文件 {} 的行数'.format(csv_file_path))
+                        # 计算 csv 文件的行
+                        try:
+                            with database.timer.phase('count'):
+                                csv_file_line = count_lines(csv_file_path, threads=COUNT_THREADS)
+                        except OSError as e:
+                            ColorFormatter.error('计算csv文件 "{}" 行数时出错, 出错信息为: {}'.format(csv_file_path, e))
+                            debug_logger.error('计算csv文件 "{}" 行数时出错, 出错信息为: {}'.format(csv_file_path, e))
+                            error_logger.error('计算csv文件 "{}" 行数时出错, 出错信息为: {}'.format(csv_file_path, e))
+                            # 异常退出
+                            sys.exit(1)
+                        else:
+                            ColorFormatter.info('计算 "{}" 文件行数结束, 一共 "{}" 行'.format(csv_file_path, csv_file_line))
+                            debug_logger.info('计算 "{}" 文件行数结束, 一共 "{}" 行'.format(csv_file_path, csv_file_line))
+
+                        # 进度条 对象, 续传的时候只显示剩下的行
+                        if resume_record:
+                            csv_file_line -= resume_record['lines']
+                        progress_bar = ProgressBar(total_line=max(1, csv_file_line), description='正在插入数据: ')
+
+                        # 去重的时候不记录 checkpoint, 见 insert_csv_range
+                        deduper = Deduper(columns, **dedupe_config) if dedupe_config else None
+                        insert_csv_range(csv_file_path, 0, file_size, database, table_name, columns, debug_logger,
+                                         error_logger, skip_error=opts.skip_error,
+                                         checkpoint=None if deduper else checkpoint,
+                                         resume_record=resume_record, progress_bar=progress_bar, deduper=deduper)
+
+                        # 输出插入数据总共用时
+                        end_time = time.time()
+                        print(colored('总共用时: {:.2f}秒'.format(end_time - start_time), 'white'))
 
                         ColorFormatter.success('插入数据完成')
                         debug_logger.info('insert data to database done')
 
                         # 显示汇总信息
-                        ColorFormatter.info('总共插入 "{}" 条数据, 成功 "{}" 条, 失败 "{}" 条'.format(
+                        ColorFormatter.info('总共插入 "{}" 条数据, 成功 "{}" 条, 失败 "{}" 条, 提交事务 "{}" 次'.format(
                             database.insert_total_count,
                             database.insert_success_count,
-                            database.insert_failed_count
+                            database.insert_failed_count,
+                            database.commit_count
                         ))
-                        debug_logger.info('总共插入 "{}" 条数据, 成功 "{}" 条, 失败 "{}" 条'.format(
+                        debug_logger.info('总共插入 "{}" 条数据, 成功 "{}" 条, 失败 "{}" 条, 提交事务 "{}" 次'.format(
                             database.insert_total_count,
                             database.insert_success_count,
-                            database.insert_failed_count
+                            database.insert_failed_count,
+                            database.commit_count
                         ))
+                        if deduper:
+                            show_duplicates(deduper.duplicate_count, debug_logger)
+                            deduper.close()
 
+                if not finish_load(database, table_name, index_config, debug_logger, error_logger):
+                    sys.exit(1)
                 # 安全退出
                 sys.exit(0)
 
@@ -594,10 +1816,78 @@ def main():
 
                 if separator == '\\t':
                     separator = '\t'
+
+                # 可以是一个文件, 一个目录或者一个 glob 表达式, 标准输入和命名管道不展开
+                if is_stream_source(txt_files):
+                    txt_file_list = [txt_files]
+                else:
+                    txt_file_list = expand_input_files(txt_files, suffix='.txt')
+
+                if len(txt_file_list) == 1 and is_stream_source(txt_file_list[0]):
+                    # 标准输入, 命名管道或者压缩文件, 只能顺序读取
+                    if opts.fast or opts.pipeline or opts.resume:
+                        ColorFormatter.warning('流式读取的时候不支持 -f, --pipeline 和 --resume, 忽略这些选项')
+                        debug_logger.warning('-f, --pipeline and --resume are not supported for streaming input')
+                    if not import_stream(txt_file_list[0], 'txt', table_name, column_list, separator, database, writer_config,
+                                         debug_logger, error_logger, skip_error=skip_error,
+                                         schema_config=schema_config, dedupe_config=dedupe_config):
+                        sys.exit(1)
+                    if not finish_load(database, table_name, index_config, debug_logger, error_logger):
+                        sys.exit(1)
+                    # 正常退出程序
+                    sys.exit(0)
+
+                if not txt_file_list:
+                    debug_logger.warning('File "{}" not exists'.format(txt_files))
+                    ColorFormatter.fatal('File "{}" not exists'.format(txt_files))
+                    sys.exit(1)
+
+                if not check_dedupe_columns(column_list, dedupe_config, debug_logger, error_logger):
+                    sys.exit(1)
+
+                # 用最大的文件的开头推断列类型
+                sample = sample_file(txt_file_list[0], 'txt', separator, column_list, schema_config)
+                column_types = resolve_column_types(column_list, sample, schema_config, debug_logger,
+                                                    database_config=database_config)
+
+                if len(txt_file_list) > 1:
+                    # 一次导入多个文件, 只创建一次数据库表
+                    if not create_csv_table(database, table_name, column_list, debug_logger, error_logger,
+                                            column_types=column_types):
+                        sys.exit(1)
+                    if not import_files(txt_file_list, 'txt', table_name, column_list, separator,
+                                        max(1, opts.workers or 1), database_config, logger, debug_logger,
+                                        error_logger, skip_error=skip_error, resume=opts.resume,
+                                        dedupe_config=dedupe_config,
+                                        stall_timeout=opts.stall_timeout):
+                        sys.exit(1)
+                    if not finish_load(database, table_name, index_config, debug_logger, error_logger):
+                        sys.exit(1)
+                    # 正常退出程序
+                    sys.exit(0)
+
+                txt_files = txt_file_list[0]
+                # 多进程模式的配置
+                fast_config = None
+                if opts.fast:
+                    fast_config = {
+                        'worker_count': opts.workers,
+                        'chunk_size': opts.chunk_size,
+                        'resume': opts.resume,
+                        'database_config': database_config,
+                        'logger': logger,
+                        'log_level': log_level,
+                        'stall_timeout': opts.stall_timeout,
+                    }
                 insert_txt_to_database(txt_files=txt_files, separator=separator, database_obj=database,
                                        column_list=column_list, debug_logger=debug_logger, error_logger=error_logger,
-                                       table_name=table_name, skip_error=skip_error)
+                                       table_name=table_name, skip_error=skip_error,
+                                       pipeline_config=pipeline_config, log_level=log_level,
+                                       writer_config=writer_config, fast_config=fast_config,
+                                       column_types=column_types, dedupe_config=dedupe_config)
 
+                if not finish_load(database, table_name, index_config, debug_logger, error_logger):
+                    sys.exit(1)
                 # 正常退出程序
                 sys.exit(0)
 
@@ -615,6 +1905,8 @@ def main():
                     os.remove(os.path.join(LOG_PATH, 'debug.log'))
                 except:
                     pass
+                # 断点续传的 checkpoint 也一起清除
+                shutil.rmtree(CHECKPOINT_PATH, ignore_errors=True)
                 ColorFormatter.success('Clean log cache successful')
                 debug_logger.info('Clean log cache success')
 
@@ -0,0 +1,83 @@
+# encoding: utf8
+#!/usr/bin/env python3
+"""
+测试都使用 SQLite backend, 不需要数据库服务器. 日志, reject 文件和 checkpoint 写到临时目录, 不会在仓库里留下 logs/ 和
+checkpoint/
+"""
+import sqlite3
+import pytest
+import lib.Logger
+import lib.checkpoint
+import lib.database
+from lib.Logger import Logger
+from lib.database import Database
+from lib.settings import TABLE_NAME
+
+
+@pytest.fixture(scope='session', autouse=True)
+def log_path(tmp_path_factory):
+    """所有测试共用一个日志目录, Logger 的 listener 在整个进程中只启动一次"""
+    path = tmp_path_factory.mktemp('logs')
+    lib.Logger.LOG_PATH = str(path)
+    return path
+
+
+@pytest.fixture(autouse=True)
+def checkpoint_path(tmp_path, monkeypatch):
+    path = tmp_path / 'checkpoint'
+    monkeypatch.setattr(lib.checkpoint, 'CHECKPOINT_PATH', str(path))
+    return path
+
+
+@pytest.fixture(autouse=True)
+def reject_path(tmp_path, monkeypatch):
+    """没有指定 reject_file 的 Database 对象写的 reject 文件"""
+    path = tmp_path / 'rejects.jsonl'
+    monkeypatch.setattr(lib.database, 'REJECT_FILE', str(path))
+    return path
+
+
+@pytest.fixture
+def logger():
+    return Logger(log_level='DEBUG')
+
+
+@pytest.fixture
+def database_path(tmp_path):
+    return str(tmp_path / 'test.sqlite3')
+
+
+@pytest.fixture
+def make_database(logger, database_path):
+    """
+    创建连接到同一个 SQLite 文件的 Database 对象, 参数和 move_to_database.py 中的 database_config 一样,
+    测试结束的时候全部关闭
+    """
+
+    database_list = []
+
+    def make(**database_config):
+        database_config.setdefault('backend', 'sqlite')
+        database_obj = Database(host=None, logger=logger, database=database_path, **database_config)
+        database_list.append(database_obj)
+        return database_obj
+
+    yield make
+    for database_obj in database_list:
+        if database_obj.conn is not None:
+            database_obj.close()
+        database_obj.pool.close_all()
+
+
+@pytest.fixture
+def fetch_rows(database_path):
+    """用一个新的连接读取已经提交的数据, 按插入的顺序排列"""
+
+    def fetch(table_name=TABLE_NAME):
+        conn = sqlite3.connect(database_path)
+        try:
+            return conn.execute('SELECT * FROM {} ORDER BY rowid'.format(table_name)).fetchall()
+        finally:
+            conn.close()
+
+    return fetch
@@ -0,0 +1,91 @@
+# encoding: utf8
+#!/usr/bin/env python3
+import os
+import pytest
+from lib.checkpoint import Checkpoint
+from lib.settings import TABLE_NAME
+from move_to_database import insert_csv_range
+
+COLUMNS = ['id', 'name', 'email']
+ROW_COUNT = 237
+
+
+class Crash(Exception):
+    pass
+
+
+def write_csv(path):
+    """CRLF 换行, 中间有空行, 数据中有中文, 这样 checkpoint 的字节位置和行号都不能只按行数计算"""
+    lines = [','.join(COLUMNS)]
+    for i in range(1, ROW_COUNT + 1):
+        lines.append('{},名字{},user{}@example.com'.format(i, i, i))
+        if i % 50 == 0:
+            lines.append('')
+    with open(path, 'wb') as w:
+        w.write('\r\n'.join(lines).encode('utf8') + b'\r\n')
+
+
+def crash_after(database_obj, rows):
+    """插入 rows 行之后再插入就抛出异常, 就像进程在导入的过程中被杀掉"""
+    insert_data = database_obj.insert_data
+    count = [0]
+
+    def insert(**kwargs):
+        count[0] += 1
+        if count[0] > rows:
+            raise Crash()
+        return insert_data(**kwargs)
+
+    database_obj.insert_data = insert
+
+
+@pytest.mark.parametrize('vectorize', [False, True])
+def test_resume_inserts_every_row_exactly_once(make_database, fetch_rows, logger, tmp_path, vectorize):
+    if vectorize:
+        pytest.importorskip('numpy')
+    debug_logger, error_logger = logger.get_logger('debug_logger'), logger.get_logger('error_logger')
+    csv_path = str(tmp_path / 'dump.csv')
+    write_csv(csv_path)
+    file_size = os.path.getsize(csv_path)
+    database_config = {'batch_size': 10, 'commit_every': 25, 'vectorize': vectorize}
+
+    database_obj = make_database(**database_config)
+    database_obj.create_table(table_name=TABLE_NAME, table_column_list=COLUMNS)
+    checkpoint = Checkpoint(csv_path, TABLE_NAME)
+    checkpoint.save(0, file_size, 0, 0, 0)
+    crash_after(database_obj, 175)
+    with pytest.raises(Crash):
+        insert_csv_range(csv_path, 0, file_size, database_obj, TABLE_NAME, COLUMNS, debug_logger, error_logger,
+                         checkpoint=checkpoint)
+    # 没有提交的数据随着进程一起丢掉
+    database_obj.conn.rollback()
+    database_obj.close()
+
+    record = Checkpoint(csv_path, TABLE_NAME).load()[0]
+    assert record['committed_rows'] == 150
+    assert not record['done']
+    assert len(fetch_rows()) == 150
+
+    database_obj = make_database(**database_config)
+    checkpoint = Checkpoint(csv_path, TABLE_NAME)
+    insert_csv_range(csv_path, 0, file_size, database_obj, TABLE_NAME, COLUMNS, debug_logger, error_logger,
+                     checkpoint=checkpoint, resume_record=checkpoint.load()[0])
+
+    assert fetch_rows() == [(str(i), '名字{}'.format(i), 'user{}@example.com'.format(i))
+                            for i in range(1, ROW_COUNT + 1)]
+    record = checkpoint.load()[0]
+    assert record['done']
+    assert record['offset'] == file_size
+    assert record['committed_rows'] == ROW_COUNT
+    assert record['success_rows'] == ROW_COUNT
+
+
+def test_checkpoint_of_modified_file_is_ignored(tmp_path):
+    csv_path = str(tmp_path / 'dump.csv')
+    write_csv(csv_path)
+    Checkpoint(csv_path, TABLE_NAME).save(0, os.path.getsize(csv_path), 100, 5, 4)
+    assert Checkpoint(csv_path, TABLE_NAME).load()
+
+    with open(csv_path, 'ab') as w:
+        w.write(b'1000,new,new@example.com\r\n')
+    assert Checkpoint(csv_path, TABLE_NAME).load() == {}
@@ -0,0 +1,75 @@
+# encoding: utf8
+#!/usr/bin/env python3
+import random
+import pytest
+from lib.clean import clean_file_string, clean_txt_line, clean_csv_batch, clean_txt_batch, vectorize_rows, \
+    vectorize_supported
+
+pytest.importorskip('numpy')
+
+# 脏数据里面会出现的字符: 坏字符, 空格, 常见的分隔符和中文
+DIRTY_CHARS = ['a', 'b', '1', ' ', ' ', '\r', '\t', '\n', '|', ',', '中', 'é']
+
+
+def dirty_field(rng, newline=True):
+    chars = DIRTY_CHARS if newline else [_ for _ in DIRTY_CHARS if _ != '\n']
+    return ''.join([rng.choice(chars) for _ in range(rng.randint(0, 8))])
+
+
+def csv_rows(rng, count, newline=False, same_width=False):
+    width = rng.randint(1, 6)
+    return [[dirty_field(rng, newline) for _ in range(width if same_width else rng.randint(1, 6))]
+            for _ in range(count)]
+
+
+def txt_lines(rng, count, separator, newline=False):
+    lines = []
+    for _ in range(count):
+        fields = [dirty_field(rng, newline) for _ in range(rng.randint(0, 7))]
+        line = separator.join(fields)
+        # 开头和结尾的空格, 以及连续的分隔符 (空的列)
+        lines.append(rng.choice(['', ' ', '  ']) + line + rng.choice(['', ' ', separator * 2]))
+    return lines
+
+
+@pytest.mark.parametrize('seed', range(5))
+@pytest.mark.parametrize('same_width', [False, True])
+@pytest.mark.parametrize('newline', [False, True])
+def test_clean_csv_batch_matches_clean_file_string(seed, same_width, newline):
+    rows = csv_rows(random.Random(seed), 200, newline=newline, same_width=same_width)
+    assert clean_csv_batch(rows) == [clean_file_string(_) for _ in rows]
+
+
+@pytest.mark.parametrize('seed', range(5))
+@pytest.mark.parametrize('separator', ['|', '\t', ',', ' '])
+@pytest.mark.parametrize('column_count', [1, 3, 5])
+@pytest.mark.parametrize('newline', [False, True])
+def test_clean_txt_batch_matches_clean_txt_line(seed, separator, column_count, newline):
+    lines = txt_lines(random.Random(seed), 200, separator, newline=newline)
+    assert clean_txt_batch(lines, separator, column_count) == \
+        [clean_txt_line(_, separator, column_count) for _ in lines]
+
+
+def test_clean_txt_batch_of_clean_lines():
+    # 每一行的列数都对的时候走 reshape 的捷径
+    lines = ['{0}|名字{0}| user{0} '.format(i) for i in range(100)]
+    assert clean_txt_batch(lines, '|', 3) == [clean_txt_line(_, '|', 3) for _ in lines]
+
+
+def test_clean_csv_batch_of_empty_batch():
+    assert clean_csv_batch([]) == []
+
+
+def test_vectorize_rows_keeps_order_across_batches():
+    rng = random.Random(0)
+    rows = csv_rows(rng, 1000)
+    items = [(i, i * 10, row) for i, row in enumerate(rows)]
+    result = list(vectorize_rows(items, clean_csv_batch, batch_rows=64))
+    assert result == [(i, i * 10, clean_file_string(row)) for i, row in enumerate(rows)]
+
+
+def test_vectorize_supported_separators():
+    assert vectorize_supported()
+    assert vectorize_supported('|')
+    assert not vectorize_supported('||')
+    assert not vectorize_supported('\n')
@@ -0,0 +1,260 @@
+# encoding: utf8
+#!/usr/bin/env python3
+import sqlite3
+from lib.backends.sqlite import SQLiteBackend
+from lib.reject import iter_rejects
+from lib.settings import TABLE_NAME
+
+COLUMNS = 'id, name'
+
+
+def create_test_table(database_obj):
+    database_obj.execute_command('CREATE TABLE {} (id integer PRIMARY KEY, name text NOT NULL)'.format(TABLE_NAME))
+
+
+def insert_rows(database_obj, rows, column_list=COLUMNS):
+    """按顺序插入 rows, 行号从 1 开始, 返回 insert_data 返回 True 的行号"""
+    committed_lines = []
+    for line_number, row in enumerate(rows, 1):
+        if database_obj.insert_data(table_name=TABLE_NAME, column_list=column_list, data_list=row, skip_error=True,
+                                    line_number=line_number):
+            committed_lines.append(line_number)
+    return committed_lines
+
+
+def test_rows_are_sent_in_batches(make_database, fetch_rows):
+    database_obj = make_database(batch_size=10)
+    create_test_table(database_obj)
+
+    insert_rows(database_obj, [[str(i), 'name{}'.format(i)] for i in range(1, 26)])
+    # 最后不满一批的 5 行还在缓冲区里
+    assert database_obj.insert_total_count == 20
+    assert len(database_obj.batch_rows) == 5
+
+    assert database_obj.execute_commit()
+    assert database_obj.insert_success_count == 25
+    assert fetch_rows() == [(i, 'name{}'.format(i)) for i in range(1, 26)]
+
+
+def test_failed_batch_is_bisected(make_database, fetch_rows):
+    database_obj = make_database(batch_size=16)
+    create_test_table(database_obj)
+
+    # 主键重复的行, 每一批都只有这几行插入失败, 同一批的其他行照样插入
+    bad_lines = [5, 17, 18, 40]
+    insert_rows(database_obj, [['1', 'duplicate'] if i in bad_lines else [str(i), 'name{}'.format(i)]
+                               for i in range(1, 51)])
+    assert database_obj.execute_commit()
+
+    good_lines = [_ for _ in range(1, 51) if _ not in bad_lines]
+    assert fetch_rows() == [(_, 'name{}'.format(_)) for _ in good_lines]
+    assert database_obj.insert_success_count == len(good_lines)
+    assert database_obj.insert_failed_count == len(bad_lines)
+    assert database_obj.insert_total_count == 50
+
+
+def test_failed_batch_is_bisected_into_reject_file(make_database, reject_path):
+    database_obj = make_database(batch_size=16)
+    create_test_table(database_obj)
+    database_obj.source_file = 'dump.csv'
+
+    bad_lines = [5, 17, 18, 40]
+    insert_rows(database_obj, [['1', 'duplicate'] if i in bad_lines else [str(i), 'name{}'.format(i)]
+                               for i in range(1, 51)])
+    assert database_obj.execute_commit()
+
+    records = [record for _, record in iter_rejects(str(reject_path))]
+    assert [_['line'] for _ in records] == bad_lines
+    for record in records:
+        assert record['table'] == TABLE_NAME
+        assert record['columns'] == ['id', 'name']
+        assert record['source'] == 'dump.csv'
+        assert record['fields'] == ['1', 'duplicate']
+        assert record['code'] == 'SQLITE_CONSTRAINT_PRIMARYKEY'
+
+
+def test_rejects_are_written_when_their_rows_are_committed(make_database, reject_path):
+    database_obj = make_database(batch_size=10, commit_every=20)
+    create_test_table(database_obj)
+
+    def reject_lines():
+        return [record['line'] for _, record in iter_rejects(str(reject_path))] if reject_path.exists() else []
+
+    rows = [['1', 'duplicate'] if i in (3, 25, 47) else [str(i), 'name'] for i in range(1, 51)]
+    committed_lines = []
+    for line_number, row in enumerate(rows, 1):
+        if database_obj.insert_data(table_name=TABLE_NAME, column_list=COLUMNS, data_list=row, skip_error=True,
+                                    line_number=line_number):
+            committed_lines.append(line_number)
+            assert reject_lines() == [_ for _ in (3, 25, 47) if _ <= line_number]
+    assert committed_lines == [20, 40]
+    assert reject_lines() == [3, 25]
+
+    # 最后一个事务没有提交就关闭了, 例如进程崩溃, 它的 reject 记录也不写
+    database_obj.close()
+    assert reject_lines() == [3, 25]
+
+
+def test_wrong_column_count_is_not_sent(make_database, fetch_rows):
+    database_obj = make_database(batch_size=10)
+    create_test_table(database_obj)
+
+    insert_rows(database_obj, [['1', 'a'], ['2'], ['3', 'c', 'extra'], ['4', 'd']])
+    assert database_obj.execute_commit()
+    assert fetch_rows() == [(1, 'a'), (4, 'd')]
+    assert database_obj.insert_failed_count == 2
+
+
+def test_empty_strings_of_null_columns_are_inserted_as_null(make_database, fetch_rows):
+    database_obj = make_database(null_columns=['age'])
+    database_obj.execute_command('CREATE TABLE {} (name text, age integer, city text)'.format(TABLE_NAME))
+
+    insert_rows(database_obj, [['a', '', ''], ['', '3', 'x']], column_list='name, age, city')
+    assert database_obj.execute_commit()
+    # 只有 null_columns 中的列把空字符串换成 NULL
+    assert fetch_rows() == [('a', None, ''), ('', 3, 'x')]
+
+
+def test_commit_after_max_packet_size_does_not_include_current_row(make_database, fetch_rows):
+    database_obj = make_database(batch_size=1000, max_packet_size=200, commit_every=1)
+    create_test_table(database_obj)
+
+    for line_number in range(1, 101):
+        commit_count = database_obj.commit_count
+        # 缓冲区按字节数发送和提交的时候, 这一行还在缓冲区里, 所以不能返回 True
+        assert not database_obj.insert_data(table_name=TABLE_NAME, column_list=COLUMNS,
+                                            data_list=[str(line_number), 'name{}'.format(line_number)],
+                                            line_number=line_number)
+        if database_obj.commit_count > commit_count:
+            assert len(fetch_rows()) == line_number - 1
+            assert database_obj.committed_total_count == line_number - 1
+
+    assert database_obj.commit_count > 1
+    assert database_obj.execute_commit()
+    assert [_[0] for _ in fetch_rows()] == list(range(1, 101))
+
+
+def test_commit_every_is_aligned_to_batches(make_database, fetch_rows):
+    database_obj = make_database(batch_size=10, commit_every=25)
+    create_test_table(database_obj)
+
+    committed_lines = []
+    for line_number in range(1, 101):
+        if database_obj.insert_data(table_name=TABLE_NAME, column_list=COLUMNS,
+                                    data_list=[str(line_number), 'name'], line_number=line_number):
+            committed_lines.append(line_number)
+            # 返回 True 的时候这一行以及之前的数据都已经提交了, 别的连接可以看到
+            assert len(fetch_rows()) == line_number
+
+    # 每一批 10 行发送之后才检查, 所以提交的位置是批次的边界
+    assert committed_lines == [30, 60, 90]
+    assert database_obj.commit_count == 3
+    assert database_obj.committed_total_count == 90
+    assert database_obj.execute_commit()
+    assert len(fetch_rows()) == 100
+
+
+def test_commit_only_at_the_end_by_default(make_database, fetch_rows):
+    database_obj = make_database(batch_size=10)
+    create_test_table(database_obj)
+
+    assert insert_rows(database_obj, [[str(i), 'name'] for i in range(1, 101)]) == []
+    assert fetch_rows() == []
+    assert database_obj.execute_commit()
+    assert database_obj.commit_count == 1
+    assert len(fetch_rows()) == 100
+
+
+def test_undecodable_row_keeps_original_bytes_in_reject_file(make_database, fetch_rows, tmp_path):
+    reject_path = tmp_path / 'undecodable.jsonl'
+    database_obj = make_database(reject_file=str(reject_path))
+    create_test_table(database_obj)
+
+    name = b'bad\xff\xfe'.decode('utf8', 'surrogateescape')
+    assert not database_obj.insert_data(table_name=TABLE_NAME, column_list=COLUMNS, data_list=['1', name],
+                                        skip_error=True, line_number=1)
+    database_obj.insert_data(table_name=TABLE_NAME, column_list=COLUMNS, data_list=['2', 'good'], skip_error=True,
+                             line_number=2)
+    assert database_obj.execute_commit()
+
+    assert fetch_rows() == [(2, 'good')]
+    assert database_obj.insert_failed_count == 1
+    (_, record), = list(iter_rejects(str(reject_path)))
+    assert record['line'] == 1
+    assert record['code'] == 'decode_error'
+    assert record['fields'][1].encode('utf8', 'surrogateescape') == b'bad\xff\xfe'
+    assert b'bad\xff\xfe' in reject_path.read_bytes()
+
+
+def index_names(database_path):
+    conn = sqlite3.connect(database_path)
+    try:
+        return sorted([_[0] for _ in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = ?", (TABLE_NAME, ))])
+    finally:
+        conn.close()
+
+
+def test_indexes_are_built_after_the_load(make_database, database_path, fetch_rows):
+    database_obj = make_database(batch_size=10)
+    database_obj.create_table(table_name=TABLE_NAME, table_column_list=['id', 'name', 'age'])
+    assert index_names(database_path) == []
+
+    insert_rows(database_obj, [[str(i), 'name{}'.format(i % 5), str(i % 7)] for i in range(1, 51)],
+                column_list='id, name, age')
+    assert database_obj.execute_commit()
+    assert database_obj.add_indexes(TABLE_NAME, primary_key=['id'], indexes=[['name'], ['name', 'age']]) is True
+    assert index_names(database_path) == [TABLE_NAME + '_idx_name', TABLE_NAME + '_idx_name_age',
+                                          TABLE_NAME + '_pkey']
+
+
+def test_failed_index_keeps_the_data(make_database, fetch_rows):
+    database_obj = make_database()
+    database_obj.create_table(table_name=TABLE_NAME, table_column_list=['id', 'name'])
+    insert_rows(database_obj, [['1', 'a'], ['1', 'b']])
+    assert database_obj.execute_commit()
+
+    # 主键有重复的值, 返回错误信息, 数据已经导入了, 连接还可以继续使用
+    result = database_obj.add_indexes(TABLE_NAME, primary_key=['id'])
+    assert 'UNIQUE' in result
+    assert fetch_rows() == [('1', 'a'), ('1', 'b')]
+    assert database_obj.add_indexes(TABLE_NAME, indexes=[['name']]) is True
+
+
+class PragmaBackend(SQLiteBackend):
+    """用 PRAGMA 代替 MYSQL 的会话变量, no_such_pragma 读不到, 和没有权限的 sql_log_bin 一样被跳过"""
+
+    bulk_session_variables = (('cache_size', -4096), ('no_such_pragma', 1))
+
+    def variable_sql(self, name):
+        return 'SELECT {} AS value FROM pragma_{}'.format(name, name)
+
+    def set_variable_sql(self, name, value):
+        return 'PRAGMA {} = {}'.format(name, -2000 if value is None else value)
+
+
+def cache_size(database_obj):
+    return database_obj.execute_command('SELECT cache_size AS value FROM pragma_cache_size')[0]['value']
+
+
+def test_bulk_session_is_applied_and_restored(make_database):
+    database_obj = make_database(backend=PragmaBackend(), bulk_session=True)
+    original = database_obj.session_saved.get('cache_size')
+    assert original is not None
+    assert list(database_obj.session_saved) == ['cache_size']
+    assert list(database_obj.session_skipped) == ['no_such_pragma']
+    assert cache_size(database_obj) == -4096
+
+    assert database_obj.restore_session() == ['cache_size']
+    assert cache_size(database_obj) == original
+    assert database_obj.session_saved == {}
+
+
+def test_bulk_session_is_restored_before_the_connection_is_reused(make_database):
+    database_obj = make_database(backend=PragmaBackend(), bulk_session=True)
+    original = database_obj.session_saved['cache_size']
+    conn = database_obj.conn
+    database_obj.close()
+
+    # 连接还给连接池之前恢复了会话设置
+    assert conn.execute('SELECT cache_size AS value FROM pragma_cache_size').fetchone()['value'] == original
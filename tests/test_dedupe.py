@@ -0,0 +1,97 @@
+# encoding: utf8
+#!/usr/bin/env python3
+import os
+import sys
+import signal
+import sqlite3
+import subprocess
+import pytest
+from lib.dedupe import Deduper
+from lib.settings import TABLE_NAME
+
+MAIN_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'move_to_database.py')
+
+COLUMNS = ['id', 'email']
+
+
+def make_rows(count, unique):
+    """第 i 行的 email 是 user<i % unique>, 每个 email 第一次出现的行号是 1 到 unique"""
+    return [(i, [str(i), 'user{}@example.com'.format((i - 1) % unique)]) for i in range(1, count + 1)]
+
+
+def run_deduper(deduper, rows):
+    kept = [(line_number, row) for line_number, row in rows if deduper.check(row, line_number)]
+    return kept + list(deduper.drain())
+
+
+def test_spilled_partitions_are_deduplicated_on_drain(tmp_path):
+    # memory_limit 为 0 的时候内存中最多只有 PARTITION_COUNT 个 key, 很快就会写到磁盘上
+    deduper = Deduper(COLUMNS, key_columns=['email'], memory_limit=0, spill_dir=str(tmp_path))
+    kept = run_deduper(deduper, make_rows(2000, 500))
+
+    assert deduper.spilled_count() > 0
+    assert deduper.deferred_count > 0
+    assert deduper.duplicate_count == 1500
+    # 每个 email 只保留第一次出现的那一行
+    assert sorted([line_number for line_number, _ in kept]) == list(range(1, 501))
+    assert len(set([row[1] for _, row in kept])) == 500
+
+    deduper.close()
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_keys_are_kept_across_drains(tmp_path):
+    deduper = Deduper(COLUMNS, key_columns=['email'], memory_limit=0, spill_dir=str(tmp_path))
+    assert len(run_deduper(deduper, make_rows(1000, 300))) == 300
+
+    # 第二个文件中已经插入过的 email 都是重复的, 不管它的分区在内存中还是在磁盘上
+    second_rows = [(line_number + 1000, [str(line_number + 1000), row[1]])
+                   for line_number, row in make_rows(600, 600)]
+    kept = run_deduper(deduper, second_rows)
+    assert sorted([line_number for line_number, _ in kept]) == list(range(1301, 1601))
+    assert deduper.duplicate_count == 700 + 300
+    deduper.close()
+
+
+def test_whole_row_is_the_key_by_default():
+    deduper = Deduper(COLUMNS)
+    rows = [(1, ['1', 'a']), (2, ['1', 'b']), (3, ['1', 'a']), (4, ['2', 'a'])]
+    assert [line_number for line_number, _ in run_deduper(deduper, rows)] == [1, 2, 4]
+    assert deduper.spilled_count() == 0
+    deduper.close()
+
+
+def run_main(cwd, args, timeout=120):
+    """在 cwd 中运行 move_to_database.py, 超时的话结束它和它的子进程, 返回 (退出码, 输出)"""
+    process = subprocess.Popen([sys.executable, MAIN_PATH] + args, cwd=cwd, stdout=subprocess.PIPE,
+                               stderr=subprocess.STDOUT, start_new_session=True)
+    try:
+        output = process.communicate(timeout=timeout)[0]
+    except subprocess.TimeoutExpired:
+        os.killpg(process.pid, signal.SIGKILL)
+        output = process.communicate()[0]
+        pytest.fail('move_to_database.py {} did not finish in {} seconds:\n{}'.format(
+            ' '.join(args), timeout, output.decode('utf8', 'replace')[-2000:]))
+    return process.returncode, output.decode('utf8', 'replace')
+
+
+def test_fast_dedupe_with_several_writers_on_sqlite(tmp_path):
+    # 每个写入进程有自己的队列, SQLite 同一时间只能有一个写事务, 写入进程不提交的话会互相卡住
+    csv_path = str(tmp_path / 'dump.csv')
+    with open(csv_path, 'w') as w:
+        w.write('id,email\n')
+        for i in range(30000):
+            w.write('{},user{}@example.com\n'.format(i % 20000, i % 20000))
+
+    database_path = str(tmp_path / 'test.sqlite3')
+    returncode, output = run_main(str(tmp_path), ['--backend', 'sqlite', '-D', database_path, '-i', csv_path, '-f',
+                                                  '--workers', '2', '--dedupe', '--queue-size', '2',
+                                                  '--batch-size', '100'])
+    assert returncode == 0, output
+
+    conn = sqlite3.connect(database_path)
+    try:
+        assert conn.execute('SELECT count(*), count(DISTINCT id) FROM {}'.format(TABLE_NAME)).fetchone() == (
+            20000, 20000)
+    finally:
+        conn.close()
@@ -0,0 +1,135 @@
+# encoding: utf8
+#!/usr/bin/env python3
+import os
+import sqlite3
+import pytest
+from lib.database import Database
+from lib.file_list import expand_input_files
+from lib.reject import iter_rejects
+from lib.settings import TABLE_NAME
+from move_to_database import import_files
+
+COLUMNS = ['id', 'name']
+
+
+def write_file(path, size):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as w:
+        w.write(b'x' * size)
+    return path
+
+
+def test_single_file(tmp_path):
+    path = write_file(str(tmp_path / 'dump.txt'), 1)
+    # 直接指定的文件不检查后缀
+    assert expand_input_files(path, suffix='.csv') == [path]
+
+
+def test_folder_is_walked_by_suffix_largest_first(tmp_path):
+    small = write_file(str(tmp_path / 'a.csv'), 1)
+    large = write_file(str(tmp_path / 'sub' / 'b.CSV'), 30)
+    middle = write_file(str(tmp_path / 'sub' / 'deeper' / 'c.csv'), 20)
+    write_file(str(tmp_path / 'notes.txt'), 100)
+    write_file(str(tmp_path / '.hidden.csv'), 100)
+    write_file(str(tmp_path / '.git' / 'd.csv'), 100)
+
+    assert expand_input_files(str(tmp_path), suffix='.csv') == [large, middle, small]
+    assert len(expand_input_files(str(tmp_path))) == 4
+
+
+def test_suffix_is_matched_before_compressed_suffix(tmp_path):
+    plain = write_file(str(tmp_path / 'a.csv'), 30)
+    gzip_file = write_file(str(tmp_path / 'b.csv.gz'), 20)
+    bzip2_file = write_file(str(tmp_path / 'c.CSV.BZ2'), 10)
+    write_file(str(tmp_path / 'd.txt.gz'), 100)
+    write_file(str(tmp_path / 'e.gz'), 100)
+
+    assert expand_input_files(str(tmp_path), suffix='.csv') == [plain, gzip_file, bzip2_file]
+
+
+def test_glob(tmp_path):
+    first = write_file(str(tmp_path / '2020' / 'a.csv'), 10)
+    second = write_file(str(tmp_path / '2021' / 'b.csv'), 10)
+    write_file(str(tmp_path / '2021' / 'b.txt'), 10)
+
+    assert expand_input_files(str(tmp_path / '*' / '*.csv')) == [first, second]
+    assert expand_input_files(str(tmp_path / '**' / 'b.*')) == [second, str(tmp_path / '2021' / 'b.txt')]
+    assert expand_input_files(str(tmp_path / '*.json')) == []
+
+
+def write_txt(path, first_id, count, bad_ids=()):
+    """bad_ids 中的行的 id 和第一行重复"""
+    with open(path, 'w') as w:
+        for i in range(first_id, first_id + count):
+            w.write('{}|name{}\n'.format(first_id if i in bad_ids else i, i))
+    return path
+
+
+def crash_once_after(monkeypatch, marker_path, rows):
+    """第一次运行的子进程插入 rows 行之后异常退出, 重启的子进程正常运行"""
+    insert_data = Database.insert_data
+    count = [0]
+
+    def insert(self, **kwargs):
+        count[0] += 1
+        if count[0] > rows and not os.path.exists(marker_path):
+            open(marker_path, 'w').close()
+            os._exit(1)
+        return insert_data(self, **kwargs)
+
+    monkeypatch.setattr(Database, 'insert_data', insert)
+
+
+@pytest.fixture
+def txt_files(tmp_path):
+    return [write_txt(str(tmp_path / 'a.txt'), 1, 237), write_txt(str(tmp_path / 'b.txt'), 1001, 120)]
+
+
+@pytest.fixture
+def database_config(database_path, make_database):
+    make_database().create_table(table_name=TABLE_NAME, table_column_list=COLUMNS)
+    return {'host': None, 'database': database_path, 'backend': 'sqlite', 'batch_size': 10, 'commit_every': 25}
+
+
+def run_import_files(txt_files, database_config, logger, **kwargs):
+    return import_files(txt_files, 'txt', TABLE_NAME, COLUMNS, '|', 1, database_config, logger,
+                        logger.get_logger('debug_logger'), logger.get_logger('error_logger'), **kwargs)
+
+
+def test_file_of_crashed_worker_continues_from_checkpoint(txt_files, database_config, logger, fetch_rows,
+                                                          monkeypatch, tmp_path):
+    crash_once_after(monkeypatch, str(tmp_path / 'crashed'), 175)
+    assert run_import_files(txt_files, database_config, logger)
+    assert os.path.exists(str(tmp_path / 'crashed'))
+
+    # 重启的子进程从第一个文件提交到的位置继续, 已经提交的行不会再插入一次
+    ids = sorted([int(_[0]) for _ in fetch_rows()])
+    assert ids == list(range(1, 238)) + list(range(1001, 1121))
+
+
+def test_file_of_crashed_dedupe_worker_is_not_retried(txt_files, database_config, logger, fetch_rows,
+                                                      monkeypatch, tmp_path):
+    crash_once_after(monkeypatch, str(tmp_path / 'crashed'), 175)
+    dedupe_config = {'key_columns': [], 'memory_limit': 1024 * 1024, 'spill_dir': str(tmp_path)}
+    assert not run_import_files(txt_files, database_config, logger, dedupe_config=dedupe_config)
+
+    ids = sorted([int(_[0]) for _ in fetch_rows()])
+    # 第一个文件只有崩溃之前提交的 150 行, 没有重复的数据
+    assert ids == list(range(1, 151)) + list(range(1001, 1121))
+
+
+def test_rejects_of_crashed_worker_are_written_once(database_config, database_path, logger, fetch_rows, monkeypatch,
+                                                   tmp_path, reject_path):
+    connection = sqlite3.connect(database_path)
+    connection.execute('CREATE UNIQUE INDEX id_index ON {} (id)'.format(TABLE_NAME))
+    connection.close()
+    bad_ids = [7, 140, 160, 170, 200]
+    txt_files = [write_txt(str(tmp_path / 'a.txt'), 1, 237, bad_ids=bad_ids)]
+    # 崩溃的时候最后一次提交之后的 160 和 170 已经在 reject 缓冲区里了, 重启之后从 checkpoint 继续又会遇到它们
+    crash_once_after(monkeypatch, str(tmp_path / 'crashed'), 175)
+    assert run_import_files(txt_files, database_config, logger)
+    assert os.path.exists(str(tmp_path / 'crashed'))
+
+    assert [record['line'] for _, record in iter_rejects(str(reject_path))] == [
+        '{}:{}'.format(txt_files[0], _) for _ in bad_ids]
+    assert sorted([int(_[0]) for _ in fetch_rows()]) == [_ for _ in range(1, 238) if _ not in bad_ids]
@@ -0,0 +1,44 @@
+# encoding: utf8
+#!/usr/bin/env python3
+import pytest
+from lib.line_counter import count_lines
+
+
+@pytest.mark.parametrize('data, line_count', [
+    (b'', 0),
+    (b'\n', 1),
+    (b'a', 1),
+    (b'a\nb\n', 2),
+    # 最后一行没有换行符也算一行
+    (b'a\nb', 2),
+    (b'a\r\n\r\nb\r\n', 3),
+])
+def test_count_lines(tmp_path, data, line_count):
+    path = str(tmp_path / 'dump.txt')
+    with open(path, 'wb') as w:
+        w.write(data)
+    assert count_lines(path) == line_count
+
+
+@pytest.mark.parametrize('config', [
+    {'block_size': 7},
+    {'block_size': 7, 'threads': 4},
+    {'block_size': 7, 'use_mmap': True},
+    {'block_size': 1024, 'threads': 4},
+])
+def test_blocks_threads_and_mmap_count_the_same(tmp_path, config):
+    path = str(tmp_path / 'data dump (1).csv')
+    with open(path, 'wb') as w:
+        w.write(b''.join([b'%d,' % i + '名字'.encode('utf8') * (i % 7) + b'\n' for i in range(1000)]) + b'last')
+    assert count_lines(path, **config) == 1001
+
+
+def test_modified_file_is_counted_again(tmp_path):
+    path = str(tmp_path / 'dump.txt')
+    with open(path, 'wb') as w:
+        w.write(b'a\nb\n')
+    assert count_lines(path) == 2
+
+    with open(path, 'ab') as w:
+        w.write(b'c\n')
+    assert count_lines(path) == 3
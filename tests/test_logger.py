@@ -0,0 +1,84 @@
+# encoding: utf8
+#!/usr/bin/env python3
+import os
+import time
+import signal
+import uuid
+from multiprocessing import Process
+import lib.Logger
+from lib.Logger import Logger
+
+
+def read_log(log_path, name, text, timeout=10):
+    """listener 在另一个线程中写文件, 等到 text 出现在日志文件中, 返回文件内容"""
+    deadline = time.time() + timeout
+    while True:
+        path = str(log_path / name)
+        content = open(path).read() if os.path.exists(path) else ''
+        if text in content or time.time() > deadline:
+            return content
+        time.sleep(0.05)
+
+
+def log_in_child(text):
+    Logger(log_level='DEBUG').get_logger('debug_logger').info('child %s %s', text, os.getpid())
+
+
+def log_forever(text):
+    debug_logger = Logger(log_level='DEBUG').get_logger('debug_logger')
+    while True:
+        debug_logger.info('%s %s', text, 'x' * 10000)
+
+
+def run_process(target, *args):
+    process = Process(target=target, args=args)
+    process.start()
+    process.join(10)
+    return process
+
+
+def test_records_are_routed_by_logger_name(logger, log_path):
+    text = uuid.uuid4().hex
+    logger.get_logger('debug_logger').debug('debug %s', text)
+    logger.get_logger('error_logger').error('error %s', text)
+
+    assert 'error ' + text in read_log(log_path, 'error.log', 'error ' + text)
+    debug_log = read_log(log_path, 'debug.log', 'debug ' + text)
+    assert 'debug ' + text in debug_log
+    assert 'error ' + text not in debug_log
+
+
+def test_level_is_respected(log_path):
+    text = uuid.uuid4().hex
+    debug_logger = Logger(log_level='WARNING').get_logger('debug_logger')
+    debug_logger.info('info %s', text)
+    debug_logger.warning('warning %s', text)
+    assert 'info ' + text not in read_log(log_path, 'debug.log', 'warning ' + text)
+    Logger(log_level='DEBUG')
+
+
+def test_child_records_are_written_by_main_process(logger, log_path):
+    listener = lib.Logger.LOG_LISTENER
+    text = uuid.uuid4().hex
+    process = run_process(log_in_child, text)
+    assert process.exitcode == 0
+    assert 'child {} {}'.format(text, process.pid) in read_log(log_path, 'debug.log', text)
+    # 子进程里创建 Logger 不会启动新的 listener
+    assert lib.Logger.LOG_LISTENER is listener
+
+
+def test_child_killed_while_logging_does_not_block_others(logger, log_path):
+    # 子进程在写日志记录的中间被 kill, 其他进程的日志和退出都不受影响
+    process = Process(target=log_forever, args=(uuid.uuid4().hex, ))
+    process.start()
+    time.sleep(0.5)
+    os.kill(process.pid, signal.SIGKILL)
+    process.join()
+
+    text = uuid.uuid4().hex
+    process = run_process(log_in_child, text)
+    assert process.exitcode == 0
+    assert text in read_log(log_path, 'debug.log', text)
+
+    logger.get_logger('debug_logger').info('main %s', text)
+    assert 'main ' + text in read_log(log_path, 'debug.log', 'main ' + text)
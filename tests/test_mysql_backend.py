@@ -0,0 +1,86 @@
+# encoding: utf8
+#!/usr/bin/env python3
+"""
+不连接 MYSQL 服务器, 用一个记录发送的语句的 pymysql 连接检查 MySQLBackend 批量写入的语句
+"""
+import pytest
+
+pymysql = pytest.importorskip('pymysql')
+
+from lib.backends import get_backend
+
+TEMPLATE = 'INSERT INTO test_table (id, name) VALUES (%s, %s)'
+
+
+class QueryResult(object):
+    def __init__(self, affected_rows):
+        self.affected_rows = affected_rows
+        self.warning_count = 0
+        self.description = None
+        self.insert_id = 0
+        self.rows = None
+
+
+class RecordingConnection(pymysql.connections.Connection):
+    """只保留转义需要的属性, query 只记录语句, 不发送"""
+
+    def __init__(self):
+        self.encoding = 'utf8'
+        self.charset = 'utf8'
+        self.encoders = pymysql.converters.encoders
+        self.server_status = 0
+        self.queries = []
+        self._result = None
+
+    def query(self, sql, unbuffered=False):
+        if isinstance(sql, (bytes, bytearray)):
+            sql = bytes(sql).decode(self.encoding)
+        self.queries.append(sql)
+        self._result = QueryResult(sql.count('),') + 1 if sql.startswith('INSERT') else 0)
+        return self._result.affected_rows
+
+
+@pytest.fixture
+def backend():
+    return get_backend('mysql')
+
+
+@pytest.fixture
+def conn():
+    return RecordingConnection()
+
+
+def test_batch_is_sent_as_one_statement(backend, conn):
+    cursor = backend.open_cursor(conn)
+    rows = [[str(i), 'name{}'.format(i) * 1000] for i in range(200)]
+
+    backend.write_batch(cursor, TEMPLATE, 'test_table', 'id, name', rows)
+    # 一批就是一条多行 INSERT 语句, 没有 savepoint, 超过 pymysql 默认的 max_stmt_length 也不拆开
+    assert len(conn.queries) == 1
+    assert conn.queries[0].startswith('INSERT INTO test_table (id, name) VALUES (')
+    assert cursor.rowcount == 200
+
+
+def test_statement_size_matches_sent_statement(backend, conn):
+    cursor = backend.open_cursor(conn)
+    rows = [['1', "it's"], ['2', None], ['3', '中文\\']]
+
+    size = backend.statement_size(TEMPLATE) + sum(backend.row_size(cursor, TEMPLATE, _) for _ in rows)
+    backend.write_batch(cursor, TEMPLATE, 'test_table', 'id, name', rows)
+    # 最后一行不需要连接用的 , 所以多算了一个字节
+    assert size == len(conn.queries[0].encode('utf8')) + 1
+
+
+def test_one_alter_table_builds_all_indexes(backend):
+    column_types = {'id': 'int', 'email': 'varchar(64)', 'bio': 'text'}
+    assert backend.index_sql_list('test_table', ['id'], [['email'], ['email', 'bio']], column_types) == [
+        'ALTER TABLE test_table ADD PRIMARY KEY (id), ADD INDEX idx_email (email), '
+        'ADD INDEX idx_email_bio (email, bio(255))']
+    assert backend.index_sql_list('test_table', None, [], column_types) == []
+
+
+def test_bulk_session_sql(backend):
+    assert [_[0] for _ in backend.bulk_session_variables] == ['unique_checks', 'foreign_key_checks', 'sql_log_bin']
+    assert backend.set_variable_sql('unique_checks', 0) == 'SET SESSION unique_checks = 0'
+    # 读不到原来的值的变量恢复为全局的默认值
+    assert backend.set_variable_sql('sql_log_bin', None) == 'SET SESSION sql_log_bin = DEFAULT'
@@ -0,0 +1,103 @@
+# encoding: utf8
+#!/usr/bin/env python3
+import os
+import logging
+import pytest
+from lib.database import ConnectionPool
+from lib.pipeline import Pipeline, ThreadWriter
+from lib.settings import TABLE_NAME
+from lib.split_file import split_file
+from move_to_database import iter_csv_rows
+
+COLUMNS = ['id', 'name']
+ROW_COUNT = 1000
+
+test_logger = logging.getLogger('test_pipeline')
+
+
+@pytest.fixture
+def csv_path(tmp_path):
+    path = str(tmp_path / 'dump.csv')
+    with open(path, 'w') as w:
+        w.write('id,name\n')
+        for i in range(1, ROW_COUNT + 1):
+            w.write('{},name{}\n'.format(i, i))
+    return path
+
+
+@pytest.fixture
+def database_config(database_path, make_database):
+    """和 move_to_database.py 中的 database_config 一样, 表已经创建好了"""
+    make_database().create_table(table_name=TABLE_NAME, table_column_list=COLUMNS)
+    return {'host': None, 'database': database_path, 'backend': 'sqlite', 'batch_size': 50}
+
+
+def expected_rows(count=ROW_COUNT):
+    return [(str(i), 'name{}'.format(i)) for i in range(1, count + 1)]
+
+
+def run_pipeline(csv_path, database_config, logger, parser_count=2, writer_count=2, **pipeline_config):
+    pipeline = Pipeline(parser_count=parser_count, writer_count=writer_count, batch_size=30,
+                        database_config=database_config, logger=logger, debug_logger=test_logger,
+                        error_logger=test_logger, **pipeline_config)
+    ranges = split_file(csv_path, 'WARNING', split_count=parser_count)
+    return pipeline, pipeline.run(csv_path, ranges, iter_csv_rows, (False, ), TABLE_NAME, COLUMNS,
+                                  tick_interval=0.1)
+
+
+@pytest.mark.parametrize('parser_count, writer_count', [(1, 1), (2, 2), (3, 1)])
+def test_pipeline_inserts_every_row_once(csv_path, database_config, logger, fetch_rows, parser_count, writer_count):
+    pipeline, failed_stages = run_pipeline(csv_path, database_config, logger, parser_count=parser_count,
+                                           writer_count=writer_count, queue_size=2)
+    assert failed_stages == []
+    assert sorted(fetch_rows(), key=lambda _: int(_[0])) == expected_rows()
+    assert pipeline.total_lines() == ROW_COUNT
+    assert pipeline.total_success() == ROW_COUNT
+    assert pipeline.total_failed() == 0
+    assert pipeline.total_bytes() == os.path.getsize(csv_path)
+
+
+def test_pipeline_stops_parsers_when_writers_exit(csv_path, database_config, logger):
+    # 写入进程创建 Database 的时候就失败了, 队列很快就满了, 解析进程不能一直阻塞在队列上
+    database_config['backend'] = 'unknown'
+    pipeline, failed_stages = run_pipeline(csv_path, database_config, logger, queue_size=1)
+    assert 'writer 1' in failed_stages
+    assert 'writer 2' in failed_stages
+    assert pipeline.total_success() == 0
+
+
+def run_thread_writer(csv_path, database_config, logger, pool, thread_count=2):
+    writer = ThreadWriter(thread_count=thread_count, queue_size=1, batch_size=30, database_config=database_config,
+                          logger=logger, pool=pool, debug_logger=test_logger, error_logger=test_logger)
+    rows = iter_csv_rows(csv_path, 0, os.path.getsize(csv_path))
+    positions = []
+    failed_threads = writer.run(rows, TABLE_NAME, COLUMNS, on_progress=positions.append, source_file=csv_path)
+    return writer, failed_threads, positions
+
+
+@pytest.mark.parametrize('thread_count', [1, 3])
+def test_thread_writer_inserts_every_row_once(csv_path, database_config, logger, fetch_rows, thread_count):
+    pool = ConnectionPool(host=None, database=database_config['database'], pool_size=thread_count, backend='sqlite')
+    writer, failed_threads, positions = run_thread_writer(csv_path, database_config, logger, pool,
+                                                          thread_count=thread_count)
+    assert failed_threads == []
+    assert sorted(fetch_rows(), key=lambda _: int(_[0])) == expected_rows()
+    assert writer.total_success() == ROW_COUNT
+    assert writer.total_failed() == 0
+    assert writer.total_commit() == thread_count
+    # 每放进队列一批就报告一次解析到的位置
+    assert len(positions) == ROW_COUNT // 30
+    assert positions == sorted(positions)
+    # 所有连接都还给了连接池
+    assert pool.idle_connections.qsize() == pool.created_count
+    pool.close_all()
+
+
+def test_thread_writer_stops_parsing_when_threads_exit(csv_path, database_config, logger):
+    database_config['backend'] = 'unknown'
+    pool = ConnectionPool(host=None, database=database_config['database'], pool_size=2, backend='sqlite')
+    writer, failed_threads, positions = run_thread_writer(csv_path, database_config, logger, pool)
+    assert sorted(failed_threads) == [1, 2]
+    assert writer.total_success() == 0
+    # 队列满了之后就不再解析
+    assert len(positions) < ROW_COUNT // 30
@@ -0,0 +1,155 @@
+# encoding: utf8
+#!/usr/bin/env python3
+"""
+不连接 PostgreSQL 服务器, 用一个模拟 PostgreSQL 事务的连接检查 PostgreSQLBackend 和 Database: 事务中任何一条语句失败之后
+整个事务都不能用了, 只能 ROLLBACK 或者 ROLLBACK TO SAVEPOINT
+"""
+import pytest
+
+psycopg2 = pytest.importorskip('psycopg2')
+import psycopg2.errors
+
+from lib.database import Database
+from lib.reject import iter_rejects
+from lib.settings import TABLE_NAME
+
+COLUMNS = ['id', 'name']
+
+
+class FakeConnection(object):
+    """committed 是已经提交的行, pending 是事务中写入还没有提交的行"""
+
+    def __init__(self):
+        self.committed = []
+        self.pending = []
+        self.savepoints = []
+        self.aborted = False
+        self.statements = []
+        # 执行的时候失败的语句和抛出的异常, 例如 {'DROP TABLE t': psycopg2.errors.UndefinedTable('...')}
+        self.failing = {}
+
+    def cursor(self, cursor_factory=None):
+        return FakeCursor(self)
+
+    def commit(self):
+        if self.aborted:
+            raise psycopg2.errors.InFailedSqlTransaction('current transaction is aborted')
+        self.committed.extend(self.pending)
+        self.pending = []
+        self.savepoints = []
+
+    def rollback(self):
+        self.pending = []
+        self.savepoints = []
+        self.aborted = False
+
+
+class FakeCursor(object):
+    def __init__(self, conn):
+        self.conn = conn
+        self.result = []
+
+    def execute(self, sql):
+        conn = self.conn
+        conn.statements.append(sql)
+        if sql.startswith('ROLLBACK TO SAVEPOINT '):
+            name = sql.split()[-1]
+            while conn.savepoints[-1][0] != name:
+                conn.savepoints.pop()
+            del conn.pending[conn.savepoints[-1][1]:]
+            conn.aborted = False
+            return
+        if conn.aborted:
+            raise psycopg2.errors.InFailedSqlTransaction('current transaction is aborted')
+        if sql.startswith('SAVEPOINT '):
+            conn.savepoints.append((sql.split()[-1], len(conn.pending)))
+        elif sql.startswith('RELEASE SAVEPOINT '):
+            conn.savepoints.pop()
+        elif sql in conn.failing:
+            conn.aborted = True
+            raise conn.failing[sql]
+        self.result = [{'value': 'on'}] if sql.startswith('SELECT') else []
+
+    def fetchall(self):
+        return self.result
+
+    def copy_expert(self, sql, file):
+        if self.conn.aborted:
+            raise psycopg2.errors.InFailedSqlTransaction('current transaction is aborted')
+        rows = [line.split('\t') for line in file.read().splitlines()]
+        if any(_[1] == 'duplicate' for _ in rows):
+            self.conn.aborted = True
+            raise psycopg2.errors.UniqueViolation('duplicate key value violates unique constraint')
+        self.conn.pending.extend([int(_[0]) for _ in rows])
+
+
+class FakePool(object):
+    def __init__(self, conn):
+        self.conn = conn
+
+    def get_connection(self, timeout=None):
+        return self.conn
+
+    def release_connection(self, conn):
+        pass
+
+    def close_all(self):
+        pass
+
+
+@pytest.fixture
+def conn():
+    return FakeConnection()
+
+
+@pytest.fixture
+def make_database(logger, conn):
+    def make(**database_config):
+        return Database(host=None, logger=logger, database='test', backend='postgresql', pool=FakePool(conn),
+                        **database_config)
+
+    return make
+
+
+def insert_rows(database_obj, first_id, count, bad_ids=()):
+    for i in range(first_id, first_id + count):
+        database_obj.insert_data(table_name=TABLE_NAME, column_list=', '.join(COLUMNS), skip_error=True,
+                                 data_list=[str(i), 'duplicate' if i in bad_ids else 'name{}'.format(i)],
+                                 line_number=i)
+
+
+def test_failed_batch_is_bisected_into_reject_file(make_database, conn, reject_path):
+    database_obj = make_database(batch_size=8)
+    insert_rows(database_obj, 1, 30, bad_ids=[5, 6, 21])
+    assert database_obj.execute_commit()
+
+    # 失败的 COPY 只回滚它自己的 savepoint, 同一个事务中前面写入的批次还在
+    assert conn.committed == [_ for _ in range(1, 31) if _ not in (5, 6, 21)]
+    records = [record for _, record in iter_rejects(str(reject_path))]
+    assert [_['line'] for _ in records] == [5, 6, 21]
+    assert {_['code'] for _ in records} == {'UniqueViolation'}
+    assert not [_ for _ in conn.statements if _ == 'ROLLBACK']
+
+
+def test_failed_statements_do_not_roll_back_pending_rows(make_database, conn):
+    database_obj = make_database(batch_size=5, bulk_session=True)
+    insert_rows(database_obj, 1, 10)
+    create_table_sql = database_obj.backend.create_table_sql(TABLE_NAME, COLUMNS, {})
+    conn.failing = {
+        create_table_sql: psycopg2.errors.DuplicateTable('relation "test_table" already exists'),
+        'DROP TABLE missing_table': psycopg2.errors.UndefinedTable('table "missing_table" does not exist'),
+        'ALTER TABLE test_table ADD PRIMARY KEY (id)': psycopg2.errors.UniqueViolation('could not create index'),
+        "SET synchronous_commit TO 'on'": psycopg2.errors.InsufficientPrivilege('permission denied'),
+    }
+
+    # 表已经存在, 继续往里面插入数据
+    assert 'already exists' in database_obj.create_table(TABLE_NAME, COLUMNS)
+    insert_rows(database_obj, 11, 10)
+    assert database_obj.drop_table('missing_table') is False
+    assert database_obj.restore_session() == []
+    assert conn.pending == list(range(1, 21))
+
+    assert database_obj.add_indexes(TABLE_NAME, primary_key=['id'], indexes=[['name']]) == 'could not create index'
+    assert database_obj.execute_commit()
+    assert conn.committed == list(range(1, 21))
+    database_obj.close()
@@ -0,0 +1,73 @@
+# encoding: utf8
+#!/usr/bin/env python3
+import os
+import lib.reject
+from lib.reject import RejectFile, iter_rejects
+
+
+def write_records(reject_file, first_line, count):
+    for line_number in range(first_line, first_line + count):
+        reject_file.write('test_table', ['id', 'name'], 'dump.csv', line_number, [str(line_number), 'x'], 1366,
+                          'Incorrect integer value')
+
+
+def lines_of(path):
+    if not os.path.exists(path):
+        return []
+    return [record['line'] for _, record in iter_rejects(path)]
+
+
+def test_records_are_written_only_on_flush(tmp_path):
+    path = str(tmp_path / 'rejects.jsonl')
+    reject_file = RejectFile(path)
+    write_records(reject_file, 1, 3)
+    assert lines_of(path) == []
+
+    reject_file.flush()
+    assert lines_of(path) == [1, 2, 3]
+    reject_file.flush()
+    assert lines_of(path) == [1, 2, 3]
+    reject_file.close()
+
+
+def test_pending_records_are_spooled_to_a_temporary_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(lib.reject, 'REJECT_BUFFER_SIZE', 10)
+    monkeypatch.setattr(lib.reject, 'REJECT_WRITE_SIZE', 500)
+    path = str(tmp_path / 'rejects.jsonl')
+    reject_file = RejectFile(path)
+    write_records(reject_file, 1, 95)
+    assert reject_file.spool is not None
+    assert len(reject_file.buffer) == 5
+    assert lines_of(path) == []
+
+    reject_file.flush()
+    assert reject_file.spool is None
+    assert lines_of(path) == list(range(1, 96))
+    reject_file.close()
+
+
+def test_close_discards_records_that_were_not_flushed(tmp_path, monkeypatch):
+    monkeypatch.setattr(lib.reject, 'REJECT_BUFFER_SIZE', 10)
+    path = str(tmp_path / 'rejects.jsonl')
+    reject_file = RejectFile(path)
+    write_records(reject_file, 1, 5)
+    reject_file.flush()
+
+    write_records(reject_file, 6, 25)
+    reject_file.close()
+    assert lines_of(path) == [1, 2, 3, 4, 5]
+
+
+def test_two_writers_append_whole_lines(tmp_path, monkeypatch):
+    monkeypatch.setattr(lib.reject, 'REJECT_WRITE_SIZE', 300)
+    path = str(tmp_path / 'rejects.jsonl')
+    first, second = RejectFile(path), RejectFile(path)
+    write_records(first, 1, 20)
+    write_records(second, 101, 20)
+    second.flush()
+    first.flush()
+    first.close()
+    second.close()
+
+    # 每一行都是完整的 JSON
+    assert sorted(lines_of(path)) == list(range(1, 21)) + list(range(101, 121))
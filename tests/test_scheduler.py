@@ -0,0 +1,91 @@
+# encoding: utf8
+#!/usr/bin/env python3
+import os
+import time
+import logging
+from multiprocessing import Array
+import pytest
+from lib.scheduler import ChunkScheduler, iter_tasks
+
+logger = logging.getLogger('test_scheduler')
+
+
+def run_worker(worker_index, task_queue, result_pipe, path, behavior, heartbeats=None):
+    """
+    每个任务在 path 中写一个 <task_id>.<次数> 文件, 然后按 behavior 处理:
+    crash_once / hang_once 第一次异常退出 / 卡住, crash 每次都异常退出, slow 慢慢处理但一直有进度
+    """
+
+    for task_id, task in iter_tasks(worker_index, task_queue, result_pipe):
+        attempt = len([_ for _ in os.listdir(path) if _.split('.')[0] == str(task_id)]) + 1
+        open(os.path.join(path, '{}.{}'.format(task_id, attempt)), 'w').close()
+        action = behavior.get(task_id)
+        if action == 'crash' or (action == 'crash_once' and attempt == 1):
+            os._exit(1)
+        if action == 'hang_once' and attempt == 1:
+            time.sleep(3600)
+        if action == 'slow':
+            for _ in range(10):
+                time.sleep(0.1)
+                heartbeats[task_id] = time.time()
+
+
+def attempts(path):
+    """每个任务执行的次数"""
+    result = {}
+    for name in os.listdir(str(path)):
+        task_id = int(name.split('.')[0])
+        result[task_id] = result.get(task_id, 0) + 1
+    return result
+
+
+def make_scheduler(path, behavior, worker_count=2, **kwargs):
+    return ChunkScheduler(worker_target=run_worker, worker_args=(str(path), behavior) + kwargs.pop('args', ()),
+                          worker_count=worker_count, debug_logger=logger, error_logger=logger, **kwargs)
+
+
+def test_every_task_runs_once(tmp_path):
+    scheduler = make_scheduler(tmp_path, {}, worker_count=3)
+    done, failed = scheduler.run([(i, None) for i in range(10)], tick_interval=0.1)
+    assert done == set(range(10))
+    assert failed == set()
+    assert attempts(tmp_path) == {i: 1 for i in range(10)}
+    assert scheduler.restart_count == 0
+
+
+def test_task_of_crashed_worker_is_retried(tmp_path):
+    scheduler = make_scheduler(tmp_path, {3: 'crash_once'})
+    done, failed = scheduler.run([(i, None) for i in range(6)], tick_interval=0.1)
+    assert done == set(range(6))
+    assert failed == set()
+    assert attempts(tmp_path)[3] == 2
+    assert scheduler.restart_count == 1
+
+
+def test_task_is_given_up_after_max_retry(tmp_path):
+    scheduler = make_scheduler(tmp_path, {1: 'crash'}, max_retry=2)
+    done, failed = scheduler.run([(i, None) for i in range(4)], tick_interval=0.1)
+    assert done == {0, 2, 3}
+    assert failed == {1}
+    assert attempts(tmp_path)[1] == 3
+
+
+def test_stalled_worker_is_terminated_and_task_retried(tmp_path):
+    scheduler = make_scheduler(tmp_path, {2: 'hang_once'}, stall_timeout=1)
+    start_time = time.time()
+    done, failed = scheduler.run([(i, None) for i in range(4)], tick_interval=0.1)
+    assert done == set(range(4))
+    assert failed == set()
+    assert attempts(tmp_path)[2] == 2
+    assert time.time() - start_time < 30
+
+
+def test_worker_with_heartbeat_is_not_terminated(tmp_path):
+    heartbeats = Array('d', 2, lock=False)
+    scheduler = make_scheduler(tmp_path, {0: 'slow', 1: 'slow'}, stall_timeout=0.5, args=(heartbeats, ),
+                               heartbeat=lambda task_id: heartbeats[task_id])
+    done, failed = scheduler.run([(0, None), (1, None)], tick_interval=0.1)
+    # 一个任务要处理 1 秒, 比 stall_timeout 长, 但是一直有进度
+    assert done == {0, 1}
+    assert attempts(tmp_path) == {0: 1, 1: 1}
+    assert scheduler.restart_count == 0
@@ -0,0 +1,103 @@
+# encoding: utf8
+#!/usr/bin/env python3
+import logging
+import pytest
+from lib.schema import DEFAULT_COLUMN_TYPE, infer_column_types, null_columns_of, parse_column_types
+from lib.settings import TABLE_NAME
+from move_to_database import resolve_column_types, sample_file
+
+test_logger = logging.getLogger('test_schema')
+
+
+def infer(values, margin=2.0):
+    return infer_column_types(['c'], [[_] for _ in values], margin=margin)['c']
+
+
+@pytest.mark.parametrize('values, column_type', [
+    (['1', '-20', '+3', ''], 'int'),
+    (['1', '2000000000'], 'bigint'),
+    # 乘以余量之后超过 INT 的范围
+    (['1100000000'], 'bigint'),
+    # 19 位的数字可能超过 BIGINT 的范围
+    (['1234567890123456789'], 'varchar(38)'),
+    # 0 开头的数字保留开头的 0
+    (['1', '007'], 'varchar(16)'),
+    (['2020-01-31', ''], 'date'),
+    (['2020-01-31 12:00:00', '2020-02-01T00:00:59'], 'datetime'),
+    (['2020-02-30'], 'varchar(20)'),
+    (['2020-01-31', '2020-01-31 12:00:00'], 'varchar(38)'),
+    (['a' * 100], 'varchar(200)'),
+    (['a' * 151], 'text'),
+    (['', ''], DEFAULT_COLUMN_TYPE),
+    ([], DEFAULT_COLUMN_TYPE),
+])
+def test_infer_column_type(values, column_type):
+    assert infer(values) == column_type
+
+
+def test_margin():
+    assert infer(['a' * 100], margin=1.0) == 'varchar(100)'
+    assert infer(['1100000000'], margin=1.0) == 'int'
+
+
+def test_short_rows_do_not_fail():
+    assert infer_column_types(['a', 'b'], [['1'], ['2', 'x']]) == {'a': 'int', 'b': 'varchar(16)'}
+
+
+def test_null_columns_are_the_non_string_columns():
+    column_types = {'id': 'int', 'day': 'date', 'name': 'varchar(16)', 'note': 'TEXT', 'code': 'char(2)',
+                    'price': 'decimal(10,2)'}
+    assert sorted(null_columns_of(column_types)) == ['day', 'id', 'price']
+
+
+def test_parse_column_types():
+    assert parse_column_types(['id=bigint unsigned', ' price = decimal(10, 2) ', 'name=VARCHAR(64)']) == {
+        'id': 'bigint unsigned', 'price': 'decimal(10, 2)', 'name': 'VARCHAR(64)'}
+    assert parse_column_types(None) == {}
+
+
+@pytest.mark.parametrize('spec', ['id', '=int', 'id=int; DROP TABLE x', 'id=varchar(a)'])
+def test_invalid_column_type(spec):
+    with pytest.raises(ValueError):
+        parse_column_types([spec])
+
+
+@pytest.fixture
+def csv_path(tmp_path):
+    path = str(tmp_path / 'dump.csv')
+    with open(path, 'w') as w:
+        w.write('id,day,name\n')
+        for i in range(1, 101):
+            w.write('{},2020-01-{:02d},{}\n'.format(i, i % 28 + 1, 'x' * (i % 10)))
+        # 样本之外的行
+        w.write(',,{}\n'.format('y' * 100))
+    return path
+
+
+def schema_config(**kwargs):
+    config = {'infer': True, 'sample_rows': 1000, 'sample_bytes': 1024 * 1024, 'margin': 2.0, 'overrides': {}}
+    config.update(kwargs)
+    return config
+
+
+def test_sample_is_limited_by_rows_and_bytes(csv_path):
+    columns = ['id', 'day', 'name']
+    assert len(sample_file(csv_path, 'csv', None, columns, schema_config(sample_rows=10))) == 10
+    assert len(sample_file(csv_path, 'csv', None, columns, schema_config(sample_bytes=200))) < 20
+    assert sample_file(csv_path, 'csv', None, columns, schema_config(infer=False)) == []
+
+
+def test_inferred_table_inserts_empty_values_as_null(csv_path, make_database, fetch_rows):
+    columns = ['id', 'day', 'name']
+    config = schema_config(sample_rows=100, overrides={'name': 'text', 'missing': 'int'})
+    database_config = {}
+    column_types = resolve_column_types(columns, sample_file(csv_path, 'csv', None, columns, config), config,
+                                        test_logger, database_config=database_config)
+    assert column_types == {'id': 'int', 'day': 'date', 'name': 'text'}
+    assert sorted(database_config['null_columns']) == ['day', 'id']
+
+    database_obj = make_database(null_columns=database_config['null_columns'])
+    database_obj.create_table(table_name=TABLE_NAME, table_column_list=columns, column_types=column_types)
+    database_obj.insert_data(table_name=TABLE_NAME, column_list=', '.join(columns), data_list=['', '', ''])
+    assert database_obj.execute_commit()
+    assert fetch_rows() == [(None, None, '')]
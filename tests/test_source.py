@@ -0,0 +1,74 @@
+# encoding: utf8
+#!/usr/bin/env python3
+import os
+import io
+import sys
+import pytest
+from lib.source import COMPRESSED_SUFFIXES, StreamSource, is_stream_source, read_source_range, \
+    strip_compressed_suffix
+
+DATA = b'id,name\r\n1,\xe5\x90\x8d\xe5\xad\x97\n\n2,b\xffc\r\n3,last'
+LINES = ['id,name', '1,名字', '', '2,b\udcffc', '3,last']
+
+
+def write_source(tmp_path, suffix):
+    path = str(tmp_path / 'dump.csv{}'.format(suffix))
+    module = COMPRESSED_SUFFIXES.get(suffix)
+    with (module.open(path, 'wb') if module else open(path, 'wb')) as w:
+        w.write(DATA)
+    return path
+
+
+@pytest.mark.parametrize('suffix', ['', '.gz', '.bz2', '.xz'])
+def test_stream_source_lines(tmp_path, suffix):
+    path = write_source(tmp_path, suffix)
+    source = StreamSource(path)
+    lines = list(source.iter_lines())
+    source.close()
+
+    assert [line for _, line in lines] == LINES
+    # 进度是已经读取的 (压缩) 字节数, 读完的时候就是文件的大小
+    assert source.total_size == os.path.getsize(path)
+    assert [consumed for consumed, _ in lines] == sorted([consumed for consumed, _ in lines])
+    assert source.consumed == os.path.getsize(path)
+
+
+def test_stdin(monkeypatch):
+    monkeypatch.setattr(sys, 'stdin', io.TextIOWrapper(io.BytesIO(DATA)))
+    source = StreamSource('-')
+    assert [line for _, line in source.iter_lines()] == LINES
+    assert source.total_size is None
+    assert source.consumed == len(DATA)
+    source.close()
+
+
+def test_is_stream_source(tmp_path):
+    assert is_stream_source('-')
+    assert is_stream_source(write_source(tmp_path, '.gz'))
+    assert not is_stream_source(write_source(tmp_path, ''))
+    # 不存在的文件不是, 由 expand_input_files 当作 glob 展开
+    assert not is_stream_source(str(tmp_path / 'missing.csv.gz'))
+
+    fifo_path = str(tmp_path / 'pipe')
+    os.mkfifo(fifo_path)
+    assert is_stream_source(fifo_path)
+
+
+@pytest.mark.parametrize('name, expected', [
+    ('dump.csv.gz', 'dump.csv'),
+    ('dump.TXT.XZ', 'dump.TXT'),
+    ('dump.csv', 'dump.csv'),
+    ('dump.gz.csv', 'dump.gz.csv'),
+])
+def test_strip_compressed_suffix(name, expected):
+    assert strip_compressed_suffix(name) == expected
+
+
+@pytest.mark.parametrize('suffix', ['', '.gz', '.bz2'])
+def test_read_source_range(tmp_path, suffix):
+    path = write_source(tmp_path, suffix)
+    lines = list(read_source_range(path, 0, os.path.getsize(path)))
+    assert [line for _, _, line in lines] == LINES
+    # 每一行从上一行结束的位置开始, 最后一行结束的位置是文件的大小
+    assert [start for start, _, _ in lines[1:]] == [end for _, end, _ in lines[:-1]]
+    assert lines[-1][1] == os.path.getsize(path)
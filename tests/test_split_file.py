@@ -0,0 +1,78 @@
+# encoding: utf8
+#!/usr/bin/env python3
+import random
+import pytest
+from lib.split_file import split_file, read_file_range, normalize_line, find_undecodable
+
+
+def write_lines(path, rng, count):
+    """长度不一样的行, 有 CRLF, 空行, 中文和行中间的 \\r"""
+    lines = []
+    for i in range(count):
+        line = '{}|{}'.format(i, rng.choice(['', 'a' * rng.randint(1, 300), '名字' * rng.randint(1, 50), 'x\ry']))
+        lines.append(line.encode('utf8') + rng.choice([b'\n', b'\r\n']))
+    with open(path, 'wb') as w:
+        w.write(b''.join(lines))
+    return [normalize_line(_) for _ in lines]
+
+
+@pytest.mark.parametrize('split_count', [1, 2, 3, 7, 16, 64])
+def test_ranges_are_aligned_to_newlines(tmp_path, split_count):
+    path = str(tmp_path / 'dump.txt')
+    lines = write_lines(path, random.Random(split_count), 500)
+    with open(path, 'rb') as r:
+        data = r.read()
+
+    ranges = split_file(path, 'WARNING', split_count=split_count)
+    assert 1 <= len(ranges) <= split_count
+    # 连续地覆盖整个文件
+    assert ranges[0][0] == 0
+    assert ranges[-1][1] == len(data)
+    assert all([end == next_start for (_, end), (next_start, _) in zip(ranges, ranges[1:])])
+    assert all([start < end for start, end in ranges])
+    # 每一段都从一行的开头开始
+    assert all([data[start - 1:start] == b'\n' for start, _ in ranges[1:]])
+
+    read_lines = []
+    for start, end in ranges:
+        read_lines.extend([line for _, _, line in read_file_range(path, start, end)])
+    assert read_lines == lines
+
+
+def test_split_point_on_newline_does_not_skip_a_line(tmp_path):
+    # 每一行 10 个字节, 分割的位置刚好落在换行符后面
+    path = str(tmp_path / 'dump.txt')
+    with open(path, 'wb') as w:
+        w.write(b''.join([b'%08d\r\n' % i for i in range(10)]))
+    ranges = split_file(path, 'WARNING', split_count=5)
+    assert ranges == [(0, 20), (20, 40), (40, 60), (60, 80), (80, 100)]
+    assert [line for start, end in ranges for _, _, line in read_file_range(path, start, end)] == \
+        ['%08d' % i for i in range(10)]
+
+
+def test_read_file_range_positions(tmp_path):
+    path = str(tmp_path / 'dump.txt')
+    with open(path, 'wb') as w:
+        w.write(b'a\r\nbb\n\nccc')
+    assert list(read_file_range(path, 0, 10)) == [(0, 3, 'a'), (3, 6, 'bb'), (6, 7, ''), (7, 10, 'ccc')]
+    # 从 end 开始的行不会被读取
+    assert list(read_file_range(path, 3, 7)) == [(3, 6, 'bb'), (6, 7, '')]
+
+
+@pytest.mark.parametrize('line, expected', [
+    (b'a|b\n', 'a|b'),
+    (b'a|b\r\n', 'a|b'),
+    (b'a|b', 'a|b'),
+    # 行中间单独的 \r (^M) 也去掉
+    (b'a\r|b\r\r\n', 'a|b'),
+    (b'\r\n', ''),
+])
+def test_normalize_line(line, expected):
+    assert normalize_line(line) == expected
+
+
+def test_undecodable_bytes_are_kept():
+    line = normalize_line(b'1|\xe5\x90\x8d\xff\r\n')
+    assert line.encode('utf8', 'surrogateescape') == b'1|\xe5\x90\x8d\xff'
+    assert find_undecodable(line.split('|')) == "'utf8' codec can't decode byte 0xff in column 2"
+    assert find_undecodable(['1', '名字', '', None]) is None
@@ -0,0 +1,156 @@
+# encoding: utf8
+#!/usr/bin/env python3
+import os
+import json
+import time
+import pstats
+from multiprocessing import Process
+import pytest
+from lib.settings import TABLE_NAME
+from lib.stats import HISTOGRAM_BUCKETS, PhaseTimer, StageProfiler, cprofile_dump, histogram_percentile, \
+    merge_profile, merge_stats, write_stats
+
+
+class Clock(object):
+    """代替 time.perf_counter, 只有调用 advance 的时候时间才会前进"""
+
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(time, 'perf_counter', clock)
+    return clock
+
+
+def test_phase_timer_accumulates(clock):
+    timer = PhaseTimer()
+    for seconds in (0.5, 0.25):
+        with timer.phase('insert'):
+            clock.advance(seconds)
+    with pytest.raises(ValueError):
+        with timer.phase('commit'):
+            clock.advance(1)
+            raise ValueError()
+    assert timer.phases == {'insert': 0.75, 'commit': 1}
+
+
+def test_nested_stages_record_their_own_time(clock):
+    profiler = StageProfiler()
+
+    def read():
+        clock.advance(0.001)
+        return 'line'
+
+    def parse(lines):
+        with profiler.stage('parse'):
+            clock.advance(0.002)
+            line = profiler.wrap(read, 'read')()
+            clock.advance(0.002)
+            return line
+
+    rows = []
+    for line in profiler.iterate([parse(None) for _ in range(3)], 'format'):
+        with profiler.stage('execute'):
+            clock.advance(0.01)
+            rows.append(line)
+
+    result = profiler.to_dict()
+    # parse 不包括里面的 read
+    assert result['seconds'] == {'read': 0.003, 'parse': 0.012, 'format': 0.0, 'execute': 0.03}
+    assert result['calls'] == {'read': 3, 'parse': 3, 'format': 3, 'execute': 3}
+    # 1000 微秒在 [512, 1024) 这一格, 10000 微秒在 [8192, 16384) 这一格
+    assert result['histograms']['read'][10] == 3
+    assert result['histograms']['execute'][14] == 3
+    assert result['histograms']['format'][0] == 3
+    assert all(len(_) == HISTOGRAM_BUCKETS for _ in result['histograms'].values())
+
+
+def test_histogram_percentile():
+    histogram = [0] * HISTOGRAM_BUCKETS
+    histogram[3], histogram[10] = 90, 10
+    assert histogram_percentile(histogram, 50) == 8
+    assert histogram_percentile(histogram, 90) == 8
+    assert histogram_percentile(histogram, 99) == 1024
+    assert histogram_percentile([0] * HISTOGRAM_BUCKETS, 50) == 0
+
+
+def write_worker_stats(path, rows):
+    profiler = StageProfiler()
+    profiler.add('execute', 0.5)
+    profiler.add('parse', 0.25)
+    write_stats(path, 'worker', {'insert': 1.5, 'commit': 0.5}, rows=rows, success=rows - 1, failed=1, commits=2,
+                profile=profiler.to_dict())
+
+
+def test_records_of_several_processes_are_merged(tmp_path):
+    path = str(tmp_path / 'stats' / 'stats.jsonl')
+    processes = [Process(target=write_worker_stats, args=(path, 100 * (i + 1))) for i in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    write_stats(path, 'split', {'split': 0.25})
+    write_stats(None, 'split', {'split': 0.25})
+
+    records = [json.loads(_) for _ in open(path)]
+    assert len(records) == 5
+    assert {_['pid'] for _ in records[:4]} == {_.pid for _ in processes}
+
+    merged = merge_stats(path)
+    assert merged['records'] == 5
+    assert merged['phases'] == {'count': 0.0, 'split': 0.25, 'insert': 6.0, 'commit': 2.0}
+    assert (merged['rows'], merged['success'], merged['failed'], merged['commits']) == (1000, 996, 4, 8)
+    assert merged['max_rss_kb'] > 0
+
+    report = merge_profile(path)
+    assert report['bottleneck'] == 'execute'
+    assert len(report['processes']) == 4
+    assert report['stages']['execute']['seconds'] == 2.0
+    assert report['stages']['execute']['calls'] == 4
+    assert report['stages']['execute']['percent'] == pytest.approx(66.67)
+    assert report['stages']['parse']['mean_us'] == 250000
+
+
+def test_missing_stats_file(tmp_path):
+    path = str(tmp_path / 'missing.jsonl')
+    assert merge_stats(path)['records'] == 0
+    assert merge_profile(path) == {'stages': {}, 'bottleneck': None, 'processes': []}
+
+
+def test_cprofile_dump(tmp_path):
+    profile = {'dir': str(tmp_path / 'profile'), 'cprofile': True}
+    with cprofile_dump(profile, 'worker'):
+        sorted(range(1000), key=lambda _: -_)
+    path = os.path.join(profile['dir'], 'worker_{}.prof'.format(os.getpid()))
+    assert pstats.Stats(path).total_calls > 0
+
+    with cprofile_dump({'dir': str(tmp_path / 'off'), 'cprofile': False}, 'worker'):
+        pass
+    with cprofile_dump(None, 'worker'):
+        pass
+    assert not os.path.exists(str(tmp_path / 'off'))
+
+
+def test_database_writes_its_stats_on_close(make_database, tmp_path):
+    path = str(tmp_path / 'stats.jsonl')
+    database_obj = make_database(batch_size=10, stats_file=path, profile={'dir': str(tmp_path), 'cprofile': False})
+    database_obj.create_table(table_name=TABLE_NAME, table_column_list=['id', 'name'])
+    for i in range(25):
+        database_obj.insert_data(table_name=TABLE_NAME, column_list='id, name', data_list=[str(i), 'name'])
+    assert database_obj.execute_commit()
+    database_obj.close()
+
+    record = json.loads(open(path).read())
+    assert record['role'] == 'database'
+    assert (record['rows'], record['success'], record['failed']) == (25, 25, 0)
+    assert set(record['phases']) == {'insert', 'commit'}
+    assert record['profile']['calls']['execute'] == 3